@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the pygs upload and read paths, run offline against
+pygs.fake_service. For each frame shape it reports the time and peak
+Python memory of:
+
+    serialize   pytools.serialize_df, and the old cleanDF + values.tolist()
+    encode      serializing and JSON encoding every upload chunk, in this
+                process and, with --processes, in pools of worker processes
+    upload      update_sheet_with_df into an existing sheet
+    read        read_google_sheet of the same sheet, into pandas and, with
+                pyarrow installed, into an Arrow table, and read_changes of it
+                when nothing changed
+
+plus the time taken by `import pygs` in a fresh interpreter, and the cold
+first-call cost of loading the discovery document and building the service
+from it, with the document cached on disk and without (fetched over the
+network, reported as unavailable offline).
+
+    python benchmarks/bench_pygs.py --max-cells 1000000 --latency 0.05
+    python benchmarks/bench_pygs.py --max-cells 5000000 --processes 1,2,4,8
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import pygs
+from pygs import fake_service
+from pygs import pygs_tools as pytools
+from pygs import arrow_tools
+from pygs import process_pool
+
+CELL_COUNTS = [10000, 100000, 1000000, 5000000]
+SHAPES = [('tall', 10), ('wide', 200)]
+
+
+def mixed_frame(rows, cols):
+    # cycles through int, float with gaps, string, datetime and bool columns
+    data = {}
+    for col in range(cols):
+        kind = col % 5
+        if kind == 0:
+            values = np.arange(rows)
+        elif kind == 1:
+            values = np.random.rand(rows)
+            values[::7] = np.nan
+        elif kind == 2:
+            values = np.array(['value {}'.format(x % 1000) for x in range(rows)], dtype=object)
+        elif kind == 3:
+            values = pd.date_range('2020-01-01', periods=rows, freq='min')
+        else:
+            values = np.arange(rows) % 2 == 0
+        data['col_{}'.format(col)] = values
+    return pd.DataFrame(data)
+
+
+def measure(func):
+    # (seconds, peak MB) from two runs, so tracing doesn't skew the timing
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024.0 / 1024.0
+
+
+def old_serialize(df):
+    df = pytools.cleanDF(df)
+    return [df.columns.tolist()] + df.values.tolist()
+
+
+def encode_in_process(df):
+    paste_data = pytools.serialize_df(df)
+    return [json.dumps(piece['values'])
+            for chunk in pytools.pack_chunks([('Data', 1, paste_data)], pytools.CHUNK_CELLS, pytools.CHUNK_BYTES)
+            for piece in chunk]
+
+
+def encode_in_processes(df, processes):
+    return [chunk[0]['encoded'] for chunk in process_pool.encode_chunks(df, 'Data', processes=processes)]
+
+
+def import_time():
+    code = 'import time; start = time.time(); import pygs; print(time.time() - start)'
+    env = dict(os.environ, PYTHONPATH=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    output = subprocess.check_output([sys.executable, '-c', code], env=env)
+    return float(output.decode('utf-8').strip())
+
+
+def discovery_document_copy():
+    # a Sheets v4 discovery document to seed the cache with: the one pygs
+    # cached for this user, or the copy bundled with googleapiclient
+    import googleapiclient
+    paths = [os.path.join(os.path.expanduser('~'), '.credentials', 'sheets.googleapis.com-v4-discovery.json'),
+             os.path.join(os.path.dirname(googleapiclient.__file__), 'discovery_cache', 'documents', 'sheets.v4.json')]
+    for path in paths:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def first_call_time(cached):
+    """
+    (seconds loading the discovery document, seconds building the service)
+    in a fresh interpreter with an empty home directory, holding a cached
+    copy of the document if `cached`, or None if it can't be had.
+    """
+    code = ('import time, json, httplib2\n'
+            'from googleapiclient import discovery\n'
+            'from pygs import initialize_service as init_service\n'
+            'start = time.time()\n'
+            'document = init_service.get_discovery_document()\n'
+            'loaded = time.time()\n'
+            'discovery.build_from_document(document, http=httplib2.Http())\n'
+            'print(json.dumps([loaded - start, time.time() - loaded]))')
+    home = tempfile.mkdtemp()
+    try:
+        if cached:
+            source = discovery_document_copy()
+            if source is None:
+                return None
+            os.makedirs(os.path.join(home, '.credentials'))
+            shutil.copy(source, os.path.join(home, '.credentials', 'sheets.googleapis.com-v4-discovery.json'))
+        env = dict(os.environ, HOME=home, USERPROFILE=home,
+                   PYTHONPATH=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+        try:
+            output = subprocess.check_output([sys.executable, '-c', code], env=env,
+                                             stderr=subprocess.DEVNULL, timeout=120)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            return None
+        return json.loads(output.decode('utf-8'))
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+
+def report(name, cells, elapsed, peak):
+    print('{:<28} {:>10,} cells {:>8.3f}s {:>10,.0f} cells/s {:>9.1f} MB'.format(
+        name, cells, elapsed, cells / elapsed if elapsed else 0, peak))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--max-cells', type=int, default=1000000,
+                        help='skip frames with more cells than this (default 1,000,000)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every fake API request (default 0)')
+    parser.add_argument('--max-workers', type=int, default=None,
+                        help='concurrent chunk uploads (default pygs.pygs_tools.MAX_WORKERS)')
+    parser.add_argument('--processes', default='',
+                        help='comma separated worker process counts to encode and upload with, e.g. 1,2,4 '
+                             '({} cores here)'.format(process_pool.cpu_count()))
+    args = parser.parse_args()
+    process_counts = [int(count) for count in args.processes.split(',') if count.strip()]
+
+    print('import pygs: {:.3f}s'.format(import_time()))
+    for cached, label in ((True, 'cached'), (False, 'uncached')):
+        timing = first_call_time(cached)
+        if timing is None:
+            print('first call, {} discovery document: unavailable'.format(label))
+        else:
+            print('first call, {} discovery document: {:.3f}s load + {:.3f}s build'.format(label, *timing))
+
+    fake_service.install(latency=args.latency)
+    # the fake has no quota to protect
+    pygs.configure_rate_limits(requests_per_minute=10 ** 9, user_requests_per_minute=10 ** 9)
+
+    for cells in CELL_COUNTS:
+        if cells > args.max_cells:
+            continue
+        for shape, cols in SHAPES:
+            rows = cells // cols - 1
+            df = mixed_frame(rows, cols)
+            label = '{} {}x{}'.format(shape, rows, cols)
+            print(label)
+
+            report('  serialize_df', cells, *measure(lambda: pytools.serialize_df(df)))
+            report('  cleanDF + tolist', cells, *measure(lambda: old_serialize(df)))
+            report('  encode in process', cells, *measure(lambda: encode_in_process(df)))
+            for processes in process_counts:
+                # start the workers before timing them
+                encode_in_processes(df.head(1), processes)
+                report('  encode x{} processes'.format(processes), cells, *measure(
+                    lambda: encode_in_processes(df, processes)))
+
+            key = pygs.create_empty_spreadsheet(sheet_name='Data', rows=rows + 1, cols=cols)['spreadsheetId']
+            report('  update_sheet_with_df', cells, *measure(
+                lambda: pygs.update_sheet_with_df(df, 'Data', key, max_workers=args.max_workers)))
+            for processes in process_counts:
+                report('  update_sheet_with_df x{}'.format(processes), cells, *measure(
+                    lambda: pygs.update_sheet_with_df(df, 'Data', key, max_workers=args.max_workers,
+                                                      processes=processes)))
+            report('  read_google_sheet', cells, *measure(lambda: pygs.read_google_sheet(key, 'Data')))
+            if arrow_tools.pa is not None:
+                # tracemalloc doesn't see Arrow's buffers, so this is the Python side only
+                report('  read_google_sheet arrow', cells, *measure(
+                    lambda: pygs.read_google_sheet(key, 'Data', output='arrow')))
+            # the first read_changes records the sheet, the timed one finds nothing changed
+            pygs.read_changes(key, 'Data')
+            report('  read_changes unchanged', cells, *measure(lambda: pygs.read_changes(key, 'Data')))
+
+    fake_service.uninstall()
+    process_pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
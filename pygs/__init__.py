@@ -3,16 +3,35 @@
 __author__ = "JP Schultz jp.schultz@gmail.com"
 __license__ = "MIT"
 
+import time
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
 #py3 Compatability
 try:
     import pygs_tools as pytools
     import initialize_service as init_service
+    import instrumentation
+    import read_cache
+    import arrow_tools
+    import process_pool
+    import ranges
+    from sheet_writer import SheetWriter
 except ImportError:
     from . import pygs_tools as pytools
     from . import initialize_service as init_service
+    from . import instrumentation
+    from . import read_cache
+    from . import arrow_tools
+    from . import process_pool
+    from . import ranges
+    from .sheet_writer import SheetWriter
 
 
 
+@instrumentation.instrument('call')
 def create_empty_spreadsheet(document_name=None, sheet_name=None, **kwargs):
     """
     This will create an empty Google Sheet and return an object
@@ -57,8 +76,11 @@ def create_empty_spreadsheet(document_name=None, sheet_name=None, **kwargs):
         }
     }]
 
-    response = service.spreadsheets().create(body={'properties': {'title': document_name},
-                                                   'sheets': sheets_info}).execute()
+    response = init_service.execute(
+        service.spreadsheets().create(body={'properties': {'title': document_name},
+                                            'sheets': sheets_info}))
+    pytools.cache_metadata(response['spreadsheetId'], response)
+
     ret_val = {
         'spreadsheetId': str(response['spreadsheetId']),
         'spreadsheetUrl': str(response['spreadsheetUrl'])
@@ -67,6 +89,7 @@ def create_empty_spreadsheet(document_name=None, sheet_name=None, **kwargs):
     return ret_val
 
 
+@instrumentation.instrument('call')
 def get_all_sheet_names(spreadsheetId):
     """
     This will return a list of all of the sheet names.
@@ -89,7 +112,10 @@ def get_all_sheet_names(spreadsheetId):
     return sheet_names
 
 
-def create_spreadsheet_from_df(df, sheet_name=None, document_name=None, header=True):
+@instrumentation.instrument('call')
+def create_spreadsheet_from_df(df, sheet_name=None, document_name=None, header=True,
+                               chunk_cells=None, max_workers=None, progress=None, processes=None,
+                               datetime_format=None):
     """
     Given a Pandas DataFrame (df), this will create a google sheet
     and name it the document_name and paste
@@ -109,6 +135,25 @@ def create_spreadsheet_from_df(df, sheet_name=None, document_name=None, header=T
         This will determine if the header (column titles) are included
         when pasting data. Defaults to true.
         Setting to False will mean that just the raw data is pasted, starting in the first cell
+    chunk_cells : int, optional
+        The most cells sent in a single request. Larger DataFrames are split
+        into row blocks and uploaded in several requests. Defaults to 250,000.
+    max_workers : int, optional
+        How many chunks are uploaded concurrently. Defaults to 4.
+    progress : callable, optional
+        Called with a dict describing each chunk as it finishes uploading
+        (chunk number, rows, cells and running totals).
+    processes : int, optional
+        Serialize and encode the rows in this many worker processes, while
+        the chunks already encoded are uploaded. Worth it for frames of a
+        million cells or more.
+    datetime_format : str, optional
+        How datetime columns are written: 'iso' (the default) strings that
+        Sheets reads as dates, keeping fractional seconds where there are
+        any, 'serial' day numbers, or a strftime pattern such as
+        '%Y-%m-%dT%H:%M:%S%z'. Sheets has no time zones, so tz-aware
+        columns are written as their wall time unless a pattern shows the
+        offset, and Sheets keeps such strings as text.
 
     Returns
     -------
@@ -118,39 +163,38 @@ def create_spreadsheet_from_df(df, sheet_name=None, document_name=None, header=T
     if df.empty:
         raise ValueError('Please pass in a dataframe with data.')
 
-    # clean/prep the dataframe to go to google sheets
-    df = pytools.cleanDF(df)
-
-    if header:
-        paste_data = [df.columns.tolist()] + df.values.tolist()
-    else:
-        paste_data = df.values.tolist()
-
-    total_cells = df.size + (0 if not header else len(paste_data[0]))
+    total_cells = df.size + (0 if not header else df.shape[1])
 
     if total_cells > 5000000:
         raise ValueError(
             'There are more than 5 million cells in this dataframe which cannot be loaded into Google Sheets.')
 
+    if processes:
+        # the rows are serialized in worker processes while they're uploaded
+        paste_data = None
+        total_rows = len(df) + (1 if header else 0)
+        width = df.shape[1]
+    else:
+        # convert the dataframe to the rows sent to google sheets
+        paste_data = pytools.serialize_df(df, header=header, datetime_format=datetime_format)
+        total_rows = len(paste_data)
+        width = len(paste_data[0])
+
     if document_name is None:
         document_name = 'Untitled spreadsheet'
     if sheet_name is None:
         sheet_name = 'Sheet1'
 
-    last_col = pytools.getEndCol(paste_data)
-    last_row = str(len(paste_data))
-
-    a1notation = sheet_name + '!A1:' + last_col + last_row
+    # fail early on frames wider than the sheet can hold
+    ranges.check_columns(width)
 
-    if len(paste_data) * 26 > 5000000:
-        cols = len(paste_data[0])
-        rows = len(paste_data)
+    if total_rows * 26 > 5000000:
+        cols = width
+        rows = total_rows
     else:
         cols = 26
         rows = 1000
 
-    service = init_service.get_service()
-
     new_sheet = create_empty_spreadsheet(document_name=document_name,
                                          sheet_name=sheet_name,
                                          cols=cols,
@@ -158,26 +202,29 @@ def create_spreadsheet_from_df(df, sheet_name=None, document_name=None, header=T
 
     new_sheet_id = new_sheet['spreadsheetId']
 
-    body = {
-        "range": a1notation,
-        "values": paste_data
-    }
-
-    response = service.spreadsheets().values().update(spreadsheetId=new_sheet_id,
-                                                      range=a1notation,
-                                                      body=body,
-                                                      valueInputOption='USER_ENTERED').execute()
+    pytools.write_blocks(new_sheet_id,
+                         [(sheet_name, 1, paste_data)] if paste_data is not None else None,
+                         max_cells=chunk_cells,
+                         max_workers=max_workers,
+                         progress=progress,
+                         chunks=process_pool.encode_chunks(df, sheet_name, 1, header,
+                                                           max_cells=chunk_cells,
+                                                           processes=processes,
+                                                           datetime_format=datetime_format) if processes else None)
 
     ret_val = {
         'status': 'success',
-        'spreadsheetId': str(response['spreadsheetId']),
+        'spreadsheetId': str(new_sheet_id),
         'spreadsheetUrl': str(new_sheet['spreadsheetUrl'])
     }
 
     return ret_val
 
 
-def update_sheet_with_df(df, sheet_name, spreadsheetId, header=True):
+@instrumentation.instrument('call')
+def update_sheet_with_df(df, sheet_name, spreadsheetId, header=True,
+                         chunk_cells=None, max_workers=None, progress=None, mode='replace',
+                         processes=None, datetime_format=None):
     """
     Given a Pandas DataFrame (df), spreadsheetId and sheet_name, this will
     empty the sheet and paste the dataframe into it.
@@ -194,6 +241,36 @@ def update_sheet_with_df(df, sheet_name, spreadsheetId, header=True):
         This will determine if the header (column titles) are included when pasting data.
         Defaults to true.
         Setting to False will mean that just the raw data is pasted, starting in the first cell
+    chunk_cells : int, optional
+        The most cells sent in a single request. Larger DataFrames are split
+        into row blocks and uploaded in several requests. Defaults to 250,000.
+    max_workers : int, optional
+        How many chunks are uploaded concurrently. Defaults to 4.
+    progress : callable, optional
+        Called with a dict describing each chunk as it finishes uploading
+        (chunk number, rows, cells and running totals).
+    mode : str, optional
+        'replace' (the default) clears the sheet and pastes the whole DataFrame.
+        'diff' only writes the rows that changed since the last pygs write to
+        this sheet (reading the sheet first if there wasn't one) and removes
+        rows below the new data, so the sheet is never empty while updating.
+    processes : int, optional
+        Serialize and encode the rows in this many worker processes, while
+        the chunks already encoded are uploaded. Worth it for frames of a
+        million cells or more. Only used in 'replace' mode.
+    datetime_format : str, optional
+        How datetime columns are written: 'iso' (the default) strings that
+        Sheets reads as dates, keeping fractional seconds where there are
+        any, 'serial' day numbers, or a strftime pattern such as
+        '%Y-%m-%dT%H:%M:%S%z'. Sheets has no time zones, so tz-aware
+        columns are written as their wall time unless a pattern shows the
+        offset, and Sheets keeps such strings as text.
+
+    The rows are pasted over the old ones in chunks, several at a time, and
+    the old rows and columns left over are removed once they're all in. If
+    a chunk fails, its error is raised and the sheet is left with some rows
+    already new and the rest still old; writing the DataFrame again
+    finishes the replace.
 
     Returns
     -------
@@ -206,118 +283,84 @@ def update_sheet_with_df(df, sheet_name, spreadsheetId, header=True):
         raise ValueError('Please specify a sheet name.')
     if not spreadsheetId:
         raise ValueError('Please specify a spreadsheetId.')
+    if mode not in ('replace', 'diff'):
+        raise ValueError("mode must be either 'replace' or 'diff'.")
 
-    # clean/prep the dataframe to go to google sheets
-    df = pytools.cleanDF(df)
-
-    if header:
-        paste_data = [df.columns.tolist()] + df.values.tolist()
-    else:
-        paste_data = df.values.tolist()
-
-    total_cells = df.size + (0 if not header else len(paste_data[0]))
+    total_cells = df.size + (0 if not header else df.shape[1])
 
     if total_cells > 5000000:
         raise ValueError('There are more than 5 million cells in \
                         this dataframe which cannot be loaded into Google Sheets.')
 
-    last_col = pytools.getEndCol(paste_data)
-    last_row = str(len(paste_data))
-
-    a1notation = sheet_name + '!A1:' + last_col + last_row
-
-    service = init_service.get_service()
-
-    current_state = service.spreadsheets().get(
-        spreadsheetId=spreadsheetId).execute()
+    if processes and mode == 'replace':
+        # the rows are serialized in worker processes while they're uploaded
+        paste_data = None
+        rows = len(df) + (1 if header else 0)
+        width = df.shape[1]
+    else:
+        # convert the dataframe to the rows sent to google sheets
+        paste_data = pytools.serialize_df(df, header=header, datetime_format=datetime_format)
+        rows = len(paste_data)
+        width = len(paste_data[0])
 
-    found = False
-    for sheet in current_state['sheets']:
-        if sheet['properties']['title'] == sheet_name:
-            current_cols = sheet['properties']['gridProperties']['columnCount']
-            current_rows = sheet['properties']['gridProperties']['rowCount']
-            sheet_id = sheet['properties']['sheetId']
-            found = True
-            break
+    # fail early on frames wider than the sheet can hold
+    ranges.check_columns(width)
 
-    if not found:
-        raise ValueError(
-            "Unable to find '{}' in the spreadsheet. Please check the sheet name again.".format(sheet_name))
+    # a diff goes by the sheet's current write stamp. A replace can use the cached
+    # grid size, its last request sets the row count whatever the cache says
+    properties = pytools.get_sheet_properties(spreadsheetId, sheet_name, refresh=(mode == 'diff'))
+    current_cols = properties['gridProperties']['columnCount']
 
-    # clear the data from the sheet
-    clear_range_end_col = pytools.getEndCol([range(current_cols)])
+    ret_val = {
+        'status': 'success',
+        'spreadsheetId': str(spreadsheetId),
+        'spreadsheetUrl': 'https://docs.google.com/spreadsheets/d/' + str(spreadsheetId)
+    }
 
-    range_to_clear = "{}!A1:{}{}".format(sheet_name, clear_range_end_col, str(current_rows))
+    if mode == 'diff':
+        pytools.diff_sync(spreadsheetId, sheet_name, paste_data, properties,
+                          max_cells=chunk_cells,
+                          max_workers=max_workers,
+                          progress=progress)
+        return ret_val
 
-    service.spreadsheets().values().clear(spreadsheetId=spreadsheetId,
-                                          range=range_to_clear,
-                                          body={}).execute()
+    # a full rewrite leaves nothing for a later diff to compare against
+    pytools.set_fingerprint(spreadsheetId, sheet_name, None)
 
-    # remove extra columns so we can fit the new DF
     # If the length of the incoming data multiplied by the number of columns there currently are would
-    # make the sheet more than 5000000, we need to remove any extra columns, so this deletes those columns
-    if (len(paste_data) * current_cols) > 5000000:
-        range_dict = {
-            'sheetId': sheet_id,
-            'dimension': 'COLUMNS',
-            'startIndex': 1,
-            'endIndex': current_cols - 1
-        }
-        # request body based off of the dimensions above
-        body = {
-            "requests": [{
-                "deleteDimension": {
-                    "range": range_dict
-                }
-            }]
-        }
-        # clear the columns
-        service.spreadsheets().batchUpdate(
-            spreadsheetId=spreadsheetId, body=body).execute()
-
-    # If the incoming data is shorter than the current data, we need to clear the old data first, otherwise
-    # we can just paste over it
-    if len(paste_data) < current_rows:
-        range_dict = {
-            'sheetId': sheet_id,
-            'dimension': 'ROWS',
-            'startIndex': len(paste_data) - 1,
-            'endIndex': current_rows
-        }
-        # request body based off of the dimensions above
-        body = {
-            "requests": [{
-                "deleteDimension": {
-                    "range": range_dict
-                }
-            }]
-        }
-        # clear the columns
-        service.spreadsheets().batchUpdate(
-            spreadsheetId=spreadsheetId, body=body).execute()
-
-    body = {
-        "range": a1notation,
-        "values": paste_data
-    }
-
-    response = service.spreadsheets().values().update(
-        spreadsheetId=spreadsheetId,
-        range=a1notation,
-        body=body,
-        valueInputOption='USER_ENTERED'
-    ).execute()
-
-    ret_val = {
-        'status': 'success',
-        'spreadsheetId': str(response['spreadsheetId']),
-        'spreadsheetUrl': 'https://docs.google.com/spreadsheets/d/' + str(response['spreadsheetId'])
-    }
+    # make the sheet more than 5000000, the extra columns have to go before the data can be written
+    if (rows * current_cols) > 5000000:
+        pytools.batch_update(spreadsheetId, pytools.resize_requests(properties, cols=width))
+        current_cols = width
+
+    # paste over the old data first so the sheet is never left empty, then clear
+    # whatever is left of it and resize the grid in a single batchUpdate
+    try:
+        pytools.write_blocks(spreadsheetId,
+                             [(sheet_name, 1, paste_data)] if paste_data is not None else None,
+                             max_cells=chunk_cells,
+                             max_workers=max_workers,
+                             progress=progress,
+                             chunks=process_pool.encode_chunks(df, sheet_name, 1, header,
+                                                               max_cells=chunk_cells,
+                                                               processes=processes,
+                                                               datetime_format=datetime_format)
+                             if paste_data is None else None)
+    except Exception:
+        # part of the new rows are in, cached reads of the old ones are stale
+        pytools.restamp(spreadsheetId, [sheet_name])
+        raise
+
+    requests = pytools.trim_requests(properties, rows, width, current_cols)
+    pytools.batch_update(spreadsheetId, requests + pytools.stamp_requests(spreadsheetId, [sheet_name]))
 
     return ret_val
 
 
-def create_tab_from_df(df, sheet_name, spreadsheetId, header=True):
+@instrumentation.instrument('call')
+def create_tab_from_df(df, sheet_name, spreadsheetId, header=True,
+                       chunk_cells=None, max_workers=None, progress=None, processes=None,
+                       datetime_format=None):
     """
     Given a Pandas DataFrame (df), spreadsheetId and sheet name,
     this will create a new tab in the spreadsheet
@@ -335,6 +378,25 @@ def create_tab_from_df(df, sheet_name, spreadsheetId, header=True):
         This will determine if the header (column titles) are included
         when pasting data. Defaults to true.
         Setting to False will mean that just the raw data is pasted, starting in the first cell
+    chunk_cells : int, optional
+        The most cells sent in a single request. Larger DataFrames are split
+        into row blocks and uploaded in several requests. Defaults to 250,000.
+    max_workers : int, optional
+        How many chunks are uploaded concurrently. Defaults to 4.
+    progress : callable, optional
+        Called with a dict describing each chunk as it finishes uploading
+        (chunk number, rows, cells and running totals).
+    processes : int, optional
+        Serialize and encode the rows in this many worker processes, while
+        the chunks already encoded are uploaded. Worth it for frames of a
+        million cells or more.
+    datetime_format : str, optional
+        How datetime columns are written: 'iso' (the default) strings that
+        Sheets reads as dates, keeping fractional seconds where there are
+        any, 'serial' day numbers, or a strftime pattern such as
+        '%Y-%m-%dT%H:%M:%S%z'. Sheets has no time zones, so tz-aware
+        columns are written as their wall time unless a pattern shows the
+        offset, and Sheets keeps such strings as text.
 
     Returns
     -------
@@ -348,15 +410,7 @@ def create_tab_from_df(df, sheet_name, spreadsheetId, header=True):
     if not spreadsheetId:
         raise ValueError('Please specify a spreadsheetId.')
 
-    # clean/prep the dataframe to go to google sheets
-    df = pytools.cleanDF(df)
-
-    if header:
-        paste_data = [df.columns.tolist()] + df.values.tolist()
-    else:
-        paste_data = df.values.tolist()
-
-    total_cells = df.size + (0 if not header else len(paste_data[0]))
+    total_cells = df.size + (0 if not header else df.shape[1])
 
     if total_cells > 5000000:
         raise ValueError('There are more than 5 million cells in \
@@ -364,34 +418,440 @@ def create_tab_from_df(df, sheet_name, spreadsheetId, header=True):
 
     sheet_name = pytools.clean_sheet_name(sheet_name, spreadsheetId)
 
-    body = {
-        "requests": [{
-            "addSheet": {
-                "properties": {
-                    "title":
-                        sheet_name,
-                    "gridProperties": {
-                        "rowCount": len(paste_data),
-                        "columnCount": len(paste_data[0])
-                    }
-                }
-            }
-        }]
-    }
-    service = init_service.get_service()
+    requests = [pytools.add_sheet_request(sheet_name,
+                                          len(df) + (1 if header else 0),
+                                          df.shape[1])]
     # create the empty sheet
-    service.spreadsheets().batchUpdate(
-        spreadsheetId=spreadsheetId, body=body).execute()
+    pytools.batch_update(spreadsheetId, requests)
 
     resp = update_sheet_with_df(df,
                                 sheet_name=sheet_name,
                                 spreadsheetId=spreadsheetId,
-                                header=header)
+                                header=header,
+                                chunk_cells=chunk_cells,
+                                max_workers=max_workers,
+                                progress=progress,
+                                processes=processes,
+                                datetime_format=datetime_format)
 
     return resp
 
 
-def read_google_sheet(spreadsheetId=None, sheet_name=None):
+@instrumentation.instrument('call')
+def write_dfs_to_spreadsheet(spreadsheetId, dfs, mode='replace', header=True,
+                             chunk_cells=None, max_workers=None, progress=None):
+    """
+    Given a dict of Pandas DataFrames keyed by sheet name, this will write
+    each DataFrame to its own tab in the spreadsheet. All tabs are set up in
+    a single request and the data is sent in as few requests as the chunk
+    size allows, however many DataFrames there are.
+
+    Parameters
+    ----------
+    spreadsheetId : str, required
+        The ID of the spreadsheet to write to.
+    dfs : dict, required
+        The DataFrames to write, keyed by sheet name.
+    mode : str, optional
+        'replace' (the default) replaces the contents of the sheets that
+        already exist and creates the ones that don't. 'create' always
+        creates new tabs, adding '_1', '_2' etc. to names that are taken,
+        the same way create_tab_from_df does.
+    header : bool, optional
+        This will determine if the header (column titles) are included
+        when pasting data. Defaults to true.
+    chunk_cells : int, optional
+        The most cells sent in a single request. Defaults to 250,000.
+    max_workers : int, optional
+        How many chunks are uploaded concurrently. Defaults to 4.
+    progress : callable, optional
+        Called with a dict describing each chunk as it finishes uploading
+        (chunk number, rows, cells and running totals).
+
+    Returns
+    -------
+    Returns an object containing the 'key' for the spreadsheet, the 'url' and
+    'sheet_names', a dict of the names asked for to the names written to.
+    """
+    if not spreadsheetId:
+        raise ValueError('Please specify a spreadsheetId.')
+    if not dfs:
+        raise ValueError('Please pass in at least one dataframe.')
+    if mode not in ('replace', 'create'):
+        raise ValueError("mode must be either 'replace' or 'create'.")
+
+    for sheet_name, df in dfs.items():
+        if not sheet_name:
+            raise ValueError('Please specify a sheet name for every dataframe.')
+        if df.empty:
+            raise ValueError("Please pass in a dataframe with data for '{}'.".format(sheet_name))
+        if df.size + (0 if not header else df.shape[1]) > 5000000:
+            raise ValueError("There are more than 5 million cells in the dataframe for '{}' "
+                             "which cannot be loaded into Google Sheets.".format(sheet_name))
+
+    current_state = pytools.get_metadata(spreadsheetId)
+    existing = dict((sheet['properties']['title'], sheet['properties']) for sheet in current_state['sheets'])
+    titles = list(existing)
+
+    sheet_names = {}
+    structure_requests = []
+    replaced = []
+    blocks = []
+    for sheet_name, df in dfs.items():
+        # convert the dataframe to the rows sent to google sheets
+        paste_data = pytools.serialize_df(df, header=header)
+        rows = len(paste_data)
+        width = len(paste_data[0])
+        # fail early on frames wider than the sheet can hold
+        ranges.check_columns(width)
+
+        if mode == 'replace' and sheet_name in existing:
+            properties = existing[sheet_name]
+            current_cols = properties['gridProperties']['columnCount']
+            # extra columns go first if the write would take the sheet past 5M cells
+            if rows * current_cols > 5000000:
+                structure_requests.extend(pytools.resize_requests(properties, cols=width))
+                current_cols = width
+            replaced.append((properties, rows, width, current_cols))
+            pytools.set_fingerprint(spreadsheetId, sheet_name, None)
+            target = sheet_name
+        else:
+            target = pytools.unique_sheet_name(sheet_name, titles)
+            titles.append(target)
+            structure_requests.append(pytools.add_sheet_request(target, rows, width))
+
+        sheet_names[sheet_name] = target
+        blocks.append((target, 1, paste_data))
+
+    # create and resize all the sheets at once
+    if structure_requests:
+        pytools.batch_update(spreadsheetId, structure_requests)
+
+    try:
+        pytools.write_blocks(spreadsheetId,
+                             blocks,
+                             max_cells=chunk_cells,
+                             max_workers=max_workers,
+                             progress=progress)
+    except Exception:
+        pytools.restamp(spreadsheetId, list(sheet_names.values()))
+        raise
+
+    # then clear what's left of the old data in the replaced sheets and
+    # stamp every sheet written, all at once
+    trim = []
+    for properties, rows, width, current_cols in replaced:
+        trim.extend(pytools.trim_requests(properties, rows, width, current_cols))
+    pytools.batch_update(spreadsheetId, trim + pytools.stamp_requests(spreadsheetId, list(sheet_names.values())))
+
+    ret_val = {
+        'status': 'success',
+        'spreadsheetId': str(spreadsheetId),
+        'spreadsheetUrl': 'https://docs.google.com/spreadsheets/d/' + str(spreadsheetId),
+        'sheet_names': sheet_names
+    }
+
+    return ret_val
+
+
+@instrumentation.instrument('call')
+def append_df_to_sheet(df, sheet_name, spreadsheetId, header=True, chunk_rows=None, datetime_format=None):
+    """
+    Given a Pandas DataFrame (df), or an iterator of DataFrames, this will add
+    its rows below the data already in the sheet, without rewriting it. Each
+    DataFrame from an iterator is sent as soon as it's produced.
+
+    Parameters
+    ----------
+    df : Pandas Dataframe or iterator of DataFrames, required
+        The rows to append. Every DataFrame must have the same columns.
+    sheet_name : str, required
+        The name of the tab within the sheet that you would like the rows appended to.
+    spreadsheetId : str, required
+        The ID of the spreadsheet containing the sheet.
+    header : bool, optional
+        If the sheet is empty, the column titles are written first. If it
+        isn't, its first row must match the column titles. Defaults to true.
+        Setting to False appends just the raw data without any check.
+    chunk_rows : int, optional
+        The most rows sent in a single request. Defaults to 10,000.
+    datetime_format : str, optional
+        How datetime columns are written: 'iso' (the default) strings that
+        Sheets reads as dates, keeping fractional seconds where there are
+        any, 'serial' day numbers, or a strftime pattern such as
+        '%Y-%m-%dT%H:%M:%S%z'. Sheets has no time zones, so tz-aware
+        columns are written as their wall time unless a pattern shows the
+        offset, and Sheets keeps such strings as text.
+
+    Returns
+    -------
+    Returns an object containing the 'key' for the spreadsheet, the 'url' and
+    'updatedRows', the number of rows appended.
+    """
+    if not sheet_name:
+        raise ValueError('Please specify a sheet name.')
+    if not spreadsheetId:
+        raise ValueError('Please specify a spreadsheetId.')
+
+    chunk_rows = chunk_rows or pytools.APPEND_CHUNK_ROWS
+    frames = [df] if isinstance(df, pd.DataFrame) else df
+
+    # make sure the sheet exists before anything is sent
+    pytools.get_sheet_properties(spreadsheetId, sheet_name)
+    total_cells = pytools.grid_cells(pytools.get_metadata(spreadsheetId))
+
+    columns = None
+    updated_rows = 0
+    for frame in frames:
+        if frame.empty:
+            continue
+        frame_columns = [str(col) for col in frame.columns]
+
+        paste_data = pytools.serialize_df(frame, header=False, datetime_format=datetime_format)
+        if columns is None:
+            # check the header once, against the first DataFrame
+            columns = frame_columns
+            if header:
+                existing = pytools.get_header_row(spreadsheetId, sheet_name)
+                if existing is None:
+                    paste_data.insert(0, columns)
+                elif [str(col) for col in existing] != columns:
+                    raise ValueError(
+                        "The columns don't match the header of '{}'. Please check the dataframe again.".format(
+                            sheet_name))
+            pytools.set_fingerprint(spreadsheetId, sheet_name, None)
+        elif frame_columns != columns:
+            raise ValueError('Every dataframe appended must have the same columns.')
+
+        for start in range(0, len(paste_data), chunk_rows):
+            rows = paste_data[start:start + chunk_rows]
+            # appended rows take the full width of the sheet's grid
+            grid_cols = pytools.get_sheet_properties(spreadsheetId, sheet_name)['gridProperties']['columnCount']
+            new_cells = len(rows) * max(grid_cols, len(columns))
+            if total_cells + new_cells > 5000000:
+                raise ValueError('Appending these rows would take the spreadsheet past 5 million cells, '
+                                 'which cannot be loaded into Google Sheets.')
+            pytools.append_rows(spreadsheetId, sheet_name, rows)
+            total_cells += new_cells
+            updated_rows += len(rows)
+
+    if updated_rows:
+        pytools.batch_update(spreadsheetId, pytools.stamp_requests(spreadsheetId, [sheet_name]))
+
+    ret_val = {
+        'status': 'success',
+        'spreadsheetId': str(spreadsheetId),
+        'spreadsheetUrl': 'https://docs.google.com/spreadsheets/d/' + str(spreadsheetId),
+        'updatedRows': updated_rows
+    }
+
+    return ret_val
+
+
+@instrumentation.instrument('call')
+def write_sharded_df(df, dataset_name, spreadsheetId=None, document_name=None, max_cells=None,
+                     chunk_cells=None, max_workers=None, progress=None):
+    """
+    Given a Pandas DataFrame (df) of any size, this will split its rows
+    across as many spreadsheets as it takes to stay under the 5 million
+    cell limit of each, one tab per spreadsheet, and record where each
+    shard went in a manifest kept in the '_pygs_manifest' tab of the first
+    spreadsheet. Read it back with read_sharded_df.
+
+    Writing a dataset again overwrites its shards in place, in the
+    spreadsheets it already used, adds shards in new spreadsheets if more
+    are needed and removes the shards left over once the manifest is
+    switched over to the new ones. A read while the dataset is being
+    written can find a mix of old and new rows.
+
+    Parameters
+    ----------
+    df : Pandas Dataframe, required
+        The DataFrame to write. Every shard has the column titles as its first row.
+    dataset_name : str, required
+        The name the dataset is recorded under. Shard tabs are named after it.
+    spreadsheetId : str, optional
+        The ID of the spreadsheet that holds the manifest and the first
+        shard. If left blank, a new spreadsheet is created.
+    document_name : str, optional
+        The name of the spreadsheets created. Defaults to the dataset_name,
+        followed by the shard number for all but the first.
+    max_cells : int, optional
+        The most cells each spreadsheet can hold, counting the sheets that
+        are already in it. Defaults to 5,000,000.
+    chunk_cells : int, optional
+        The most cells sent in a single request. Defaults to 250,000.
+    max_workers : int, optional
+        How many chunks are uploaded concurrently. Defaults to 4.
+    progress : callable, optional
+        Called with a dict describing each chunk as it finishes uploading
+        (chunk number, rows, cells and running totals).
+
+    Returns
+    -------
+    Returns an object containing the 'key' and the 'url' of the spreadsheet
+    with the manifest, and 'manifest', the dataset's entry in it.
+    """
+    if df.empty:
+        raise ValueError('Please pass in a dataframe with data.')
+    if not dataset_name:
+        raise ValueError('Please specify a dataset name.')
+
+    max_cells = max_cells or pytools.SPREADSHEET_CELLS
+    width = df.shape[1]
+    # a new spreadsheet holds the one cell manifest tab and at least a header and a row
+    if 2 * width + 1 > max_cells:
+        raise ValueError('The dataframe is too wide to fit a row in a spreadsheet of {} cells.'.format(max_cells))
+
+    document_name = document_name or dataset_name
+    if spreadsheetId is None:
+        spreadsheetId = create_empty_spreadsheet(document_name=document_name,
+                                                 sheet_name=pytools.MANIFEST_SHEET,
+                                                 rows=1, cols=1)['spreadsheetId']
+
+    manifest = pytools.read_manifest(spreadsheetId)
+    old = manifest['datasets'].get(dataset_name)
+    generation = old['generation'] + 1 if old else 1
+    spreadsheets = [spreadsheetId] + [key for key in (old['spreadsheets'] if old else []) if key != spreadsheetId]
+
+    # each spreadsheet holds at most one shard of the dataset, which is reused
+    old_shards = dict((shard['spreadsheetId'], shard) for shard in (old['shards'] if old else []))
+
+    shards = []
+    start = 0
+    position = 0
+    while start < len(df):
+        if position == len(spreadsheets):
+            spreadsheets.append(create_empty_spreadsheet(
+                document_name='{} ({})'.format(document_name, position + 1),
+                sheet_name=pytools.MANIFEST_SHEET,
+                rows=1, cols=1)['spreadsheetId'])
+        target = spreadsheets[position]
+        position += 1
+
+        # the shard's tab is sized to its rows plus the header, all `width` cells
+        # wide, in the cells left free by the other sheets of the spreadsheet
+        current_state = pytools.get_metadata(target, refresh=True)
+        free_cells = max_cells - pytools.grid_cells(current_state)
+        reused = None
+        if target in old_shards:
+            for sheet in current_state['sheets']:
+                if sheet['properties']['title'] == old_shards[target]['sheet_name']:
+                    reused = sheet['properties']
+                    free_cells += reused['gridProperties']['rowCount'] * reused['gridProperties']['columnCount']
+        rows = free_cells // width - 1
+        if rows < 1:
+            continue
+
+        shard = df.iloc[start:start + rows]
+        if reused is not None:
+            # resized to fit the new rows before they're written over the old ones
+            pytools.batch_update(target, pytools.resize_requests(reused, rows=len(shard) + 1, cols=width))
+            update_sheet_with_df(shard, reused['title'], target,
+                                 chunk_cells=chunk_cells,
+                                 max_workers=max_workers,
+                                 progress=progress)
+            sheet_name = reused['title']
+            del old_shards[target]
+        else:
+            result = write_dfs_to_spreadsheet(target,
+                                              {'{}_{}'.format(dataset_name, generation): shard},
+                                              mode='create',
+                                              chunk_cells=chunk_cells,
+                                              max_workers=max_workers,
+                                              progress=progress)
+            sheet_name = list(result['sheet_names'].values())[0]
+        shards.append({
+            'spreadsheetId': target,
+            'sheet_name': sheet_name,
+            'start_row': start,
+            'rows': len(shard)
+        })
+        start += len(shard)
+
+    entry = {
+        'generation': generation,
+        'columns': [str(col) for col in df.columns],
+        'rows': len(df),
+        'shards': shards,
+        'spreadsheets': spreadsheets,
+        'updated': datetime.datetime.utcnow().isoformat()
+    }
+    manifest['datasets'][dataset_name] = entry
+    pytools.write_manifest(spreadsheetId, manifest)
+
+    # the old shards that weren't reused go once the manifest no longer points at them
+    if old_shards:
+        pytools.delete_sheets(list(old_shards.values()))
+
+    ret_val = {
+        'status': 'success',
+        'spreadsheetId': str(spreadsheetId),
+        'spreadsheetUrl': 'https://docs.google.com/spreadsheets/d/' + str(spreadsheetId),
+        'manifest': entry
+    }
+
+    return ret_val
+
+
+def iter_google_sheet(spreadsheetId=None, sheet_name=None, chunk_rows=None,
+                      value_render_option=None, date_time_render_option=None,
+                      dtype=None, parse_dates=None):
+    """
+    This will read a Google Sheet in blocks of rows, yielding a Pandas
+    DataFrame for each block so large sheets can be processed without
+    holding the whole sheet in memory.
+
+    Parameters
+    ----------
+    spreadsheetId : str, required
+        The ID of the spreadsheet to read from
+
+    sheet_name : str, optional
+        This is the name of the tab/sheet you would like to read from. Without it, it defaults to
+        the first sheet in the spreadsheet.
+
+    chunk_rows : int, optional
+        The number of sheet rows fetched per request. Defaults to 10,000.
+
+    value_render_option : str, optional
+        How cell values are returned: 'FORMATTED_VALUE' (the default, every
+        cell is a string as shown in the sheet), 'UNFORMATTED_VALUE' (numbers
+        and booleans keep their type) or 'FORMULA'.
+
+    date_time_render_option : str, optional
+        With unformatted values, dates come back as 'SERIAL_NUMBER' (the
+        default) or 'FORMATTED_STRING'.
+
+    dtype : type, str or dict, optional
+        A type for every column or a {column: type} dict, e.g.
+        {'id': 'int64', 'price': 'float64', 'state': 'category'}.
+        Empty cells become missing values.
+
+    parse_dates : list, optional
+        Columns to convert to datetimes, from serial numbers or date strings.
+
+    Returns
+    -------
+    Yields Pandas Dataframes of consecutive rows, with cells formatted as strings
+    unless other render options or types are asked for.
+    Every block uses the first row of the sheet as its header.
+    """
+    if not spreadsheetId:
+        raise ValueError('Please specify a spreadsheetId.')
+
+    render_options = pytools.get_render_options(value_render_option, date_time_render_option)
+    infer = value_render_option not in (None, 'FORMATTED_VALUE')
+
+    for _, df in pytools.iter_sheet_frames(spreadsheetId, sheet_name, chunk_rows, render_options):
+        yield pytools.convert_types(df, dtype, parse_dates, infer)
+
+
+@instrumentation.instrument('call')
+def read_google_sheet(spreadsheetId=None, sheet_name=None, chunk_rows=None,
+                      value_render_option=None, date_time_render_option=None,
+                      dtype=None, parse_dates=None, usecols=None, query=None, cache=True,
+                      output='pandas'):
     """
     This will read in a Google Sheet to a Pandas DataFrame
 
@@ -404,26 +864,351 @@ def read_google_sheet(spreadsheetId=None, sheet_name=None):
         This is the name of the tab/sheet you would like to read from. Without it, it defaults to
         the first sheet in the spreadsheet.
 
+    chunk_rows : int, optional
+        The number of sheet rows fetched per request. Defaults to 10,000.
+
+    value_render_option : str, optional
+        How cell values are returned: 'FORMATTED_VALUE' (the default, every
+        cell is a string as shown in the sheet), 'UNFORMATTED_VALUE' (numbers
+        and booleans keep their type) or 'FORMULA'.
+
+    date_time_render_option : str, optional
+        With unformatted values, dates come back as 'SERIAL_NUMBER' (the
+        default) or 'FORMATTED_STRING'.
+
+    dtype : type, str or dict, optional
+        A type for every column or a {column: type} dict, e.g.
+        {'id': 'int64', 'price': 'float64', 'state': 'category'}.
+        Empty cells become missing values.
+
+    parse_dates : list, optional
+        Columns to convert to datetimes, from serial numbers or date strings.
+
+    usecols : list, optional
+        Only read these columns, given by their header or 0-based position.
+        Just those columns are fetched from the sheet, in sheet order.
+
+    query : str, optional
+        A Google Visualization API query that Sheets runs before sending
+        anything, e.g. "select A, C where B > 100 limit 50". Columns are
+        referred to by letter. Only the rows and columns it returns are
+        downloaded, formatted as shown in the sheet, so the render options
+        don't apply. Can't be combined with usecols.
+
+    cache : bool, optional
+        Once the read cache is turned on with configure_read_cache, results
+        are reused until the sheet is written by pygs or the cache's ttl
+        runs out. Set to False to always read the sheet. Defaults to True.
+
+    output : str, optional
+        'pandas' (the default) returns a Pandas DataFrame. 'arrow' returns a
+        pyarrow Table and 'polars' a Polars DataFrame, both built straight
+        from the response column by column without an intermediate object
+        DataFrame. With them, empty cells in typed columns are nulls.
+
     Returns
     -------
-    Returns a Pandas Dataframe of the sheet with cells formatted as strings.
+    Returns a Pandas Dataframe of the sheet with cells formatted as strings
+    unless other render options or types are asked for.
     """
     if not spreadsheetId:
         raise ValueError('Please specify a spreadsheetId.')
+    if usecols is not None and query is not None:
+        raise ValueError('Please pass either usecols or query, not both.')
+    if output not in ('pandas', 'arrow', 'polars'):
+        raise ValueError("output must be 'pandas', 'arrow' or 'polars'.")
+    if output != 'pandas':
+        arrow_tools.require(output)
+
+    render_options = pytools.get_render_options(value_render_option, date_time_render_option)
+    infer = value_render_option not in (None, 'FORMATTED_VALUE')
+
+    key = None
+    if cache and read_cache.enabled():
+        # the stamp is read before the data, so a write in between makes the entry stale
+        sheet_name, stamp = pytools.read_stamp(spreadsheetId, sheet_name)
+        key = read_cache.cache_key(spreadsheetId, sheet_name, sorted(render_options.items()),
+                                   dtype, parse_dates, usecols, query, output == 'pandas')
+        df = read_cache.load(key, stamp, output)
+        if df is not None:
+            return arrow_tools.to_polars(df) if output == 'polars' else df
+
+    response = None
+    if usecols is not None or query is not None:
+        sheet_name = pytools.get_sheet_properties(spreadsheetId, sheet_name)['title']
+        if query is not None:
+            response = pytools.query_sheet(spreadsheetId, sheet_name, query)
+        else:
+            response = pytools.read_columns(spreadsheetId, sheet_name, usecols, render_options)
+
+    if output != 'pandas':
+        if response is not None:
+            table = arrow_tools.table_from_response(response, dtype, parse_dates, infer)
+        else:
+            table = arrow_tools.read_sheet_table(spreadsheetId, sheet_name, chunk_rows, render_options,
+                                                 dtype, parse_dates, infer)
+        if key is not None:
+            read_cache.store(key, table, stamp)
+        return arrow_tools.to_polars(table) if output == 'polars' else table
+
+    if response is not None:
+        df = pytools.fixResponse(response)
+    else:
+        df = pytools.read_sheet_frame(spreadsheetId, sheet_name, chunk_rows, render_options)
+        if df.empty and not len(df.columns):
+            return df
 
-    service = init_service.get_service()
+    # convert once on the whole frame so categories and types agree across blocks
+    df = pytools.convert_types(df, dtype, parse_dates, infer)
+    if key is not None:
+        read_cache.store(key, df, stamp)
+    return df
 
-    # if the sheet name isn't specified, use the first one we find
-    if not sheet_name:
-        current_state = service.spreadsheets().get(
-            spreadsheetId=spreadsheetId).execute()
-        sheet_name = current_state['sheets'][0]['properties']['title']
 
-    response = service.spreadsheets().values() \
-        .get(spreadsheetId=spreadsheetId, range=sheet_name).execute()
-    return pytools.fixResponse(response)
+@instrumentation.instrument('call')
+def read_google_sheets(spreadsheetId=None, sheet_names=None, a1ranges=None,
+                       value_render_option=None, date_time_render_option=None,
+                       dtype=None, parse_dates=None):
+    """
+    This will read several tabs or ranges of a Google Sheet at once, with
+    as few requests as possible, into a dict of Pandas DataFrames.
+
+    Parameters
+    ----------
+    spreadsheetId : str, required
+        The ID of the spreadsheet to read from
+
+    sheet_names : list, optional
+        The names of the tabs/sheets to read. If neither sheet_names nor
+        a1ranges are given, every sheet in the spreadsheet is read.
+
+    a1ranges : list, optional
+        A1 ranges to read, e.g. ['Sheet1!A1:D100', "'Other Sheet'!B:F"]. The
+        first row of each range is used as its header.
+
+    value_render_option : str, optional
+        How cell values are returned: 'FORMATTED_VALUE' (the default, every
+        cell is a string as shown in the sheet), 'UNFORMATTED_VALUE' (numbers
+        and booleans keep their type) or 'FORMULA'.
+
+    date_time_render_option : str, optional
+        With unformatted values, dates come back as 'SERIAL_NUMBER' (the
+        default) or 'FORMATTED_STRING'.
+
+    dtype : type, str or dict, optional
+        A type for every column or a {column: type} dict, applied to each
+        DataFrame that has those columns.
+
+    parse_dates : list, optional
+        Columns to convert to datetimes, in each DataFrame that has them.
+
+    Returns
+    -------
+    Returns a dict of Pandas Dataframes keyed by sheet name and range, in the order requested.
+    """
+    if not spreadsheetId:
+        raise ValueError('Please specify a spreadsheetId.')
+
+    if sheet_names is None and a1ranges is None:
+        sheet_names = pytools.get_all_sheet_names(spreadsheetId)
+    keys = list(sheet_names or []) + list(a1ranges or [])
+    # sheet names like 'Q1' or 'AB12' would be read as a cell without quotes
+    requested = [ranges.quote(name) for name in sheet_names or []] + list(a1ranges or [])
+
+    render_options = pytools.get_render_options(value_render_option, date_time_render_option)
+    infer = value_render_option not in (None, 'FORMATTED_VALUE')
+
+    value_ranges = pytools.batch_get(spreadsheetId, requested, render_options)
+
+    frames = {}
+    for key, value_range in zip(keys, value_ranges):
+        df = pytools.fixResponse(value_range)
+        frame_dtype, frame_dates = pytools.select_columns(df, dtype, parse_dates)
+        frames[key] = pytools.convert_types(df, frame_dtype, frame_dates, infer)
+
+    return frames
+
+
+@instrumentation.instrument('call')
+def read_sharded_df(spreadsheetId=None, dataset_name=None, max_workers=None,
+                    value_render_option=None, date_time_render_option=None,
+                    dtype=None, parse_dates=None):
+    """
+    This will read a dataset written by write_sharded_df back into a single
+    Pandas DataFrame, fetching its shards concurrently.
+
+    Parameters
+    ----------
+    spreadsheetId : str, required
+        The ID of the spreadsheet with the dataset's manifest.
+
+    dataset_name : str, required
+        The name the dataset was written under.
+
+    max_workers : int, optional
+        How many shards are read at the same time. Defaults to 4.
+
+    value_render_option : str, optional
+        How cell values are returned: 'FORMATTED_VALUE' (the default, every
+        cell is a string as shown in the sheet), 'UNFORMATTED_VALUE' (numbers
+        and booleans keep their type) or 'FORMULA'.
+
+    date_time_render_option : str, optional
+        With unformatted values, dates come back as 'SERIAL_NUMBER' (the
+        default) or 'FORMATTED_STRING'.
+
+    dtype : type, str or dict, optional
+        A type for every column or a {column: type} dict.
+
+    parse_dates : list, optional
+        Columns to convert to datetimes, from serial numbers or date strings.
+
+    Returns
+    -------
+    Returns a Pandas Dataframe of the whole dataset, in the order it was written.
+    """
+    if not spreadsheetId:
+        raise ValueError('Please specify a spreadsheetId.')
+
+    entry = pytools.read_manifest(spreadsheetId)['datasets'].get(dataset_name)
+    if entry is None:
+        raise ValueError(
+            "Unable to find the dataset '{}' in the spreadsheet. Please check the name again.".format(dataset_name))
+
+    render_options = pytools.get_render_options(value_render_option, date_time_render_option)
+    infer = value_render_option not in (None, 'FORMATTED_VALUE')
+    # worker threads don't inherit the caller's request priority
+    priority = init_service.get_priority()
+
+    def read_shard(shard):
+        with init_service.request_priority(priority):
+            return pytools.read_sheet_frame(shard['spreadsheetId'], shard['sheet_name'],
+                                            render_options=render_options)
+
+    with ThreadPoolExecutor(max_workers=max_workers or pytools.MAX_WORKERS) as executor:
+        frames = list(executor.map(read_shard, entry['shards']))
+
+    if not frames:
+        return pd.DataFrame(columns=entry['columns'])
+    df = pd.concat(frames, ignore_index=True)
+
+    # convert once on the whole frame so categories and types agree across shards
+    return pytools.convert_types(df, dtype, parse_dates, infer)
+
+
+@instrumentation.instrument('call')
+def read_changes(spreadsheetId=None, sheet_name=None, key=None, chunk_rows=None, block_rows=None,
+                 value_render_option=None, date_time_render_option=None, dtype=None, parse_dates=None):
+    """
+    This will read the rows of a Google Sheet that changed since the last
+    call for the same sheet and options, e.g. edits made by hand between
+    polls. The sheet is still fetched in full, but rows are hashed in
+    blocks and only the rows of blocks that changed are compared and put
+    in the DataFrame. The first call returns every row as inserted.
+
+    Parameters
+    ----------
+    spreadsheetId : str, required
+        The ID of the spreadsheet to read from
+
+    sheet_name : str, optional
+        This is the name of the tab/sheet you would like to read from. Without it, it defaults to
+        the first sheet in the spreadsheet.
+
+    key : str, optional
+        A column that identifies each row, e.g. an ID. With it, rows are
+        matched by key, so inserting or sorting rows only reports the rows
+        that were added, removed or edited. Without it, rows are matched
+        by position.
 
+    chunk_rows : int, optional
+        The number of sheet rows fetched per request. Defaults to 10,000.
 
+    block_rows : int, optional
+        The number of rows hashed together. Smaller blocks compare fewer
+        rows around each edit. Defaults to 500.
+
+    value_render_option : str, optional
+        How cell values are returned: 'FORMATTED_VALUE' (the default, every
+        cell is a string as shown in the sheet), 'UNFORMATTED_VALUE' (numbers
+        and booleans keep their type) or 'FORMULA'.
+
+    date_time_render_option : str, optional
+        With unformatted values, dates come back as 'SERIAL_NUMBER' (the
+        default) or 'FORMATTED_STRING'.
+
+    dtype : type, str or dict, optional
+        A type for every column or a {column: type} dict.
+
+    parse_dates : list, optional
+        Columns to convert to datetimes, from serial numbers or date strings.
+
+    Returns
+    -------
+    Returns a Pandas Dataframe of the changed rows, indexed by their 1-based
+    sheet row, with a '_change' column of 'inserted', 'updated' or 'deleted'
+    first. Deleted rows are on the row they used to be on, and only have
+    the key column filled in.
+    """
+    if not spreadsheetId:
+        raise ValueError('Please specify a spreadsheetId.')
+
+    render_options = pytools.get_render_options(value_render_option, date_time_render_option)
+    infer = value_render_option not in (None, 'FORMATTED_VALUE')
+    sheet_name = pytools.get_sheet_properties(spreadsheetId, sheet_name)['title']
+
+    change_key = (spreadsheetId, sheet_name, key, chunk_rows, block_rows, tuple(sorted(render_options.items())))
+    header, changes, state = pytools.sheet_changes(spreadsheetId, sheet_name, pytools.get_change_state(change_key),
+                                                   key, chunk_rows, block_rows, render_options)
+    df = pytools.changes_frame(header, changes, state['width'], key, dtype, parse_dates, infer)
+    # only move on once the changes made it into a frame
+    pytools.set_change_state(change_key, state)
+    return df
+
+
+def watch_sheet(spreadsheetId=None, sheet_name=None, interval=60, key=None, initial=False, **kwargs):
+    """
+    This will poll a Google Sheet every `interval` seconds with read_changes
+    and yield a DataFrame of the changed rows whenever there are any.
+
+    Parameters
+    ----------
+    spreadsheetId : str, required
+        The ID of the spreadsheet to watch
+
+    sheet_name : str, optional
+        This is the name of the tab/sheet you would like to watch. Without it, it defaults to
+        the first sheet in the spreadsheet.
+
+    interval : float, optional
+        Seconds from the start of one read to the start of the next. Defaults to 60.
+
+    key : str, optional
+        A column that identifies each row, as in read_changes.
+
+    initial : bool, optional
+        Whether the changes found by the first read are yielded: every row
+        as inserted, unless the sheet was read with read_changes before.
+        Defaults to False, so only changes made after the watch starts are
+        yielded.
+
+    Any other keyword arguments are passed on to read_changes.
+
+    Returns
+    -------
+    Yields Pandas Dataframes in the shape read_changes returns, forever.
+    """
+    first = True
+    while True:
+        started = time.time()
+        df = read_changes(spreadsheetId, sheet_name, key=key, **kwargs)
+        if len(df) and (initial or not first):
+            yield df
+        first = False
+        time.sleep(max(0, interval - (time.time() - started)))
+
+
+@instrumentation.instrument('call')
 def get_total_cells(spreadsheetId):
     """
     Given a specific spreadsheetId, this will return a count of the number of
@@ -443,16 +1228,113 @@ def get_total_cells(spreadsheetId):
     if not spreadsheetId:
         raise ValueError('Please specify a spreadsheetId.')
 
-    service = init_service.get_service()
-    sheet_info = service.spreadsheets().get(spreadsheetId=spreadsheetId).execute()
+    # fetched fresh, other clients may have added sheets or resized grids
+    sheet_info = pytools.get_metadata(spreadsheetId, refresh=True)
+
+    return pytools.grid_cells(sheet_info)
+
 
-    total_cells = 0
-    for sheet in sheet_info['sheets']:
-        columns = sheet['properties']['gridProperties']['columnCount']
-        rows = sheet['properties']['gridProperties']['rowCount']
-        total_cells += columns * rows
+def invalidate_metadata_cache(spreadsheetId=None):
+    """
+    pygs caches the sheet names, IDs and grid sizes of each spreadsheet it
+    works with for a few minutes and keeps them current through its own
+    writes. Call this after changing a spreadsheet outside of pygs so the
+    next call fetches them again.
+
+    Parameters
+    ----------
+    spreadsheetId : str, optional
+        The ID of the spreadsheet to forget. Without it, the whole cache is cleared.
+    """
+    pytools.invalidate_metadata(spreadsheetId)
+
+
+def configure_read_cache(directory, ttl=None, max_bytes=None):
+    """
+    Turns on the on-disk cache for read_google_sheet, which needs pyarrow.
+    Results are kept as memory-mapped Arrow files and reused while they're
+    younger than `ttl` and no pygs writer has changed the sheet since.
+    Settings left as None are unchanged.
+
+    Parameters
+    ----------
+    directory : str, required
+        Where the cache files are kept. Pass None to turn the cache off.
+    ttl : int, optional
+        How many seconds a result can be reused for. Defaults to 3600.
+        Sheets changed outside of pygs are only read again after this.
+    max_bytes : int, optional
+        The least recently used results are removed once the cache grows
+        past this size. Defaults to 1GB.
+    """
+    read_cache.configure(directory, ttl, max_bytes)
+
+
+def clear_read_cache():
+    """Removes every result from the read cache."""
+    read_cache.clear()
 
-    return total_cells
+
+def set_pool_size(size):
+    """
+    Sets how many requests pygs can have in flight at the same time across
+    all threads. Each one uses its own HTTP connection, which is kept open
+    for later requests. Defaults to 8.
+
+    Parameters
+    ----------
+    size : int, required
+        The number of pooled connections.
+    """
+    init_service.set_pool_size(size)
+
+
+def configure_rate_limits(requests_per_minute=None, user_requests_per_minute=None,
+                          interactive_reserve=None, max_retries=None, base_delay=None, max_delay=None):
+    """
+    Every request pygs sends goes through a rate limiter that keeps it under
+    the Sheets API quotas, and is retried with exponential backoff and
+    jitter on quota (429) and server (5xx) errors. This changes its settings.
+    Settings left as None are unchanged.
+
+    The limits only count the requests of this process. On its own, the
+    lower of the two is the one that applies; with several processes on the
+    same project, give each a share of the project's quota as its
+    requests_per_minute.
+
+    Parameters
+    ----------
+    requests_per_minute : int, optional
+        Read and write requests allowed per minute for the project. Defaults to 300.
+    user_requests_per_minute : int, optional
+        Read and write requests allowed per minute for the user. Defaults to 60.
+    interactive_reserve : float, optional
+        The share of each limit that 'batch' requests leave for
+        'interactive' ones. Defaults to 0.2.
+    max_retries : int, optional
+        How many times a failed request is retried. Defaults to 5.
+    base_delay : float, optional
+        The first backoff delay in seconds, doubled on each retry. Defaults to 1.
+    max_delay : float, optional
+        The longest backoff delay in seconds. Defaults to 64.
+    """
+    init_service.configure_scheduler(requests_per_minute, user_requests_per_minute,
+                                     interactive_reserve, max_retries, base_delay, max_delay)
+
+
+def get_request_stats(reset=False):
+    """
+    Returns the request counters since import (or the last reset):
+    'requests_sent', 'throttled' (requests that waited for the rate limit),
+    'retried' and 'wait_time' (seconds spent waiting on limits and backoff).
+
+    Parameters
+    ----------
+    reset : bool, optional
+        Set the counters back to zero after reading them.
+    """
+    return init_service.get_scheduler_stats(reset)
 
 
-init_service.initialize_service(initializing=True)
+# use as `with pygs.request_priority('batch'):` around bulk jobs
+request_priority = init_service.request_priority
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+asyncio versions of the pygs functions.
+
+Each call runs the matching pygs function on a bounded pool of worker
+threads, whose requests share pygs's pool of HTTP connections, so many
+sheets can be read or written at once from a single event loop:
+
+    import pygs.aio
+
+    results = await asyncio.gather(*[
+        pygs.aio.create_tab_from_df(df, name, spreadsheetId) for name, df in frames.items()
+    ])
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pygs
+
+aio_dict = {
+    'executor': None,
+    'max_concurrency': 8
+}
+aio_lock = threading.Lock()
+
+
+def set_max_concurrency(max_concurrency):
+    """
+    Sets how many pygs calls can be in flight at once. Calls made after this
+    wait for a free worker once the limit is reached. Defaults to 8.
+    """
+    if max_concurrency < 1:
+        raise ValueError('max_concurrency must be at least 1.')
+    with aio_lock:
+        old_executor = aio_dict['executor']
+        aio_dict['executor'] = None
+        aio_dict['max_concurrency'] = max_concurrency
+    if old_executor is not None:
+        old_executor.shutdown(wait=False)
+
+
+def get_executor():
+    with aio_lock:
+        if aio_dict['executor'] is None:
+            aio_dict['executor'] = ThreadPoolExecutor(max_workers=aio_dict['max_concurrency'])
+        return aio_dict['executor']
+
+
+async def run(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def create_empty_spreadsheet(document_name=None, sheet_name=None, **kwargs):
+    """Async version of pygs.create_empty_spreadsheet."""
+    return await run(pygs.create_empty_spreadsheet, document_name, sheet_name, **kwargs)
+
+
+async def get_all_sheet_names(spreadsheetId):
+    """Async version of pygs.get_all_sheet_names."""
+    return await run(pygs.get_all_sheet_names, spreadsheetId)
+
+
+async def create_spreadsheet_from_df(df, sheet_name=None, document_name=None, header=True, **kwargs):
+    """Async version of pygs.create_spreadsheet_from_df."""
+    return await run(pygs.create_spreadsheet_from_df, df, sheet_name, document_name, header, **kwargs)
+
+
+async def update_sheet_with_df(df, sheet_name, spreadsheetId, header=True, **kwargs):
+    """Async version of pygs.update_sheet_with_df."""
+    return await run(pygs.update_sheet_with_df, df, sheet_name, spreadsheetId, header, **kwargs)
+
+
+async def create_tab_from_df(df, sheet_name, spreadsheetId, header=True, **kwargs):
+    """Async version of pygs.create_tab_from_df."""
+    return await run(pygs.create_tab_from_df, df, sheet_name, spreadsheetId, header, **kwargs)
+
+
+async def read_google_sheet(spreadsheetId=None, sheet_name=None, **kwargs):
+    """Async version of pygs.read_google_sheet."""
+    return await run(pygs.read_google_sheet, spreadsheetId, sheet_name, **kwargs)
+
+
+async def get_total_cells(spreadsheetId):
+    """Async version of pygs.get_total_cells."""
+    return await run(pygs.get_total_cells, spreadsheetId)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""
+Reads straight into pyarrow Tables, for read_google_sheet(output='arrow')
+and output='polars'.
+
+The rows from the API are gathered column by column and each column is
+turned into a single Arrow array, without building an object DataFrame
+first. Column names follow fixResponse: the first row is the header, extra
+cells get 'Unnamed Sheet Col N' columns and header cells past the data get
+empty columns. Types are converted on the Arrow arrays.
+"""
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+#py3 compatible
+try:
+    import pygs_tools as pytools
+    import instrumentation
+except ImportError:
+    from . import pygs_tools as pytools
+    from . import instrumentation
+
+
+def require(output):
+    if pa is None:
+        raise ImportError("output='{}' needs pyarrow. Please install it with 'pip install pyarrow'.".format(output))
+    if output == 'polars':
+        try:
+            import polars
+        except ImportError:
+            raise ImportError("output='polars' needs polars. Please install it with 'pip install polars'.")
+
+
+def to_polars(table):
+    import polars
+    return polars.from_arrow(table)
+
+
+def column_names(header, width):
+    names = [str(name) for name in header]
+    return names + ["Unnamed Sheet Col " + str(x) for x in range(1, width - len(names) + 1)]
+
+
+def string_array(values):
+    return pa.array([value if isinstance(value, str) or value is None else str(value) for value in values],
+                    type=pa.string())
+
+
+def infer_array(values):
+    # numbers and booleans keep their type, with empty cells as nulls
+    try:
+        array = pa.array([None if value == '' else value for value in values])
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return string_array(values)
+    if array.type in (pa.int64(), pa.float64()) or (array.type == pa.bool_() and not array.null_count):
+        return array
+    return string_array(values)
+
+
+def convert_array(values, dtype):
+    if dtype in ('str', 'object', str, object):
+        return string_array(values)
+    missing = [None if value == '' else value for value in values]
+    if dtype in ('datetime', 'datetime64', 'datetime64[ns]'):
+        return pa.array(pytools.to_datetime(pd.Series(missing, dtype=object)))
+    if dtype == 'category':
+        return string_array(missing).dictionary_encode()
+    try:
+        arrow_type = pa.from_numpy_dtype(np.dtype(dtype))
+    except TypeError:
+        raise ValueError("The type '{}' can't be used with arrow output.".format(dtype))
+    # formatted reads give strings, which Arrow parses when casting
+    if any(isinstance(value, str) for value in missing):
+        array = string_array(missing)
+    else:
+        array = pa.array(missing)
+    try:
+        return array.cast(arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as error:
+        raise ValueError(str(error))
+
+
+@instrumentation.instrument('phase')
+def build_table(header, columns, dtype=None, parse_dates=None, infer=False):
+    """
+    A pyarrow Table from the header row and lists of cell values, one per
+    column (padded with '' to the same length), typed like convert_types
+    would type the DataFrame fixResponse builds from the same rows.
+    """
+    names = column_names(header, len(columns))
+    length = max([0] + [len(column) for column in columns])
+    columns = columns + [[''] * length for _ in range(len(names) - len(columns))]
+
+    if dtype is not None and not isinstance(dtype, dict):
+        dtype = dict((name, dtype) for name in names)
+    dtype = dtype or {}
+    parse_dates = parse_dates or []
+    for col in list(dtype) + list(parse_dates):
+        if col not in names:
+            raise ValueError("Column '{}' is not in the sheet.".format(col))
+
+    arrays = []
+    for name, values in zip(names, columns):
+        if name in parse_dates:
+            arrays.append(convert_array(values, 'datetime'))
+        elif name in dtype:
+            arrays.append(convert_array(values, dtype[name]))
+        elif infer:
+            arrays.append(infer_array(values))
+        else:
+            arrays.append(string_array(values))
+    return pa.Table.from_arrays(arrays, names=names)
+
+
+def unify_tables(tables):
+    """
+    Casts Tables built window by window with infer=True to one schema. A
+    column keeps its type if every window agrees on it, ints mixed with
+    floats become floats and anything else becomes strings. Windows where
+    a column is empty don't count.
+    """
+    names = tables[0].column_names
+    fields = []
+    for position, name in enumerate(names):
+        types = set(table.column(position).type for table in tables
+                    if table.column(position).null_count < table.num_rows)
+        if len(types) == 1:
+            arrow_type = types.pop()
+        elif types == set([pa.int64(), pa.float64()]):
+            arrow_type = pa.float64()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+    schema = pa.schema(fields)
+    return [table.cast(schema) for table in tables]
+
+
+def add_rows(columns, rows):
+    # spread rows over the column lists, padding short rows and earlier columns with ''
+    filled = len(columns[0]) if columns else 0
+    width = max([len(columns)] + [len(row) for row in rows])
+    while len(columns) < width:
+        columns.append([''] * filled)
+    if not rows:
+        return
+    padded = [row if len(row) == width else row + [''] * (width - len(row)) for row in rows]
+    for position, column in enumerate(columns):
+        column.extend(map(itemgetter(position), padded))
+
+
+def table_from_response(response, dtype=None, parse_dates=None, infer=False):
+    # the Table for a values().get style response, like fixResponse's DataFrame
+    values = response.get('values', [])
+    if not values:
+        return pa.table({})
+    columns = []
+    add_rows(columns, values[1:])
+    return build_table(values[0], columns, dtype, parse_dates, infer)
+
+
+def read_sheet_table(spreadsheetId, sheet_name=None, chunk_rows=None, render_options=None,
+                     dtype=None, parse_dates=None, infer=False):
+    # the whole sheet as one Table, read window by window
+    properties = pytools.get_sheet_properties(spreadsheetId, sheet_name)
+    grid = properties['gridProperties']
+
+    header = None
+    columns = []
+    for header, rows in pytools.iter_sheet_windows(spreadsheetId, properties['title'], grid['rowCount'],
+                                                   chunk_rows, render_options, col_count=grid['columnCount']):
+        add_rows(columns, rows)
+
+    if header is None:
+        return pa.table({})
+    return build_table(header, columns, dtype, parse_dates, infer)
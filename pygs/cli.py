@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+"""
+The pygs command, for bulk copies between CSV or Parquet files and sheets:
+
+    pygs push orders.csv --spreadsheet-id KEY --sheet Orders
+    pygs push events.parquet --document-name 'Nightly events' --checkpoint events.ckpt
+    pygs pull KEY orders.csv --sheet Orders --max-workers 4
+
+push replaces the contents of a sheet with a file, reading and uploading it
+--chunk-rows rows at a time, so only a couple of chunks are in memory
+whatever the size of the file. The next chunk is read while the current one
+is uploaded, in up to --max-workers concurrent requests. pull reads a sheet
+window by window into a file. Columns without a header aren't pulled.
+
+With --checkpoint, progress is saved to a small JSON file after every chunk,
+and running the same command again picks up after the last chunk that was
+saved. The checkpoint is removed once a transfer finishes. Parquet files
+need pyarrow, and Parquet pulls always start over.
+
+Pulls to Parquet type their columns the way read_google_sheet(output='arrow')
+does: with --value-render-option UNFORMATTED_VALUE, numbers and booleans
+keep their types. The windows are kept as Arrow columns until the whole
+sheet is read, since a column's type depends on every row.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import threading
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+import pandas as pd
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+import pygs
+#py3 compatible
+try:
+    import pygs_tools as pytools
+    import arrow_tools
+    import ranges
+except ImportError:
+    from . import pygs_tools as pytools
+    from . import arrow_tools
+    from . import ranges
+
+CHUNK_ROWS = 50000
+PARQUET_SUFFIXES = ('.parquet', '.pq')
+
+
+def file_format(path, fmt=None):
+    fmt = fmt or ('parquet' if path.lower().endswith(PARQUET_SUFFIXES) else 'csv')
+    if fmt == 'parquet' and pa is None:
+        raise ValueError("Parquet files need pyarrow. Please install it with 'pip install pyarrow'.")
+    return fmt
+
+
+def read_chunks(path, fmt, chunk_rows, skip_rows=0, text=False):
+    # DataFrames of up to chunk_rows rows of the file, after the first skip_rows rows
+    if fmt == 'parquet':
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            if skip_rows >= batch.num_rows:
+                skip_rows -= batch.num_rows
+                continue
+            yield batch.slice(skip_rows).to_pandas()
+            skip_rows = 0
+        return
+    reader = pd.read_csv(path, chunksize=chunk_rows, skiprows=range(1, skip_rows + 1),
+                         dtype=str if text else None, keep_default_na=not text)
+    for frame in reader:
+        yield frame
+
+
+def prefetch(items):
+    # iterate over items in a background thread, staying one item ahead
+    queue = Queue(maxsize=1)
+    done = object()
+
+    def produce():
+        try:
+            for item in items:
+                queue.put((item, None))
+        except Exception as error:
+            queue.put((None, error))
+        queue.put((done, None))
+
+    thread = threading.Thread(target=produce, name='pygs-cli-reader')
+    thread.daemon = True
+    thread.start()
+    while True:
+        item, error = queue.get()
+        if error is not None:
+            raise error
+        if item is done:
+            return
+        yield item
+
+
+def load_checkpoint(path, expected):
+    # the saved state if it's for the same transfer, otherwise None
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as checkpoint_file:
+        try:
+            state = json.load(checkpoint_file)
+        except ValueError:
+            return None
+    if any(state.get(name) != value for name, value in expected.items()):
+        return None
+    return state
+
+
+def save_checkpoint(path, state):
+    if not path:
+        return
+    # write next to the final name, then move it into place in one step
+    temp_path = '{}.tmp{}'.format(path, os.getpid())
+    with open(temp_path, 'w') as checkpoint_file:
+        json.dump(state, checkpoint_file, sort_keys=True)
+    os.rename(temp_path, path)
+
+
+def remove_checkpoint(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+class Throughput(object):
+    """Reports rows and cells moved, and the rate, on stderr after every chunk."""
+
+    def __init__(self, command, quiet=False, stream=None):
+        self.command = command
+        self.quiet = quiet
+        self.stream = stream or sys.stderr
+        self.started = time.time()
+        self.rows = 0
+        self.cells = 0
+
+    def update(self, rows, cells):
+        self.rows += rows
+        self.cells += cells
+        if not self.quiet:
+            self.stream.write(self.line() + '\n')
+            self.stream.flush()
+
+    def line(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        return '{}: {:,} rows, {:,} cells in {:.1f}s, {:,.0f} cells/s'.format(
+            self.command, self.rows, self.cells, elapsed, self.cells / elapsed)
+
+
+def push(args):
+    fmt = file_format(args.file, args.format)
+    stat = os.stat(args.file)
+    source = {
+        'command': 'push',
+        'file': os.path.abspath(args.file),
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'header': args.header
+    }
+    if args.spreadsheet_id:
+        source['spreadsheetId'] = args.spreadsheet_id
+    if args.sheet:
+        source['sheet_name'] = args.sheet
+
+    state = None if args.restart else load_checkpoint(args.checkpoint, source)
+    if state is None:
+        spreadsheetId = args.spreadsheet_id
+        sheet_name = args.sheet
+        if not spreadsheetId:
+            sheet_name = sheet_name or 'Sheet1'
+            document_name = args.document_name or os.path.splitext(os.path.basename(args.file))[0]
+            spreadsheetId = pygs.create_empty_spreadsheet(document_name, sheet_name)['spreadsheetId']
+        elif not sheet_name:
+            sheet_name = pytools.get_sheet_properties(spreadsheetId)['title']
+        else:
+            try:
+                pytools.get_sheet_properties(spreadsheetId, sheet_name)
+            except ValueError:
+                pytools.batch_update(spreadsheetId, [pytools.add_sheet_request(sheet_name, 1000, 26)])
+        grid = pytools.get_sheet_properties(spreadsheetId, sheet_name, refresh=True)['gridProperties']
+        state = dict(source, spreadsheetId=spreadsheetId, sheet_name=sheet_name, rows_done=0, width=None,
+                     current_cols=grid['columnCount'])
+    spreadsheetId = state['spreadsheetId']
+    sheet_name = state['sheet_name']
+    header_rows = 1 if args.header else 0
+
+    meter = Throughput('push', args.quiet)
+    chunks = read_chunks(args.file, fmt, args.chunk_rows, state['rows_done'], args.text)
+    for frame in prefetch(chunks):
+        width = frame.shape[1]
+        if state['width'] is None:
+            ranges.check_columns(width)
+            properties = pytools.get_sheet_properties(spreadsheetId, sheet_name)
+            # the grid only needs the file's columns, and extra ones would count toward the cell limit
+            if state['current_cols'] > width:
+                pytools.batch_update(spreadsheetId, pytools.resize_requests(properties, cols=width))
+                state['current_cols'] = width
+            pytools.set_fingerprint(spreadsheetId, sheet_name, None)
+            state['width'] = width
+        elif width != state['width']:
+            raise ValueError('Every chunk of the file must have the same columns.')
+
+        rows = header_rows + state['rows_done'] + len(frame)
+        if rows * width > pytools.SPREADSHEET_CELLS:
+            raise ValueError('The file has more than 5 million cells, which cannot be loaded into Google Sheets.')
+        first_chunk = state['rows_done'] == 0
+        paste_data = pytools.serialize_df(frame, header=args.header and first_chunk)
+        start_row = 1 if first_chunk else header_rows + state['rows_done'] + 1
+        pytools.write_blocks(spreadsheetId, [(sheet_name, start_row, paste_data)],
+                             max_cells=args.chunk_cells,
+                             max_workers=args.max_workers)
+
+        state['rows_done'] += len(frame)
+        save_checkpoint(args.checkpoint, state)
+        meter.update(len(frame), len(frame) * width)
+
+    if state['width'] is None:
+        raise ValueError('{} has no columns to push.'.format(args.file))
+
+    # clear what's left of the old contents and stamp the sheet, as update_sheet_with_df does
+    properties = pytools.get_sheet_properties(spreadsheetId, sheet_name)
+    requests = pytools.trim_requests(properties, header_rows + state['rows_done'], state['width'],
+                                     state['current_cols'])
+    pytools.batch_update(spreadsheetId, requests + pytools.stamp_requests(spreadsheetId, [sheet_name]))
+    remove_checkpoint(args.checkpoint)
+
+    print('Pushed {:,} rows to {} ({})'.format(
+        state['rows_done'], sheet_name, 'https://docs.google.com/spreadsheets/d/' + spreadsheetId))
+    return 0
+
+
+def pull(args):
+    fmt = file_format(args.file, args.format)
+    render_options = pytools.get_render_options(args.value_render_option, args.date_time_render_option)
+    # a fresh metadata fetch, for the current grid size and write stamp
+    sheet_name, stamp = pytools.read_stamp(args.spreadsheet_id, args.sheet)
+    grid = pytools.get_sheet_properties(args.spreadsheet_id, sheet_name)['gridProperties']
+    target = {
+        'command': 'pull',
+        'spreadsheetId': args.spreadsheet_id,
+        'sheet_name': sheet_name,
+        'file': os.path.abspath(args.file),
+        'render_options': render_options,
+        'stamp': stamp
+    }
+
+    state = None
+    if fmt == 'csv' and not args.restart:
+        state = load_checkpoint(args.checkpoint, target)
+        if state is not None and (not os.path.exists(args.file) or os.path.getsize(args.file) < state['bytes']):
+            state = None
+    elif args.checkpoint and not args.quiet:
+        sys.stderr.write('pull: Parquet files are written from the start every time.\n')
+
+    meter = Throughput('pull', args.quiet)
+    windows = pytools.iter_sheet_windows(args.spreadsheet_id, sheet_name, grid['rowCount'], args.chunk_rows,
+                                         render_options, max_workers=args.max_workers,
+                                         first_row=2 + (state['rows_done'] if state else 0),
+                                         col_count=grid['columnCount'])
+    if fmt == 'csv':
+        rows_done = pull_csv(args, windows, target, state, meter)
+    else:
+        rows_done = pull_parquet(args, windows, meter)
+    remove_checkpoint(args.checkpoint)
+
+    print('Pulled {:,} rows from {} to {}'.format(rows_done, sheet_name, args.file))
+    return 0
+
+
+def pull_csv(args, windows, target, state, meter):
+    if state is None:
+        state = dict(target, rows_done=0, bytes=0, header=None)
+        mode = 'w'
+    else:
+        # drop anything written after the last saved chunk
+        os.truncate(args.file, state['bytes'])
+        mode = 'a'
+
+    with open(args.file, mode, newline='') as output:
+        writer = csv.writer(output)
+        for header, rows in windows:
+            if state['header'] is None:
+                state['header'] = header
+                writer.writerow(header)
+            elif header != state['header']:
+                raise ValueError("The header of '{}' changed since the checkpoint. "
+                                 "Please pull again with --restart.".format(target['sheet_name']))
+            width = len(header)
+            writer.writerows(row[:width] + [''] * (width - len(row)) for row in rows)
+            output.flush()
+            state['rows_done'] += len(rows)
+            state['bytes'] = output.tell()
+            save_checkpoint(args.checkpoint, state)
+            meter.update(len(rows), len(rows) * width)
+    return state['rows_done']
+
+
+def pull_parquet(args, windows, meter):
+    # numbers and booleans keep their type, as read_google_sheet(output='arrow') does
+    infer = args.value_render_option not in (None, 'FORMATTED_VALUE')
+    tables = []
+    rows_done = 0
+    for header, rows in windows:
+        width = len(header)
+        columns = []
+        arrow_tools.add_rows(columns, [row[:width] for row in rows])
+        tables.append(arrow_tools.build_table(header, columns[:width], infer=infer))
+        rows_done += len(rows)
+        meter.update(len(rows), len(rows) * width)
+    if not tables:
+        raise ValueError('The sheet is empty.')
+    # a column's type depends on every window, so nothing is written before the last one
+    tables = arrow_tools.unify_tables(tables)
+
+    writer = None
+    # the file only appears once it's complete
+    temp_path = '{}.tmp{}'.format(args.file, os.getpid())
+    try:
+        writer = pq.ParquetWriter(temp_path, tables[0].schema)
+        for table in tables:
+            writer.write_table(table)
+        writer.close()
+        writer = None
+        os.rename(temp_path, args.file)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return rows_done
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='pygs', description='Bulk copies between CSV or Parquet files and Google Sheets.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    def add_common(command):
+        command.add_argument('--sheet', help='the sheet to use, by default the first one (Sheet1 for a new spreadsheet)')
+        command.add_argument('--format', choices=('csv', 'parquet'),
+                             help='the file format, by default taken from the file extension')
+        command.add_argument('--chunk-rows', type=int, default=None,
+                             help='rows read or written per step (default {:,} for push, {:,} for pull)'.format(
+                                 CHUNK_ROWS, pytools.READ_CHUNK_ROWS))
+        command.add_argument('--max-workers', type=int, default=pytools.MAX_WORKERS,
+                             help='concurrent requests (default %(default)s)')
+        command.add_argument('--checkpoint', help='save progress to this file and resume from it')
+        command.add_argument('--restart', action='store_true', help='ignore a saved checkpoint and start over')
+        command.add_argument('--quiet', action='store_true', help="don't report progress on stderr")
+
+    push_command = commands.add_parser('push', help='replace the contents of a sheet with a CSV or Parquet file')
+    push_command.add_argument('file')
+    push_command.add_argument('--spreadsheet-id', help='the spreadsheet to write to; a new one is created without it')
+    push_command.add_argument('--document-name', help='the name of a new spreadsheet, by default the file name')
+    push_command.add_argument('--no-header', dest='header', action='store_false',
+                              help="don't write the column titles")
+    push_command.add_argument('--chunk-cells', type=int, default=None,
+                              help='the most cells sent in one request (default {:,})'.format(pytools.CHUNK_CELLS))
+    push_command.add_argument('--text', action='store_true',
+                              help='read every CSV column as text, keeping leading zeros and empty strings')
+    add_common(push_command)
+    push_command.set_defaults(run=push, default_chunk_rows=CHUNK_ROWS)
+
+    pull_command = commands.add_parser('pull', help='write a sheet to a CSV or Parquet file')
+    pull_command.add_argument('spreadsheet_id')
+    pull_command.add_argument('file')
+    pull_command.add_argument('--value-render-option', choices=('FORMATTED_VALUE', 'UNFORMATTED_VALUE', 'FORMULA'),
+                              help='how cells are read, as in read_google_sheet; Parquet columns are only '
+                                   'typed without FORMATTED_VALUE')
+    pull_command.add_argument('--date-time-render-option', choices=('SERIAL_NUMBER', 'FORMATTED_STRING'),
+                              help='how dates are read with unformatted values')
+    add_common(pull_command)
+    pull_command.set_defaults(run=pull, default_chunk_rows=pytools.READ_CHUNK_ROWS)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    args.chunk_rows = args.chunk_rows or args.default_chunk_rows
+    try:
+        return args.run(args)
+    except (ValueError, EnvironmentError) as error:
+        sys.stderr.write('pygs {}: error: {}\n'.format(args.command, error))
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,558 @@
+#!/usr/bin/env python
+"""
+An in-process stand-in for the parts of the Google Sheets v4 API that pygs
+uses, for running pygs offline in tests and benchmarks:
+
+    import pygs
+    from pygs import fake_service
+
+    fake = fake_service.install(latency=0.05)
+    key = pygs.create_spreadsheet_from_df(df)['spreadsheetId']
+    pygs.read_google_sheet(key)
+    fake_service.uninstall()
+
+It keeps spreadsheets in memory and supports spreadsheets create, get and
+batchUpdate (addSheet, deleteSheet, updateSheetProperties, deleteDimension,
+insertDimension, appendDimension, updateCells, createDeveloperMetadata,
+updateDeveloperMetadata), values get, update, clear, append, batchGet
+and batchUpdate, and visualization queries made of 'select' with column
+letters, 'where' comparisons joined by 'and', and 'limit'. Request bodies
+are JSON encoded like the real client does.
+`latency` adds a delay to every request, `error_rate` and `fail_every` make
+requests fail with `error_status` (429 by default) to exercise retries.
+"""
+import io
+import re
+import csv
+import copy
+import json
+import time
+import uuid
+import random
+import threading
+
+import httplib2
+from apiclient import errors
+try:
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from urlparse import urlparse, parse_qs
+
+#py3 compatible
+try:
+    import initialize_service as init_service
+    import ranges
+except ImportError:
+    from . import initialize_service as init_service
+    from . import ranges
+
+MAX_CELLS = 5000000
+
+QUERY_PATTERN = re.compile(r'^\s*(?:select\s+(?P<select>.+?))?\s*(?:where\s+(?P<where>.+?))?\s*'
+                           r'(?:limit\s+(?P<limit>\d+))?\s*$', re.IGNORECASE)
+CONDITION_PATTERN = re.compile(r'^\s*([A-Za-z]+)\s*(<=|>=|!=|<>|=|<|>)\s*(\'[^\']*\'|"[^"]*"|-?[\d.]+)\s*$')
+
+
+def install(**kwargs):
+    """Creates a FakeSheetsService and sends all pygs requests to it."""
+    fake = FakeSheetsService(**kwargs)
+    init_service.use_service(fake)
+    return fake
+
+
+def uninstall():
+    init_service.use_service(None)
+
+
+def parse_entered(value):
+    # a little of what USER_ENTERED does to strings
+    if not isinstance(value, str):
+        return value
+    if value in ('TRUE', 'FALSE'):
+        return value == 'TRUE'
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    return value
+
+
+def formatted(value):
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class FakeRequest(object):
+
+    def __init__(self, fake, methodId, method, handler, body=None, **params):
+        self.fake = fake
+        self.methodId = methodId
+        self.method = method
+        self.handler = handler
+        self.params = params
+        # the real client serializes the body when the request is built, and
+        # the fake reads it back from the JSON, as sent
+        self.body = json.dumps(body) if body is not None else None
+
+    def execute(self, http=None, num_retries=0):
+        return self.fake.run(self)
+
+
+class FakeValues(object):
+
+    def __init__(self, fake):
+        self.fake = fake
+
+    def get(self, **params):
+        return FakeRequest(self.fake, 'sheets.spreadsheets.values.get', 'GET', self.fake.values_get, **params)
+
+    def batchGet(self, **params):
+        return FakeRequest(self.fake, 'sheets.spreadsheets.values.batchGet', 'GET', self.fake.values_batch_get,
+                           **params)
+
+    def update(self, **params):
+        return FakeRequest(self.fake, 'sheets.spreadsheets.values.update', 'PUT', self.fake.values_update,
+                           **params)
+
+    def clear(self, **params):
+        return FakeRequest(self.fake, 'sheets.spreadsheets.values.clear', 'POST', self.fake.values_clear,
+                           **params)
+
+    def append(self, **params):
+        return FakeRequest(self.fake, 'sheets.spreadsheets.values.append', 'POST', self.fake.values_append,
+                           **params)
+
+    def batchUpdate(self, **params):
+        return FakeRequest(self.fake, 'sheets.spreadsheets.values.batchUpdate', 'POST',
+                           self.fake.values_batch_update, **params)
+
+
+class FakeSpreadsheets(object):
+
+    def __init__(self, fake):
+        self.fake = fake
+
+    def create(self, **params):
+        return FakeRequest(self.fake, 'sheets.spreadsheets.create', 'POST', self.fake.create, **params)
+
+    def get(self, **params):
+        return FakeRequest(self.fake, 'sheets.spreadsheets.get', 'GET', self.fake.get, **params)
+
+    def batchUpdate(self, **params):
+        return FakeRequest(self.fake, 'sheets.spreadsheets.batchUpdate', 'POST', self.fake.batch_update,
+                           **params)
+
+    def values(self):
+        return FakeValues(self.fake)
+
+
+class FakeSheetsService(object):
+
+    def __init__(self, latency=0.0, error_rate=0.0, fail_every=None, error_status=429):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.fail_every = fail_every
+        self.error_status = error_status
+        self.spreadsheets_by_id = {}
+        self.request_count = 0
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def spreadsheets(self):
+        return FakeSpreadsheets(self)
+
+    def raw_request(self, uri, methodId):
+        # what init_service.http_get sends instead of an HTTP GET
+        return FakeRequest(self, methodId, 'GET', self.fetch, uri=uri)
+
+    # requests
+
+    def run(self, request):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.request_count += 1
+            self.requests.append(request.methodId)
+            if (self.fail_every and self.request_count % self.fail_every == 0) or \
+                    (self.error_rate and random.random() < self.error_rate):
+                raise self.error(self.error_status, 'Simulated error')
+            params = dict(request.params)
+            if request.body is not None:
+                params['body'] = json.loads(request.body)
+            return request.handler(**params)
+
+    def error(self, status, message):
+        content = json.dumps({'error': {'code': status, 'message': message}}).encode('utf-8')
+        return errors.HttpError(httplib2.Response({'status': status}), content)
+
+    def spreadsheet(self, spreadsheetId):
+        if spreadsheetId not in self.spreadsheets_by_id:
+            raise self.error(404, 'Requested entity was not found.')
+        return self.spreadsheets_by_id[spreadsheetId]
+
+    def sheet(self, spreadsheetId, title=None, sheet_id=None):
+        for sheet in self.spreadsheet(spreadsheetId)['sheets']:
+            if sheet['properties']['title'] == title or (title is None and sheet['properties']['sheetId'] == sheet_id):
+                return sheet
+        raise self.error(400, 'Unable to parse range: {}'.format(title))
+
+    def check_size(self, spreadsheetId):
+        total = 0
+        for sheet in self.spreadsheet(spreadsheetId)['sheets']:
+            grid = sheet['properties']['gridProperties']
+            total += grid['rowCount'] * grid['columnCount']
+        if total > MAX_CELLS:
+            raise self.error(400, 'This action would increase the number of cells in the workbook above the '
+                                  'limit of {} cells.'.format(MAX_CELLS))
+
+    # storage
+
+    def new_sheet(self, spreadsheet, properties):
+        properties = copy.deepcopy(properties or {})
+        taken = [sheet['properties']['sheetId'] for sheet in spreadsheet['sheets']]
+        if 'sheetId' not in properties or properties['sheetId'] in taken:
+            properties['sheetId'] = max(taken + [0]) + 1 if taken else 0
+        properties.setdefault('title', 'Sheet' + str(len(spreadsheet['sheets']) + 1))
+        properties.setdefault('sheetType', 'GRID')
+        grid = properties.setdefault('gridProperties', {})
+        grid.setdefault('rowCount', 1000)
+        grid.setdefault('columnCount', 26)
+        index = min(properties.get('index', len(spreadsheet['sheets'])), len(spreadsheet['sheets']))
+        for sheet in spreadsheet['sheets']:
+            if sheet['properties']['index'] >= index:
+                sheet['properties']['index'] += 1
+        properties['index'] = index
+        sheet = {'properties': properties, 'data': [], 'developerMetadata': []}
+        spreadsheet['sheets'].append(sheet)
+        spreadsheet['sheets'].sort(key=lambda item: item['properties']['index'])
+        return sheet
+
+    def bounds(self, sheet, start_row, start_col, end_row, end_col):
+        grid = sheet['properties']['gridProperties']
+        return (start_row, start_col,
+                grid['rowCount'] if end_row is None else min(end_row, grid['rowCount']),
+                grid['columnCount'] if end_col is None else min(end_col, grid['columnCount']))
+
+    def read(self, spreadsheetId, a1range, valueRenderOption=None, majorDimension=None, **params):
+        try:
+            title, start_row, start_col, end_row, end_col = ranges.parse(a1range)
+        except ValueError:
+            raise self.error(400, 'Unable to parse range: {}'.format(a1range))
+        sheet = self.sheet(spreadsheetId, title)
+        start_row, start_col, end_row, end_col = self.bounds(sheet, start_row, start_col, end_row, end_col)
+
+        rows = []
+        for row in sheet['data'][start_row:end_row]:
+            cells = row[start_col:end_col]
+            while cells and cells[-1] in ('', None):
+                cells = cells[:-1]
+            if valueRenderOption in (None, 'FORMATTED_VALUE'):
+                cells = [formatted(cell) if cell not in ('', None) else '' for cell in cells]
+            else:
+                cells = ['' if cell is None else cell for cell in cells]
+            rows.append(cells)
+        while rows and not rows[-1]:
+            rows.pop()
+
+        if majorDimension == 'COLUMNS':
+            width = max([len(row) for row in rows] + [0])
+            rows = [[row[col] if col < len(row) else '' for row in rows] for col in range(width)]
+            for column in rows:
+                while column and column[-1] == '':
+                    column.pop()
+
+        value_range = {
+            'range': ranges.to_a1(ranges.GridRange(sheet['properties']['title'], start_row, start_col,
+                                                   end_row if rows else start_row + 1,
+                                                   max(end_col, start_col + 1))),
+            'majorDimension': majorDimension or 'ROWS'
+        }
+        if rows:
+            value_range['values'] = rows
+        return value_range
+
+    def write(self, spreadsheetId, a1range, values, entered=True):
+        try:
+            title, start_row, start_col, _, _ = ranges.parse(a1range)
+        except ValueError:
+            raise self.error(400, 'Unable to parse range: {}'.format(a1range))
+        sheet = self.sheet(spreadsheetId, title)
+        grid = sheet['properties']['gridProperties']
+        data = sheet['data']
+
+        width = max([len(row) for row in values] + [0])
+        if start_col + width > ranges.MAX_COLUMNS:
+            raise self.error(400, 'Range ({}) exceeds grid limits.'.format(a1range))
+        grid['rowCount'] = max(grid['rowCount'], start_row + len(values))
+        grid['columnCount'] = max(grid['columnCount'], start_col + width)
+        self.check_size(spreadsheetId)
+
+        while len(data) < start_row + len(values):
+            data.append([])
+        for offset, row in enumerate(values):
+            target = data[start_row + offset]
+            if len(target) < start_col + len(row):
+                target.extend([''] * (start_col + len(row) - len(target)))
+            for col, value in enumerate(row):
+                target[start_col + col] = parse_entered(value) if entered else value
+        return {
+            'spreadsheetId': spreadsheetId,
+            'updatedRange': a1range,
+            'updatedRows': len(values),
+            'updatedColumns': width,
+            'updatedCells': sum(len(row) for row in values)
+        }
+
+    def clear_cells(self, sheet, start_row, start_col, end_row, end_col):
+        for row in sheet['data'][start_row:end_row]:
+            for col in range(start_col, min(end_col, len(row))):
+                row[col] = ''
+
+    # spreadsheets
+
+    def create(self, body=None, **params):
+        body = body or {}
+        spreadsheetId = uuid.uuid4().hex
+        spreadsheet = {
+            'spreadsheetId': spreadsheetId,
+            'properties': copy.deepcopy(body.get('properties', {'title': 'Untitled spreadsheet'})),
+            'sheets': []
+        }
+        for sheet in body.get('sheets') or [{'properties': {'title': 'Sheet1', 'sheetId': 0}}]:
+            self.new_sheet(spreadsheet, sheet.get('properties'))
+        self.spreadsheets_by_id[spreadsheetId] = spreadsheet
+        self.check_size(spreadsheetId)
+        response = self.get(spreadsheetId)
+        response['spreadsheetUrl'] = 'https://docs.google.com/spreadsheets/d/' + spreadsheetId
+        return response
+
+    def get(self, spreadsheetId, fields=None, **params):
+        spreadsheet = self.spreadsheet(spreadsheetId)
+        sheets = []
+        for sheet in spreadsheet['sheets']:
+            item = {'properties': copy.deepcopy(sheet['properties'])}
+            if sheet['developerMetadata']:
+                item['developerMetadata'] = copy.deepcopy(sheet['developerMetadata'])
+            sheets.append(item)
+        return {
+            'spreadsheetId': spreadsheetId,
+            'properties': copy.deepcopy(spreadsheet['properties']),
+            'sheets': sheets
+        }
+
+    def batch_update(self, spreadsheetId, body, **params):
+        spreadsheet = self.spreadsheet(spreadsheetId)
+        # requests are applied to a copy so a failing request changes nothing
+        backup = copy.deepcopy(spreadsheet)
+        try:
+            replies = [self.apply(spreadsheetId, request) for request in body.get('requests', [])]
+            self.check_size(spreadsheetId)
+        except Exception:
+            self.spreadsheets_by_id[spreadsheetId] = backup
+            raise
+        return {'spreadsheetId': spreadsheetId, 'replies': replies}
+
+    def apply(self, spreadsheetId, request):
+        spreadsheet = self.spreadsheet(spreadsheetId)
+        kind = list(request.keys())[0]
+        body = request[kind]
+
+        if kind == 'addSheet':
+            properties = body.get('properties', {})
+            titles = [sheet['properties']['title'].lower() for sheet in spreadsheet['sheets']]
+            if properties.get('title', '').lower() in titles:
+                raise self.error(400, 'A sheet with the name "{}" already exists.'.format(properties['title']))
+            sheet = self.new_sheet(spreadsheet, properties)
+            return {'addSheet': {'properties': copy.deepcopy(sheet['properties'])}}
+
+        if kind == 'deleteSheet':
+            sheet = self.sheet(spreadsheetId, sheet_id=body['sheetId'])
+            spreadsheet['sheets'].remove(sheet)
+            for index, item in enumerate(spreadsheet['sheets']):
+                item['properties']['index'] = index
+            return {}
+
+        if kind == 'updateSheetProperties':
+            sheet = self.sheet(spreadsheetId, sheet_id=body['properties']['sheetId'])
+            properties = sheet['properties']
+            if 'title' in body['properties']:
+                properties['title'] = body['properties']['title']
+            grid = body['properties'].get('gridProperties', {})
+            if 'rowCount' in grid:
+                properties['gridProperties']['rowCount'] = grid['rowCount']
+                del sheet['data'][grid['rowCount']:]
+            if 'columnCount' in grid:
+                properties['gridProperties']['columnCount'] = grid['columnCount']
+                for row in sheet['data']:
+                    del row[grid['columnCount']:]
+            return {}
+
+        if kind in ('deleteDimension', 'insertDimension'):
+            grid_range = body['range']
+            sheet = self.sheet(spreadsheetId, sheet_id=grid_range['sheetId'])
+            grid = sheet['properties']['gridProperties']
+            start, end = grid_range['startIndex'], grid_range['endIndex']
+            if grid_range['dimension'] == 'ROWS':
+                if kind == 'deleteDimension':
+                    if end - start >= grid['rowCount']:
+                        raise self.error(400, "You can't delete all the rows on the sheet.")
+                    del sheet['data'][start:end]
+                    grid['rowCount'] -= end - start
+                else:
+                    sheet['data'][start:start] = [[] for _ in range(end - start)]
+                    grid['rowCount'] += end - start
+            else:
+                for row in sheet['data']:
+                    if kind == 'deleteDimension':
+                        del row[start:end]
+                    elif len(row) > start:
+                        row[start:start] = [''] * (end - start)
+                grid['columnCount'] += (end - start) * (-1 if kind == 'deleteDimension' else 1)
+            return {}
+
+        if kind == 'appendDimension':
+            sheet = self.sheet(spreadsheetId, sheet_id=body['sheetId'])
+            key = 'rowCount' if body['dimension'] == 'ROWS' else 'columnCount'
+            sheet['properties']['gridProperties'][key] += body['length']
+            return {}
+
+        if kind == 'updateCells':
+            grid_range = body['range']
+            sheet = self.sheet(spreadsheetId, sheet_id=grid_range['sheetId'])
+            start_row, start_col, end_row, end_col = self.bounds(
+                sheet, grid_range.get('startRowIndex', 0), grid_range.get('startColumnIndex', 0),
+                grid_range.get('endRowIndex'), grid_range.get('endColumnIndex'))
+            if 'rows' in body:
+                raise self.error(400, 'The fake service only supports clearing cells with updateCells.')
+            self.clear_cells(sheet, start_row, start_col, end_row, end_col)
+            return {}
+
+        if kind == 'createDeveloperMetadata':
+            metadata = copy.deepcopy(body['developerMetadata'])
+            sheet = self.sheet(spreadsheetId, sheet_id=metadata['location']['sheetId'])
+            metadata['metadataId'] = random.randint(1, 2 ** 31)
+            sheet['developerMetadata'].append(metadata)
+            return {'createDeveloperMetadata': {'developerMetadata': copy.deepcopy(metadata)}}
+
+        if kind == 'updateDeveloperMetadata':
+            updated = []
+            for data_filter in body['dataFilters']:
+                lookup = data_filter['developerMetadataLookup']
+                for sheet in spreadsheet['sheets']:
+                    for metadata in sheet['developerMetadata']:
+                        if metadata['metadataId'] == lookup.get('metadataId'):
+                            metadata['metadataValue'] = body['developerMetadata']['metadataValue']
+                            updated.append(copy.deepcopy(metadata))
+            return {'updateDeveloperMetadata': {'developerMetadata': updated}}
+
+        raise self.error(400, 'The fake service does not support {} requests.'.format(kind))
+
+    # values
+
+    def values_get(self, spreadsheetId, range, **params):
+        return self.read(spreadsheetId, range, **params)
+
+    def values_batch_get(self, spreadsheetId, ranges, **params):
+        if not isinstance(ranges, (list, tuple)):
+            ranges = [ranges]
+        return {
+            'spreadsheetId': spreadsheetId,
+            'valueRanges': [self.read(spreadsheetId, a1range, **params) for a1range in ranges]
+        }
+
+    def values_update(self, spreadsheetId, range, body, valueInputOption='RAW', **params):
+        return self.write(spreadsheetId, range, body.get('values', []), valueInputOption == 'USER_ENTERED')
+
+    def values_clear(self, spreadsheetId, range, body=None, **params):
+        title, start_row, start_col, end_row, end_col = ranges.parse(range)
+        sheet = self.sheet(spreadsheetId, title)
+        self.clear_cells(sheet, *self.bounds(sheet, start_row, start_col, end_row, end_col))
+        return {'spreadsheetId': spreadsheetId, 'clearedRange': range}
+
+    def values_append(self, spreadsheetId, range, body, valueInputOption='RAW',
+                      insertDataOption='OVERWRITE', **params):
+        title = ranges.parse(range)[0]
+        sheet = self.sheet(spreadsheetId, title)
+        values = body.get('values', [])
+        # the table ends at the last row with anything in it
+        end = len(sheet['data'])
+        while end and not any(cell not in ('', None) for cell in sheet['data'][end - 1]):
+            end -= 1
+        if insertDataOption == 'INSERT_ROWS':
+            sheet['data'][end:end] = [[] for _ in values]
+            sheet['properties']['gridProperties']['rowCount'] += len(values)
+        updates = self.write(spreadsheetId, ranges.rows_range(title, end + 1, end + 1, 1), values,
+                             valueInputOption == 'USER_ENTERED')
+        return {'spreadsheetId': spreadsheetId, 'updates': updates}
+
+    def values_batch_update(self, spreadsheetId, body, **params):
+        entered = body.get('valueInputOption') == 'USER_ENTERED'
+        responses = [self.write(spreadsheetId, data['range'], data.get('values', []), entered)
+                     for data in body.get('data', [])]
+        return {
+            'spreadsheetId': spreadsheetId,
+            'totalUpdatedRows': sum(response['updatedRows'] for response in responses),
+            'totalUpdatedCells': sum(response['updatedCells'] for response in responses),
+            'responses': responses
+        }
+
+    # visualization queries
+
+    def fetch(self, uri):
+        parsed = urlparse(uri)
+        match = re.match(r'^/spreadsheets/d/([^/]+)/gviz/tq$', parsed.path)
+        if not match:
+            raise self.error(404, 'The fake service only answers visualization queries.')
+        params = dict((key, values[0]) for key, values in parse_qs(parsed.query).items())
+        sheet = self.sheet(match.group(1), params.get('sheet'))
+        query = QUERY_PATTERN.match(params.get('tq', ''))
+        if not query:
+            raise self.error(400, 'Invalid query: {}'.format(params.get('tq')))
+
+        data = sheet['data']
+        width = max([len(row) for row in data] + [0])
+        if query.group('select') and query.group('select').strip() != '*':
+            columns = [ranges.column_index(letters.strip()) for letters in query.group('select').split(',')]
+        else:
+            columns = list(range(width))
+
+        conditions = []
+        for condition in re.split(r'\s+and\s+', query.group('where') or '', flags=re.IGNORECASE):
+            if not condition.strip():
+                continue
+            parts = CONDITION_PATTERN.match(condition)
+            if not parts:
+                raise self.error(400, 'Invalid query: {}'.format(params.get('tq')))
+            letters, operator, literal = parts.groups()
+            value = literal[1:-1] if literal[0] in '\'"' else float(literal)
+            conditions.append((ranges.column_index(letters), operator, value))
+
+        def cell(row, col):
+            return row[col] if col < len(row) and row[col] is not None else ''
+
+        def matches(row):
+            for col, operator, value in conditions:
+                current = cell(row, col)
+                if isinstance(value, float) != (isinstance(current, (int, float)) and not isinstance(current, bool)):
+                    return False
+                if not {'=': current == value, '!=': current != value, '<>': current != value,
+                        '<': current < value, '>': current > value,
+                        '<=': current <= value, '>=': current >= value}[operator]:
+                    return False
+            return True
+
+        header = data[0] if data else []
+        rows = [row for row in data[1:] if any(value not in ('', None) for value in row) and matches(row)]
+        if query.group('limit'):
+            rows = rows[:int(query.group('limit'))]
+
+        output = io.StringIO()
+        writer = csv.writer(output, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        writer.writerow([formatted(cell(header, col)) if cell(header, col) != '' else '' for col in columns])
+        for row in rows:
+            writer.writerow([formatted(cell(row, col)) if cell(row, col) != '' else '' for col in columns])
+        return output.getvalue()
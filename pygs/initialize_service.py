@@ -1,22 +1,87 @@
 #!/usr/bin/env python
 
 import os
+import json
+import time
+import random
+import socket
 import datetime
+import threading
+from contextlib import contextmanager
 import httplib2
 from apiclient import discovery
+from apiclient import errors
 from oauth2client import client
 from oauth2client import tools
 from oauth2client.file import Storage
+#py3 compatible
+try:
+    import instrumentation
+except ImportError:
+    from . import instrumentation
 
 
+# The discovery-built service is only used to build requests, which is safe
+# to share between threads. Requests are executed on an authorized
+# httplib2.Http checked out of http_pool, since an Http object can't be used
+# by two threads at once. Idle Http objects keep their connections open.
 service_dict = {
     'service': None,
-    'last_updated': None
+    'credentials': None,
+    'last_updated': None,
+    'static': False
 }
 
+http_pool = {
+    'size': 8,
+    'idle': [],
+    'semaphore': threading.BoundedSemaphore(8)
+}
 
-def initialize_service(initializing=None):
-    global service_dict
+service_lock = threading.Lock()
+pool_lock = threading.Lock()
+
+# Every request waits for a token from each bucket that matches its kind
+# (read or write) before it's sent. The default rates are the Sheets API
+# quotas per project and per user, but the buckets only count the requests
+# of this process: on its own the lower limit is the one that applies, and
+# the project limit is for sharing the project's quota between processes.
+# Batch callers can't take the last 'interactive_reserve' share of a bucket,
+# so interactive calls go first.
+scheduler_dict = {
+    'buckets': {},
+    'limits': {
+        'project': 300,
+        'user': 60
+    },
+    'interactive_reserve': 0.2,
+    'max_retries': 5,
+    'base_delay': 1.0,
+    'max_delay': 64.0,
+    'stats': {
+        'requests_sent': 0,
+        'throttled': 0,
+        'retried': 0,
+        'wait_time': 0.0
+    }
+}
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+# requests that would be applied twice if a server error or dropped connection
+# came after the server had applied them, so they're only retried on 429
+NON_IDEMPOTENT_METHODS = ('sheets.spreadsheets.values.append', 'sheets.spreadsheets.create')
+# ...and the same for spreadsheets().batchUpdate calls carrying any of these
+NON_IDEMPOTENT_REQUESTS = ('addSheet', 'duplicateSheet', 'deleteDimension', 'insertDimension',
+                           'appendDimension', 'appendCells', 'insertRange', 'deleteRange')
+
+DISCOVERY_MAX_AGE = 7 * 24 * 60 * 60
+# seconds to wait for the discovery document before falling back to a stored copy
+DISCOVERY_TIMEOUT = 10
+
+scheduler_lock = threading.Lock()
+priority_state = threading.local()
+
+
+def get_credentials():
     SCOPES = 'https://www.googleapis.com/auth/spreadsheets'
     APPLICATION_NAME = 'PYGS - Python for Google Sheets'
 
@@ -48,24 +113,312 @@ def initialize_service(initializing=None):
         credentials = tools.run_flow(flow, store, flags)
         print('Storing credentials to ' + credential_path)
 
-    http = credentials.authorize(httplib2.Http())
+    return credentials
+
+
+def new_http():
+    # an Http object that signs its requests with the shared credentials
+    if service_dict['static']:
+        return None
+    return service_dict['credentials'].authorize(httplib2.Http())
+
+
+def get_discovery_document():
+    # The Sheets v4 discovery document, kept on disk next to the credentials
+    # so building a service doesn't need a network round trip. It's fetched
+    # again once a week, falling back to the stale copy if that fails, or
+    # to the copy bundled with googleapiclient if there's none.
     discoveryUrl = 'https://sheets.googleapis.com/$discovery/rest?version=v4'
+    cache_path = os.path.join(os.path.expanduser('~'), '.credentials', 'sheets.googleapis.com-v4-discovery.json')
+    bundled_path = os.path.join(os.path.dirname(discovery.__file__), 'discovery_cache', 'documents', 'sheets.v4.json')
 
-    if initializing:
-        service_dict['service'] = discovery.build('sheets', 'v4', http=http, cache_discovery=False, discoveryServiceUrl=discoveryUrl)
-        service_dict['last_updated'] = datetime.datetime.now()
-    else:
-        return discovery.build('sheets', 'v4', http=http, cache_discovery=False, discoveryServiceUrl=discoveryUrl)
+    document = None
+    if os.path.exists(cache_path):
+        with open(cache_path) as cache_file:
+            document = cache_file.read()
+        if time.time() - os.path.getmtime(cache_path) < DISCOVERY_MAX_AGE:
+            return document
+
+    try:
+        resp, content = httplib2.Http(timeout=DISCOVERY_TIMEOUT).request(discoveryUrl)
+        if resp.status >= 400:
+            raise httplib2.HttpLib2Error('Discovery document request failed with ' + str(resp.status))
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+        # make sure it parses before it's cached
+        json.loads(content)
+    except (socket.error, httplib2.HttpLib2Error, ValueError):
+        if document is not None:
+            return document
+        if os.path.exists(bundled_path):
+            with open(bundled_path) as bundled_file:
+                return bundled_file.read()
+        raise
+
+    if not os.path.exists(os.path.dirname(cache_path)):
+        os.makedirs(os.path.dirname(cache_path))
+    temp_path = cache_path + '.tmp' + str(os.getpid())
+    with open(temp_path, 'w') as cache_file:
+        cache_file.write(content)
+    os.rename(temp_path, cache_path)
+
+    return content
+
+
+def initialize_service(initializing=None):
+    global service_dict
+
+    with service_lock:
+        if service_dict['credentials'] is None or service_dict['credentials'].invalid:
+            service_dict['credentials'] = get_credentials()
+
+        service = discovery.build_from_document(get_discovery_document(), http=new_http())
+
+        if initializing:
+            service_dict['service'] = service
+            service_dict['last_updated'] = datetime.datetime.now()
+        else:
+            return service
+
+
+def use_service(service):
+    """
+    Makes pygs send every request to `service` instead of Google, e.g. a
+    pygs.fake_service.FakeSheetsService. Pass None to go back to Google.
+    """
+    with service_lock:
+        service_dict['service'] = service
+        service_dict['static'] = service is not None
+        service_dict['last_updated'] = None
+    with pool_lock:
+        del http_pool['idle'][:]
 
 
 def get_service():
     global service_dict
+    if service_dict['static']:
+        return service_dict['service']
     # get a new service every 30 minutes
-    outdated = datetime.datetime.now() > service_dict[
+    outdated = service_dict['last_updated'] is None or datetime.datetime.now() > service_dict[
         'last_updated'] + datetime.timedelta(minutes=30)
 
     if service_dict['service'] is None or outdated:
-        service_dict['service'] = initialize_service()
-        return service_dict['service']
+        initialize_service(initializing=True)
 
     return service_dict['service']
+
+
+def set_pool_size(size):
+    """
+    Sets how many HTTP connections pygs keeps for running requests at the
+    same time. Threads beyond that wait for a free connection.
+    """
+    if size < 1:
+        raise ValueError('The pool size must be at least 1.')
+    with pool_lock:
+        http_pool['size'] = size
+        http_pool['semaphore'] = threading.BoundedSemaphore(size)
+        del http_pool['idle'][size:]
+
+
+def refresh_credentials():
+    # refresh an expired access token once, before handing out connections,
+    # rather than letting every pooled connection hit a 401 and refresh
+    if service_dict['static']:
+        return
+    credentials = service_dict['credentials']
+    if credentials is None:
+        get_service()
+        credentials = service_dict['credentials']
+    if credentials.access_token_expired:
+        with service_lock:
+            if credentials.access_token_expired:
+                credentials.refresh(httplib2.Http())
+
+
+@contextmanager
+def pooled_http():
+    refresh_credentials()
+    semaphore = http_pool['semaphore']
+    semaphore.acquire()
+    try:
+        with pool_lock:
+            http = http_pool['idle'].pop() if http_pool['idle'] else None
+        if http is None:
+            http = new_http()
+        yield http
+        with pool_lock:
+            if semaphore is http_pool['semaphore'] and len(http_pool['idle']) < http_pool['size']:
+                http_pool['idle'].append(http)
+    finally:
+        semaphore.release()
+
+
+def configure_scheduler(requests_per_minute=None, user_requests_per_minute=None,
+                        interactive_reserve=None, max_retries=None, base_delay=None, max_delay=None):
+    with scheduler_lock:
+        if requests_per_minute is not None:
+            scheduler_dict['limits']['project'] = requests_per_minute
+        if user_requests_per_minute is not None:
+            scheduler_dict['limits']['user'] = user_requests_per_minute
+        for key, value in (('interactive_reserve', interactive_reserve), ('max_retries', max_retries),
+                           ('base_delay', base_delay), ('max_delay', max_delay)):
+            if value is not None:
+                scheduler_dict[key] = value
+        # start over with full buckets at the new rates
+        scheduler_dict['buckets'].clear()
+
+
+def get_scheduler_stats(reset=False):
+    with scheduler_lock:
+        stats = dict(scheduler_dict['stats'])
+        if reset:
+            for key in scheduler_dict['stats']:
+                scheduler_dict['stats'][key] = 0 if key != 'wait_time' else 0.0
+    return stats
+
+
+def get_priority():
+    return getattr(priority_state, 'priority', 'interactive')
+
+
+@contextmanager
+def request_priority(priority):
+    """
+    Runs the requests made inside the block as 'interactive' (the default)
+    or 'batch'. Batch requests leave part of each rate limit free for
+    interactive ones.
+    """
+    if priority not in ('interactive', 'batch'):
+        raise ValueError("priority must be either 'interactive' or 'batch'.")
+    previous = get_priority()
+    priority_state.priority = priority
+    try:
+        yield
+    finally:
+        priority_state.priority = previous
+
+
+def get_bucket(scope, kind, now):
+    # a token bucket holding up to one minute of requests, refilled continuously
+    key = (scope, kind)
+    capacity = float(scheduler_dict['limits'][scope])
+    bucket = scheduler_dict['buckets'].get(key)
+    if bucket is None:
+        bucket = scheduler_dict['buckets'][key] = {'tokens': capacity, 'updated': now}
+    bucket['tokens'] = min(capacity, bucket['tokens'] + (now - bucket['updated']) * capacity / 60.0)
+    bucket['updated'] = now
+    return bucket, capacity
+
+
+def acquire(kind):
+    # block until every bucket for this kind of request has a token to spare
+    reserve = scheduler_dict['interactive_reserve'] if get_priority() == 'batch' else 0.0
+    waited = 0.0
+    while True:
+        with scheduler_lock:
+            now = time.time()
+            buckets = [get_bucket(scope, kind, now) for scope in scheduler_dict['limits']]
+            wait = 0.0
+            for bucket, capacity in buckets:
+                needed = 1 + reserve * capacity - bucket['tokens']
+                if needed > 0:
+                    wait = max(wait, needed * 60.0 / capacity)
+            if wait == 0.0:
+                for bucket, _ in buckets:
+                    bucket['tokens'] -= 1
+                scheduler_dict['stats']['requests_sent'] += 1
+                if waited:
+                    scheduler_dict['stats']['throttled'] += 1
+                    scheduler_dict['stats']['wait_time'] += waited
+                return
+        time.sleep(wait)
+        waited += wait
+
+
+def retry_delay(attempt):
+    # exponential backoff with full jitter
+    delay = min(scheduler_dict['max_delay'], scheduler_dict['base_delay'] * (2 ** attempt))
+    return random.uniform(0, delay)
+
+
+class RawRequest(object):
+    """
+    A GET to a Google URL outside the Sheets API, such as the visualization
+    query endpoint, that can be run with execute() like an API request.
+    """
+    method = 'GET'
+    body = None
+
+    def __init__(self, uri, methodId):
+        self.uri = uri
+        self.methodId = methodId
+
+    def execute(self, http=None):
+        resp, content = (http or new_http()).request(self.uri, 'GET')
+        if resp.status >= 400:
+            raise errors.HttpError(resp, content, uri=self.uri)
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+        return content
+
+
+def http_get(uri, methodId='http.get'):
+    # the body of an authorized GET, with the same pooling, limits and retries as API requests
+    if service_dict['static']:
+        request = get_service().raw_request(uri, methodId)
+    else:
+        request = RawRequest(uri, methodId)
+    return execute(request)
+
+
+def is_idempotent(request):
+    # whether sending the request twice leaves the spreadsheet as sending it once
+    methodId = getattr(request, 'methodId', None)
+    if methodId in NON_IDEMPOTENT_METHODS:
+        return False
+    if methodId == 'sheets.spreadsheets.batchUpdate' and getattr(request, 'body', None):
+        body = json.loads(request.body)
+        return not any(kind in NON_IDEMPOTENT_REQUESTS
+                       for item in body.get('requests', []) for kind in item)
+    return True
+
+
+def execute(request, cells=None):
+    """
+    Runs a request built from get_service() on a pooled connection, within
+    the rate limits, retrying quota errors (429), server errors (5xx) and
+    dropped connections with exponential backoff. Requests that change the
+    spreadsheet again when repeated (appends, spreadsheet creation and
+    batchUpdates that add or remove sheets, rows or columns), which may have
+    been applied when a 5xx or a dropped connection comes back, are only
+    retried on 429. `cells` is recorded with the
+    request's timing if given.
+    """
+    kind = 'read' if getattr(request, 'method', 'GET') == 'GET' else 'write'
+    idempotent = is_idempotent(request)
+    body = getattr(request, 'body', None)
+    with instrumentation.timed('request', getattr(request, 'methodId', 'unknown'),
+                               payload_bytes=len(body) if body else 0,
+                               cells=cells, retries=0) as event:
+        attempt = 0
+        while True:
+            acquire(kind)
+            try:
+                with pooled_http() as http:
+                    return request.execute(http=http)
+            except errors.HttpError as error:
+                status = int(error.resp.status)
+                if status not in RETRYABLE_STATUSES or (status != 429 and not idempotent) or \
+                        attempt >= scheduler_dict['max_retries']:
+                    raise
+            except (socket.error, httplib2.HttpLib2Error):
+                if not idempotent or attempt >= scheduler_dict['max_retries']:
+                    raise
+            delay = retry_delay(attempt)
+            with scheduler_lock:
+                scheduler_dict['stats']['retried'] += 1
+                scheduler_dict['stats']['wait_time'] += delay
+            time.sleep(delay)
+            attempt += 1
+            event['retries'] = attempt
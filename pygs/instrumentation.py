@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+Timings and sizes for everything pygs does.
+
+Every public pygs call ('call'), every API request ('request') and the
+main steps in between ('phase': serializing a DataFrame, encoding a
+request body, building a DataFrame from a response) produce an event dict:
+
+    {'kind': 'request', 'name': 'sheets.spreadsheets.values.batchUpdate',
+     'latency': 0.42, 'payload_bytes': 181022, 'cells': 25000, 'retries': 0,
+     'error': None}
+
+Events are added up in memory (see get_metrics) and passed to any callbacks
+registered with add_callback, such as the logging and StatsD exporters below.
+"""
+import time
+import socket
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+
+instrumentation_dict = {
+    'callbacks': [],
+    'metrics': {}
+}
+instrumentation_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def add_callback(callback):
+    """Calls `callback(event)` for every event from now on."""
+    with instrumentation_lock:
+        instrumentation_dict['callbacks'].append(callback)
+
+
+def remove_callback(callback):
+    with instrumentation_lock:
+        if callback in instrumentation_dict['callbacks']:
+            instrumentation_dict['callbacks'].remove(callback)
+
+
+def get_metrics(reset=False):
+    """
+    Returns the totals per (kind, name): 'count', 'errors', 'total_time',
+    'max_time', 'payload_bytes', 'cells' and 'retries'.
+    """
+    with instrumentation_lock:
+        metrics = dict((key, dict(value)) for key, value in instrumentation_dict['metrics'].items())
+        if reset:
+            instrumentation_dict['metrics'].clear()
+    return metrics
+
+
+def emit(event):
+    with instrumentation_lock:
+        key = (event['kind'], event['name'])
+        totals = instrumentation_dict['metrics'].get(key)
+        if totals is None:
+            totals = instrumentation_dict['metrics'][key] = {
+                'count': 0, 'errors': 0, 'total_time': 0.0, 'max_time': 0.0,
+                'payload_bytes': 0, 'cells': 0, 'retries': 0
+            }
+        totals['count'] += 1
+        totals['errors'] += 1 if event.get('error') else 0
+        totals['total_time'] += event['latency']
+        totals['max_time'] = max(totals['max_time'], event['latency'])
+        for field in ('payload_bytes', 'cells', 'retries'):
+            totals[field] += event.get(field) or 0
+        callbacks = list(instrumentation_dict['callbacks'])
+
+    for callback in callbacks:
+        # a broken exporter shouldn't break the call it's measuring
+        try:
+            callback(event)
+        except Exception:
+            logger.exception('pygs instrumentation callback failed')
+
+
+@contextmanager
+def timed(kind, name, **fields):
+    """
+    Times the block and emits an event for it. Fields can be added to the
+    yielded event dict inside the block.
+    """
+    event = dict(fields, kind=kind, name=name, error=None)
+    start = time.time()
+    try:
+        yield event
+    except Exception as error:
+        event['error'] = type(error).__name__
+        raise
+    finally:
+        event['latency'] = time.time() - start
+        emit(event)
+
+
+def instrument(kind):
+    # decorator that times every call of a function as one event
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(kind, func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def logging_exporter(log=None, level=logging.INFO):
+    """A callback that logs one line per event."""
+    log = log or logger
+
+    def export(event):
+        log.log(level, '%s %s %.3fs payload_bytes=%s cells=%s retries=%s error=%s',
+                event['kind'], event['name'], event['latency'], event.get('payload_bytes'),
+                event.get('cells'), event.get('retries'), event.get('error'))
+    return export
+
+
+def statsd_exporter(host='localhost', port=8125, prefix='pygs'):
+    """A callback that sends StatsD timers and counters over UDP."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def export(event):
+        name = '{}.{}.{}'.format(prefix, event['kind'], event['name'].replace('.', '_'))
+        lines = ['{}.latency:{}|ms'.format(name, int(event['latency'] * 1000)),
+                 '{}.count:1|c'.format(name)]
+        for field in ('payload_bytes', 'cells', 'retries'):
+            if event.get(field):
+                lines.append('{}.{}:{}|c'.format(name, field, event[field]))
+        if event.get('error'):
+            lines.append('{}.errors:1|c'.format(name))
+        try:
+            sock.sendto('\n'.join(lines).encode('utf-8'), (host, port))
+        except socket.error:
+            pass
+    return export
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""
+Preparing upload requests on several cores.
+
+encode_chunks splits a DataFrame into windows of rows that each fit in one
+values().batchUpdate request, and has a pool of worker processes serialize
+and JSON encode them, so the work isn't held up by the GIL. Numeric,
+boolean and datetime columns are copied once into shared memory, which the
+workers read their rows from; other columns are pickled a window at a time.
+Windows are encoded a few at a time ahead of the upload, so encoded chunks
+are sent while later ones are still being encoded:
+
+    pytools.write_blocks(spreadsheetId, None, chunks=encode_chunks(df, 'Data', 1, True, processes=4))
+"""
+import os
+import json
+import math
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+import numpy as np
+import pandas as pd
+#py3 compatible
+try:
+    import pygs_tools as pytools
+    import ranges
+except ImportError:
+    from . import pygs_tools as pytools
+    from . import ranges
+
+process_dict = {
+    'executor': None,
+    'processes': None
+}
+process_lock = threading.Lock()
+
+SHARED_KINDS = 'biufmM'
+
+
+def cpu_count():
+    return os.cpu_count() or 1
+
+
+def get_executor(processes):
+    # one pool for the whole process, started again if the size changes
+    with process_lock:
+        if process_dict['executor'] is None or process_dict['processes'] != processes:
+            if process_dict['executor'] is not None:
+                process_dict['executor'].shutdown(wait=True)
+            process_dict['executor'] = ProcessPoolExecutor(max_workers=processes)
+            process_dict['processes'] = processes
+        return process_dict['executor']
+
+
+def shutdown():
+    with process_lock:
+        if process_dict['executor'] is not None:
+            process_dict['executor'].shutdown(wait=True)
+        process_dict['executor'] = None
+        process_dict['processes'] = None
+
+
+def share_columns(df, datetime_format):
+    # {position: (segment, dtype)} for the columns workers can read from shared memory
+    shared = {}
+    if shared_memory is None:
+        return shared
+    for position in range(df.shape[1]):
+        column = df.iloc[:, position]
+        if isinstance(column.dtype, pd.DatetimeTZDtype):
+            if datetime_format not in ('iso', 'serial'):
+                # a pattern may show the offset, so the workers need the time zone
+                continue
+            # .values of a tz-aware column are in UTC, the sheet gets the wall time
+            column = column.dt.tz_localize(None)
+        values = column.values
+        if not isinstance(values, np.ndarray) or values.dtype.kind not in SHARED_KINDS or not len(values):
+            continue
+        segment = shared_memory.SharedMemory(create=True, size=values.nbytes)
+        np.ndarray(values.shape, dtype=values.dtype, buffer=segment.buf)[:] = values
+        shared[position] = (segment, values.dtype.str)
+    return shared
+
+
+def encode_window(task):
+    """
+    Runs in a worker process: serializes and encodes rows [start, stop) of
+    the frame described by `task` into pieces of at most `max_bytes`, in the
+    form write_blocks sends, with the JSON of their values in 'encoded'.
+    """
+    start, stop = task['start'], task['stop']
+    segments = []
+    columns = []
+    try:
+        for position in range(task['width']):
+            if position in task['shared']:
+                name, dtype, length = task['shared'][position]
+                segment = shared_memory.SharedMemory(name=name)
+                segments.append(segment)
+                values = np.ndarray((length,), dtype=np.dtype(dtype), buffer=segment.buf)[start:stop]
+                series = pd.Series(values)
+            else:
+                series = task['columns'][position]
+            columns.append(pytools.serialize_column(series, task['datetime_format']))
+            # drop the views on shared memory before it's closed
+            series = values = None
+    finally:
+        for segment in segments:
+            segment.close()
+
+    rows = [list(row) for row in zip(*columns)]
+    del columns
+    first_row = task['first_row']
+    if task['header'] is not None:
+        rows.insert(0, task['header'])
+
+    # split further if the encoded rows are over the byte budget
+    encoded = json.dumps(rows)
+    parts = max(1, int(math.ceil(len(encoded) / float(task['max_bytes']))))
+    step = max(1, int(math.ceil(len(rows) / float(parts))))
+    pieces = []
+    for offset in range(0, len(rows), step):
+        piece_rows = rows[offset:offset + step]
+        piece_encoded = encoded if parts == 1 else json.dumps(piece_rows)
+        last_row = first_row + offset + len(piece_rows) - 1
+        pieces.append({
+            'range': ranges.rows_range(task['sheet_name'], first_row + offset, last_row, task['width']),
+            'sheet_name': task['sheet_name'],
+            'last_row': last_row,
+            'width': task['width'],
+            'encoded': piece_encoded,
+            'rows': len(piece_rows),
+            'cells': len(piece_rows) * task['width'],
+            'bytes': len(piece_encoded)
+        })
+    return pieces
+
+
+def encode_chunks(df, sheet_name, start_row=1, header=True, max_cells=None, max_bytes=None,
+                  processes=None, datetime_format=None):
+    """
+    Yields the chunks for write_blocks(chunks=...) that write `df` to
+    `sheet_name` from the 1-based `start_row`, encoded in `processes` worker
+    processes (all cores if None). At most two windows per process are
+    encoded ahead of the chunk being sent.
+    """
+    max_cells = max_cells or pytools.CHUNK_CELLS
+    max_bytes = max_bytes or pytools.CHUNK_BYTES
+    processes = processes or cpu_count()
+    datetime_format = datetime_format or pytools.DATETIME_FORMAT
+    width = df.shape[1]
+    window_rows = max(1, max_cells // max(1, width))
+
+    executor = get_executor(processes)
+    shared = share_columns(df, datetime_format)
+    shared_names = dict((position, (segment.name, dtype, len(df)))
+                        for position, (segment, dtype) in shared.items())
+    pending = deque()
+    try:
+        # windows of sheet rows, the header taking the first row of the first one
+        total_rows = len(df) + (1 if header else 0)
+        for offset in range(0, total_rows, window_rows):
+            start = max(0, offset - (1 if header else 0))
+            stop = min(len(df), offset + window_rows - (1 if header else 0))
+            task = {
+                'start': start,
+                'stop': stop,
+                'width': width,
+                'shared': shared_names,
+                'columns': dict((position, df.iloc[start:stop, position])
+                                for position in range(width) if position not in shared),
+                'header': [str(col) for col in df.columns] if header and offset == 0 else None,
+                'first_row': start_row + offset,
+                'sheet_name': sheet_name,
+                'datetime_format': datetime_format,
+                'max_bytes': max_bytes
+            }
+            pending.append(executor.submit(encode_window, task))
+            if len(pending) >= processes * 2:
+                for piece in pending.popleft().result():
+                    yield [piece]
+        while pending:
+            for piece in pending.popleft().result():
+                yield [piece]
+    finally:
+        for future in pending:
+            future.cancel()
+        for future in pending:
+            if not future.cancelled():
+                future.exception()
+        for segment, _ in shared.values():
+            segment.close()
+            segment.unlink()
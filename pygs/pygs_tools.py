@@ -1,20 +1,342 @@
 #!/usr/bin/env python
-import string
+import io
+import re
+import csv
+import json
+import copy
+import time
+import uuid
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 #py3 compatible
 try:
     import initialize_service as init_service
+    import instrumentation
+    import ranges
 except ImportError:
     from . import initialize_service as init_service
+    from . import instrumentation
+    from . import ranges
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
 import pandas as pd
+import numpy as np
 from numpy import nan
 import math
 
+# budgets for a single values().batchUpdate request when writing in chunks
+CHUNK_CELLS = 250000
+CHUNK_BYTES = 8 * 1024 * 1024
+MAX_WORKERS = 4
+CHUNK_RETRIES = 3
+
+# rows fetched per values().get when reading a sheet in windows
+READ_CHUNK_ROWS = 10000
+# grid cells covered by the ranges of a single values().batchGet
+READ_BATCH_CELLS = 1000000
+# rows sent per values().append when appending to a sheet
+APPEND_CHUNK_ROWS = 10000
+# rows hashed together into one block fingerprint by read_changes
+CHANGE_BLOCK_ROWS = 500
+
+# spreadsheet metadata is cached per spreadsheetId for 'ttl' seconds and
+# kept current from the replies to our own batchUpdate calls
+metadata_cache = {
+    'ttl': 300,
+    'spreadsheets': {}
+}
+metadata_lock = threading.Lock()
+
+# row hashes of what pygs last wrote to each (spreadsheetId, sheet_name), so
+# diff updates don't have to read the sheet back first. They're trusted for
+# FINGERPRINT_TTL seconds, and only while the sheet's write stamp is the one
+# they were taken under, since hand edits don't show up in them
+fingerprint_cache = {}
+FINGERPRINT_TTL = 300
+# strings the sheet turns into numbers and datetimes when they're entered
+ENTERED_NUMBER = re.compile(r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$')
+ENTERED_DATETIME = re.compile(r'^\d{4}-\d{2}-\d{2}( \d{2}:\d{2}:\d{2}(\.\d+)?)?$')
+# the column of read_changes frames saying how each row changed
+CHANGE_COLUMN = '_change'
+# block and row hashes of what read_changes last saw of each sheet, so the
+# next call only looks at the rows of blocks that changed
+change_cache = {}
+# how serialize_df sends datetimes: 'iso' strings that Sheets parses as
+# dates, 'serial' day numbers counted from the Sheets epoch, or any strftime
+# pattern, whose strings Sheets may keep as text. Sheets has no time zones,
+# so tz-aware columns are sent as their wall time unless a pattern shows
+# the offset with '%z'.
+DATETIME_FORMAT = 'iso'
+ISO_DATETIME = '%Y-%m-%d %H:%M:%S.%f'
+SHEETS_EPOCH = np.datetime64('1899-12-30')
+# pygs writers leave a new value under this developer metadata key on each
+# sheet they change, so cached reads can tell whether a sheet was written to
+STAMP_KEY = 'pygs_write_stamp'
+# the most cells a spreadsheet can hold, across the grids of all its sheets
+SPREADSHEET_CELLS = 5000000
+# sharded datasets are described by JSON in A1 of this sheet
+MANIFEST_SHEET = '_pygs_manifest'
+METADATA_FIELDS = ('sheets(properties(sheetId,title,index,gridProperties(rowCount,columnCount)),'
+                   'developerMetadata(metadataId,metadataKey,metadataValue))')
+
+
+def get_metadata(spreadsheetId, refresh=False):
+    # the sheets of a spreadsheet in the shape spreadsheets().get returns them
+    with metadata_lock:
+        entry = metadata_cache['spreadsheets'].get(spreadsheetId)
+        if entry and not refresh and time.time() - entry['fetched'] < metadata_cache['ttl']:
+            return copy.deepcopy(entry['metadata'])
+
+    service = init_service.get_service()
+    current_state = init_service.execute(service.spreadsheets().get(
+        spreadsheetId=spreadsheetId, fields=METADATA_FIELDS))
+
+    cache_metadata(spreadsheetId, current_state)
+    return copy.deepcopy(current_state)
+
+
+def cache_metadata(spreadsheetId, current_state):
+    metadata = {'sheets': [{'properties': copy.deepcopy(sheet['properties']),
+                            'developerMetadata': [copy.deepcopy(item)
+                                                  for item in sheet.get('developerMetadata', [])
+                                                  if item.get('metadataKey') == STAMP_KEY]}
+                           for sheet in current_state.get('sheets', [])]}
+    with metadata_lock:
+        metadata_cache['spreadsheets'][spreadsheetId] = {
+            'metadata': metadata,
+            'fetched': time.time()
+        }
+
+
+def invalidate_metadata(spreadsheetId=None):
+    with metadata_lock:
+        if spreadsheetId is None:
+            metadata_cache['spreadsheets'].clear()
+            fingerprint_cache.clear()
+        else:
+            metadata_cache['spreadsheets'].pop(spreadsheetId, None)
+            for key in [key for key in fingerprint_cache if key[0] == spreadsheetId]:
+                del fingerprint_cache[key]
+
+
+def cached_sheets(spreadsheetId):
+    # the cached sheet list for in-place updates, or None. Call with the lock held.
+    entry = metadata_cache['spreadsheets'].get(spreadsheetId)
+    if entry is None:
+        return None
+    return entry['metadata']['sheets']
+
+
+def find_cached_sheet(sheets, sheet_id=None, title=None):
+    for sheet in sheets:
+        properties = sheet['properties']
+        if properties.get('sheetId') == sheet_id or (title is not None and properties['title'] == title):
+            return properties
+    return None
+
+
+def renumber_sheets(sheets):
+    sheets.sort(key=lambda sheet: sheet['properties'].get('index', 0))
+    for index, sheet in enumerate(sheets):
+        sheet['properties']['index'] = index
+
+
+def apply_batch_update(spreadsheetId, requests, response):
+    # mirror the structural changes of a batchUpdate in the metadata cache
+    with metadata_lock:
+        sheets = cached_sheets(spreadsheetId)
+        if sheets is None:
+            return
+        replies = response.get('replies', [])
+        for position, request in enumerate(requests):
+            reply = replies[position] if position < len(replies) else {}
+            kind = list(request.keys())[0]
+            body = request[kind]
+
+            if kind in ('addSheet', 'duplicateSheet'):
+                properties = reply.get(kind, {}).get('properties')
+                if properties is None:
+                    # nothing to go on, fetch again next time
+                    metadata_cache['spreadsheets'].pop(spreadsheetId, None)
+                    return
+                # later sheets move down one place
+                for sheet in sheets:
+                    if sheet['properties'].get('index', 0) >= properties.get('index', len(sheets)):
+                        sheet['properties']['index'] = sheet['properties'].get('index', 0) + 1
+                sheets.append({'properties': copy.deepcopy(properties), 'developerMetadata': []})
+                renumber_sheets(sheets)
+
+            elif kind == 'deleteSheet':
+                sheets[:] = [sheet for sheet in sheets
+                             if sheet['properties'].get('sheetId') != body['sheetId']]
+                renumber_sheets(sheets)
+
+            elif kind == 'updateSheetProperties':
+                properties = find_cached_sheet(sheets, sheet_id=body['properties'].get('sheetId'))
+                if properties is None:
+                    continue
+                for key in ('title', 'index'):
+                    if key in body['properties']:
+                        properties[key] = body['properties'][key]
+                grid = body['properties'].get('gridProperties', {})
+                for key in ('rowCount', 'columnCount'):
+                    if key in grid:
+                        properties['gridProperties'][key] = grid[key]
+                if 'index' in body['properties']:
+                    renumber_sheets(sheets)
+
+            elif kind in ('deleteDimension', 'insertDimension', 'appendDimension'):
+                if kind == 'appendDimension':
+                    sheet_id = body['sheetId']
+                    dimension = body['dimension']
+                    change = body['length']
+                else:
+                    sheet_id = body['range']['sheetId']
+                    dimension = body['range']['dimension']
+                    change = body['range']['endIndex'] - body['range']['startIndex']
+                    if kind == 'deleteDimension':
+                        change = -change
+                properties = find_cached_sheet(sheets, sheet_id=sheet_id)
+                if properties is None:
+                    continue
+                key = 'rowCount' if dimension == 'ROWS' else 'columnCount'
+                properties['gridProperties'][key] += change
+
+            elif kind == 'createDeveloperMetadata':
+                metadata = reply.get(kind, {}).get('developerMetadata')
+                if metadata is None or metadata.get('metadataKey') != STAMP_KEY:
+                    continue
+                for sheet in sheets:
+                    if sheet['properties'].get('sheetId') == metadata.get('location', {}).get('sheetId'):
+                        sheet.setdefault('developerMetadata', []).append(
+                            dict((key, metadata[key]) for key in ('metadataId', 'metadataKey', 'metadataValue')))
+
+            elif kind == 'updateDeveloperMetadata':
+                ids = [data_filter['developerMetadataLookup'].get('metadataId')
+                       for data_filter in body['dataFilters']]
+                for sheet in sheets:
+                    for item in sheet.get('developerMetadata', []):
+                        if item['metadataId'] in ids:
+                            item['metadataValue'] = body['developerMetadata']['metadataValue']
+
+
+def note_grid_size(spreadsheetId, sheet_name, rows, cols):
+    # values writes past the edge of a sheet grow its grid
+    with metadata_lock:
+        sheets = cached_sheets(spreadsheetId)
+        if sheets is None:
+            return
+        properties = find_cached_sheet(sheets, title=sheet_name)
+        if properties is None:
+            return
+        grid = properties['gridProperties']
+        grid['rowCount'] = max(grid['rowCount'], rows)
+        grid['columnCount'] = max(grid['columnCount'], cols)
+
+
+def add_grid_rows(spreadsheetId, sheet_name, rows):
+    # values().append with INSERT_ROWS adds rows to the grid
+    with metadata_lock:
+        sheets = cached_sheets(spreadsheetId)
+        if sheets is None:
+            return
+        properties = find_cached_sheet(sheets, title=sheet_name)
+        if properties is not None:
+            properties['gridProperties']['rowCount'] += rows
+
+
+def grid_cells(current_state):
+    # the number of cells in every sheet's grid, which counts toward the 5M limit
+    total_cells = 0
+    for sheet in current_state['sheets']:
+        grid = sheet['properties']['gridProperties']
+        total_cells += grid['columnCount'] * grid['rowCount']
+    return total_cells
+
+
+def batch_update(spreadsheetId, requests):
+    # spreadsheets().batchUpdate that keeps the metadata cache current
+    service = init_service.get_service()
+    response = init_service.execute(service.spreadsheets().batchUpdate(
+        spreadsheetId=spreadsheetId, body={'requests': requests}))
+    apply_batch_update(spreadsheetId, requests, response)
+    return response
+
+
+def sheet_stamp(sheet):
+    # the write stamp of a sheet from get_metadata, or None if pygs never wrote to it
+    values = sorted(item['metadataValue'] for item in sheet.get('developerMetadata', [])
+                    if item.get('metadataKey') == STAMP_KEY)
+    return ','.join(values) if values else None
+
+
+def stamp_requests(spreadsheetId, sheet_names):
+    """
+    batchUpdate requests that give each sheet a new write stamp, updating
+    the stamps pygs already knows about and creating the rest. Send them
+    after the data, in the batchUpdate that finishes the write if there is
+    one, so a read can never cache new data under the old stamp.
+    """
+    requests = []
+    for sheet in get_metadata(spreadsheetId)['sheets']:
+        if sheet['properties']['title'] not in sheet_names:
+            continue
+        value = uuid.uuid4().hex
+        ids = [item['metadataId'] for item in sheet.get('developerMetadata', [])
+               if item.get('metadataKey') == STAMP_KEY]
+        if ids:
+            requests.append({
+                'updateDeveloperMetadata': {
+                    'dataFilters': [{'developerMetadataLookup': {'metadataId': metadata_id}}
+                                    for metadata_id in ids],
+                    'developerMetadata': {'metadataValue': value},
+                    'fields': 'metadataValue'
+                }
+            })
+        else:
+            requests.append({
+                'createDeveloperMetadata': {
+                    'developerMetadata': {
+                        'metadataKey': STAMP_KEY,
+                        'metadataValue': value,
+                        'location': {'sheetId': sheet['properties']['sheetId']},
+                        'visibility': 'DOCUMENT'
+                    }
+                }
+            })
+    return requests
+
+
+def restamp(spreadsheetId, sheet_names):
+    """
+    Gives sheets a new write stamp after a write to them failed part way,
+    so cached reads of what they held before aren't served any more. It's
+    called while handling the write's error, which is the one to raise, so
+    a failure here is ignored.
+    """
+    try:
+        batch_update(spreadsheetId, stamp_requests(spreadsheetId, sheet_names))
+    except Exception:
+        pass
+
+
+def read_stamp(spreadsheetId, sheet_name=None, refresh=True):
+    # (title, stamp) of a sheet as it is now, with a fresh metadata fetch unless refresh is False
+    current_state = get_metadata(spreadsheetId, refresh=refresh)
+    properties = get_sheet_properties(spreadsheetId, sheet_name)
+    for sheet in current_state['sheets']:
+        if sheet['properties']['sheetId'] == properties['sheetId']:
+            return properties['title'], sheet_stamp(sheet)
+    return properties['title'], None
+
 
 def get_all_sheet_names(spreadsheetId):
+    # fetched fresh, the cache wouldn't have sheets added by someone else
     all_sheets = []
-    service = init_service.get_service()
-    current_state = service.spreadsheets().get(
-        spreadsheetId=spreadsheetId).execute()
+    current_state = get_metadata(spreadsheetId, refresh=True)
 
     for sheet in current_state['sheets']:
         all_sheets.append(sheet['properties']['title'])
@@ -22,52 +344,105 @@ def get_all_sheet_names(spreadsheetId):
     return all_sheets
 
 
-def clean_sheet_name(sheet_name, spreadsheetId):
-    service = init_service.get_service()
-    current_state = service.spreadsheets().get(
-        spreadsheetId=spreadsheetId).execute()
-    tot_names = []
-    for sheet in current_state['sheets']:
-        if sheet_name.lower() == sheet['properties']['title'].lower():
-            try:
-                name_split = sheet['properties'][
-                    'title'].split(sheet_name + "_")
-                if len(name_split) > 1:
-                    tot_names.append(int(name_split[-1]))
-                else:
-                    tot_names.append(0)
-            except ValueError:
-                pass
-    if len(tot_names) == 0:
+def unique_sheet_name(sheet_name, titles):
+    # sheet_name, or sheet_name_N for the lowest N not already in titles
+    taken = set(title.lower() for title in titles)
+    if sheet_name.lower() not in taken:
         return sheet_name
-    new_sheet_name = sheet_name + "_" + str(max(tot_names) + 1)
-    return new_sheet_name
+    number = 1
+    while (sheet_name + "_" + str(number)).lower() in taken:
+        number += 1
+    return sheet_name + "_" + str(number)
 
 
-def getEndCol(two_dim_array):
-    array_length = len(two_dim_array[0])
+def clean_sheet_name(sheet_name, spreadsheetId):
+    # the name has to be free now, not just in the cached sheet list
+    current_state = get_metadata(spreadsheetId, refresh=True)
+    titles = [sheet['properties']['title'] for sheet in current_state['sheets']]
+    return unique_sheet_name(sheet_name, titles)
 
-    if array_length > 702:
-        raise ValueError(
-            "You have more than 702 columns which would be past column 'ZZ'. \
-            Please make smarter choices.")
 
-    lookup_dict = {}
-    for pos, char in enumerate(string.ascii_uppercase):
-        lookup_dict[pos + 1] = char
+def get_sheet_properties(spreadsheetId, sheet_name=None, refresh=False):
+    # properties of the named sheet, or of the first sheet if no name is given.
+    # With refresh, the metadata is fetched again first, for the current grid size.
+    current_state = get_metadata(spreadsheetId, refresh=refresh)
 
-    if array_length <= 26:
-        return lookup_dict[array_length]
+    if not sheet_name:
+        return current_state['sheets'][0]['properties']
 
-    if array_length % 26 == 0:
-        first_letter = lookup_dict[
-            (array_length % 26) + math.floor((array_length / 26)) - 1]
-        second_letter = 'Z'
-    else:
-        first_letter = lookup_dict[math.floor(array_length / 26)]
-        second_letter = lookup_dict[array_length % 26]
+    for retry in (False, True):
+        if retry and not refresh:
+            # the sheet may have been added since the metadata was cached
+            current_state = get_metadata(spreadsheetId, refresh=True)
+        for sheet in current_state['sheets']:
+            if sheet['properties']['title'] == sheet_name:
+                return sheet['properties']
+        if refresh:
+            break
+
+    raise ValueError(
+        "Unable to find '{}' in the spreadsheet. Please check the sheet name again.".format(sheet_name))
 
-    return first_letter + second_letter
+
+def resize_requests(properties, rows=None, cols=None):
+    # updateSheetProperties to set the grid size of a sheet
+    grid = {}
+    if rows is not None and rows != properties['gridProperties']['rowCount']:
+        grid['rowCount'] = rows
+    if cols is not None and cols != properties['gridProperties']['columnCount']:
+        grid['columnCount'] = cols
+    if not grid:
+        return []
+    return [{
+        "updateSheetProperties": {
+            "properties": {
+                "sheetId": properties['sheetId'],
+                "gridProperties": grid
+            },
+            "fields": ",".join("gridProperties." + key for key in sorted(grid))
+        }
+    }]
+
+
+def trim_requests(properties, rows, width, current_cols):
+    """
+    The requests that finish replacing a sheet's contents once `rows` rows of
+    `width` cells have been written from A1: old values to the right of the
+    new data are cleared and rows below it are removed. `current_cols` is the
+    column count from before the write. The row count is always set, even
+    when the cached grid size says it already matches, since rows added to
+    the sheet since it was cached would otherwise survive the replace.
+    """
+    requests = []
+    if width < current_cols:
+        requests.append({
+            "updateCells": {
+                "range": {
+                    "sheetId": properties['sheetId'],
+                    "startRowIndex": 0,
+                    "endRowIndex": rows,
+                    "startColumnIndex": width
+                },
+                "fields": "userEnteredValue"
+            }
+        })
+    requests.append({
+        "updateSheetProperties": {
+            "properties": {
+                "sheetId": properties['sheetId'],
+                "gridProperties": {"rowCount": rows}
+            },
+            "fields": "gridProperties.rowCount"
+        }
+    })
+    return requests
+
+
+def getEndCol(two_dim_array):
+    # the letters of the last column of the rows
+    array_length = len(two_dim_array[0])
+    ranges.check_columns(array_length)
+    return ranges.column_letter(array_length - 1)
 
 
 def cleanDF(df):
@@ -94,6 +469,62 @@ def cleanDF(df):
     return df
 
 
+def serialize_column(series, datetime_format):
+    # a list of JSON-ready cell values for one column, converted by dtype
+    missing = series.isnull().values
+
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        if datetime_format in ('iso', 'serial') and getattr(series.dt, 'tz', None) is not None:
+            series = series.dt.tz_localize(None)
+        if datetime_format == 'serial':
+            values = (series.values - SHEETS_EPOCH) / np.timedelta64(1, 'D')
+            values = values.astype(object)
+        elif datetime_format == 'iso':
+            # fractional seconds only on the values that have them
+            values = series.dt.strftime(ISO_DATETIME).str.replace('.000000', '', regex=False)
+            values = values.values.astype(object)
+        else:
+            values = series.dt.strftime(datetime_format).values.astype(object)
+    elif pd.api.types.is_timedelta64_dtype(series.dtype):
+        values = series.astype(str).values.astype(object)
+    elif pd.api.types.is_bool_dtype(series.dtype) or pd.api.types.is_numeric_dtype(series.dtype):
+        values = series.values
+        if pd.api.types.is_float_dtype(series.dtype):
+            # inf can't be sent as JSON, treat it like a missing value
+            missing = missing | series.isin([np.inf, -np.inf]).values
+        if not missing.any():
+            return values.tolist()
+        values = values.astype(object)
+    else:
+        values = series.values.astype(object)
+        values[missing] = ''
+        return values.astype(str).tolist()
+
+    values[missing] = ''
+    return values.tolist()
+
+
+def serialize_df(df, header=True, datetime_format=None):
+    """
+    Converts a DataFrame into the list of rows sent to Google Sheets, one
+    column at a time. Numbers and booleans stay JSON numbers and booleans,
+    datetimes are sent as `datetime_format` says (see DATETIME_FORMAT),
+    missing values become empty cells and everything else is sent as a
+    string.
+    """
+    datetime_format = datetime_format or DATETIME_FORMAT
+    with instrumentation.timed('phase', 'serialize', cells=df.size):
+        columns = [serialize_column(df.iloc[:, position], datetime_format)
+                   for position in range(df.shape[1])]
+        paste_data = [list(row) for row in zip(*columns)]
+        del columns
+
+    if header:
+        paste_data.insert(0, [str(col) for col in df.columns])
+    return paste_data
+
+
+@instrumentation.instrument('phase')
 def fixResponse(response):
     # return response
 
@@ -124,3 +555,882 @@ def fixResponse(response):
     # if we only have a header row, just make the empty DF
     if len(response['values']) == 1:
         return pd.DataFrame(columns=response['values'][0])
+
+
+def estimate_row_bytes(rows, sample_size=100):
+    # approximate the JSON size of a row from an evenly spaced sample
+    if not rows:
+        return 0
+    step = max(1, len(rows) // sample_size)
+    sample = rows[::step][:sample_size]
+    return int(math.ceil(len(json.dumps(sample)) / float(len(sample))))
+
+
+def split_block(sheet_name, start_row, rows, max_cells, max_bytes):
+    # break one block of rows into pieces that fit the cell and byte budgets
+    if not rows:
+        return
+    width = max(1, max(len(row) for row in rows))
+    row_bytes = max(1, estimate_row_bytes(rows))
+    step = max(1, min(max_cells // width, max_bytes // row_bytes))
+
+    for offset in range(0, len(rows), step):
+        piece = rows[offset:offset + step]
+        first_row = start_row + offset
+        last_row = first_row + len(piece) - 1
+        yield {
+            'range': ranges.rows_range(sheet_name, first_row, last_row, width),
+            'sheet_name': sheet_name,
+            'last_row': last_row,
+            'width': width,
+            'values': piece,
+            'rows': len(piece),
+            'cells': len(piece) * width,
+            'bytes': len(piece) * row_bytes
+        }
+
+
+def pack_chunks(blocks, max_cells, max_bytes):
+    # group pieces from every block into requests that stay under the budgets
+    chunk = []
+    cells = 0
+    size = 0
+    for sheet_name, start_row, rows in blocks:
+        for piece in split_block(sheet_name, start_row, rows, max_cells, max_bytes):
+            if chunk and (cells + piece['cells'] > max_cells or size + piece['bytes'] > max_bytes):
+                yield chunk
+                chunk = []
+                cells = 0
+                size = 0
+            chunk.append(piece)
+            cells += piece['cells']
+            size += piece['bytes']
+    if chunk:
+        yield chunk
+
+
+def send_chunk(spreadsheetId, chunk, priority):
+    # worker threads don't inherit the caller's request priority
+    with init_service.request_priority(priority):
+        return send_values(spreadsheetId, chunk)
+
+
+def set_request_body(request, body):
+    # swap the JSON body of a built request, as the client does for paging
+    request.body = body
+    if hasattr(request, 'body_size'):
+        request.body_size = len(body)
+    if 'content-length' in getattr(request, 'headers', {}):
+        del request.headers['content-length']
+
+
+def send_values(spreadsheetId, chunk):
+    service = init_service.get_service()
+    # pieces encoded ahead of time (see process_pool) go in as placeholders
+    # that are swapped for their JSON once the request is built
+    body = {
+        'valueInputOption': 'USER_ENTERED',
+        'data': [{'range': piece['range'],
+                  'values': piece['values'] if 'encoded' not in piece else '__pygs_values_{}__'.format(position)}
+                 for position, piece in enumerate(chunk)]
+    }
+    cells = sum(piece['cells'] for piece in chunk)
+    # the request body is JSON encoded when the request is built
+    with instrumentation.timed('phase', 'encode', cells=cells) as event:
+        request = service.spreadsheets().values().batchUpdate(spreadsheetId=spreadsheetId, body=body)
+        encoded = request.body or ''
+        for position, piece in enumerate(chunk):
+            if 'encoded' in piece:
+                encoded = encoded.replace('"__pygs_values_{}__"'.format(position), piece['encoded'], 1)
+        if encoded != (request.body or ''):
+            set_request_body(request, encoded)
+        event['payload_bytes'] = len(encoded)
+    return init_service.execute(request, cells=cells)
+
+
+def write_blocks(spreadsheetId, blocks, max_cells=None, max_bytes=None,
+                 max_workers=None, retries=None, progress=None, chunks=None):
+    """
+    Writes blocks of rows with values().batchUpdate from a bounded pool of
+    worker threads. `blocks` is an iterable of (sheet_name, start_row, rows)
+    tuples where start_row is the 1-based sheet row of the first row.
+    Already packed `chunks`, such as process_pool.encode_chunks yields, can
+    be passed instead. Chunks that fail are retried on their own, up to
+    `retries` extra rounds.
+    `progress`, if given, is called with a dict after every finished chunk.
+    """
+    max_cells = max_cells or CHUNK_CELLS
+    max_bytes = max_bytes or CHUNK_BYTES
+    max_workers = max_workers or MAX_WORKERS
+    retries = CHUNK_RETRIES if retries is None else retries
+
+    state = {'chunks_done': 0, 'rows_done': 0, 'cells_done': 0}
+    failed = []
+    priority = init_service.get_priority()
+
+    def finished(future, number, chunk, attempt):
+        try:
+            future.result()
+        except Exception as error:
+            failed.append((number, chunk, error))
+            return
+        for piece in chunk:
+            note_grid_size(spreadsheetId, piece['sheet_name'], piece['last_row'], piece['width'])
+        rows = sum(piece['rows'] for piece in chunk)
+        cells = sum(piece['cells'] for piece in chunk)
+        state['chunks_done'] += 1
+        state['rows_done'] += rows
+        state['cells_done'] += cells
+        if progress is not None:
+            progress({
+                'chunk': number,
+                'attempt': attempt,
+                'rows': rows,
+                'cells': cells,
+                'chunks_done': state['chunks_done'],
+                'rows_done': state['rows_done'],
+                'cells_done': state['cells_done']
+            })
+
+    def run(numbered_chunks, attempt):
+        # keep at most two chunks per worker in flight so a generator of
+        # blocks is consumed lazily instead of being materialized up front
+        pending = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for number, chunk in numbered_chunks:
+                if len(pending) >= max_workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finished(future, *pending.pop(future))
+                future = executor.submit(send_chunk, spreadsheetId, chunk, priority)
+                pending[future] = (number, chunk, attempt)
+            for future in list(pending):
+                future.exception()
+                finished(future, *pending.pop(future))
+
+    if chunks is None:
+        chunks = pack_chunks(blocks, max_cells, max_bytes)
+    run(enumerate(chunks), 0)
+
+    for attempt in range(1, retries + 1):
+        if not failed:
+            break
+        to_retry = [(number, chunk) for number, chunk, _ in failed]
+        del failed[:]
+        run(to_retry, attempt)
+
+    if failed:
+        raise failed[0][2]
+
+    return state
+
+
+def ordered_map(function, items, max_workers=None):
+    """
+    Yields function(item) for each item in order, with up to `max_workers`
+    calls running at once in threads and at most two per worker done ahead
+    of the caller. Without max_workers the calls are made one at a time.
+    """
+    if not max_workers or max_workers <= 1:
+        for item in items:
+            yield function(item)
+        return
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= max_workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_sheet_windows(spreadsheetId, sheet_name, row_count, chunk_rows=None, render_options=None,
+                       max_workers=None, first_row=2, col_count=None):
+    """
+    Reads a sheet in windows of `chunk_rows` rows and yields (header, rows)
+    for every window that has data. The header is the first row of the
+    sheet, read with the first window. Blank rows are kept in place even
+    when they fall at the end of a window, so joining the windows gives the
+    same rows as a single read. If the sheet only has a header,
+    (header, []) is yielded once.
+    `row_count` can come from cached metadata: the last window runs to the
+    end of the sheet (across `col_count` columns), so rows added since are
+    read too, and a sheet that fits in one window is read with a single
+    values().get of the whole sheet. `render_options` are passed on to
+    every values().get call. With `max_workers`, that many windows are
+    fetched at once. The windows start at the 1-based sheet row
+    `first_row`, just below the header by default.
+    """
+    chunk_rows = chunk_rows or READ_CHUNK_ROWS
+    render_options = render_options or {}
+    service = init_service.get_service()
+    # worker threads don't inherit the caller's request priority
+    priority = init_service.get_priority()
+
+    def fetch(window):
+        with init_service.request_priority(priority):
+            response = init_service.execute(service.spreadsheets().values()
+                                            .get(spreadsheetId=spreadsheetId, range=ranges.to_a1(window),
+                                                 **render_options))
+        return window, response.get('values', [])
+
+    header = None
+    if first_row > 2:
+        # picking up part way down the sheet, the header is read on its own
+        response = init_service.execute(service.spreadsheets().values()
+                                        .get(spreadsheetId=spreadsheetId, range=ranges.rows_range(sheet_name, 1, 1),
+                                             **render_options))
+        header = response['values'][0] if 'values' in response else None
+
+    windows = ranges.split_rows(ranges.GridRange(sheet_name, first_row - 1, 0, max(row_count, first_row)),
+                                chunk_rows)
+    if first_row == 2:
+        # the first window takes the header with it
+        windows[0] = windows[0]._replace(start_row=0)
+    if windows[-1].start_row == 0:
+        windows[-1] = ranges.GridRange(sheet_name)
+    elif col_count:
+        windows[-1] = windows[-1]._replace(end_row=None, end_col=col_count)
+
+    yielded = False
+    blank_rows = 0
+    for window, rows in ordered_map(fetch, windows, max_workers):
+        size = window.end_row - window.start_row if window.end_row is not None else None
+        if window.start_row == 0:
+            header = rows[0] if rows else None
+            rows = rows[1:]
+            size = size - 1 if size is not None else None
+        if rows:
+            # blank rows trimmed from the end of earlier windows go back in
+            yield (header or []), [[] for _ in range(blank_rows)] + rows
+            yielded = True
+            blank_rows = 0
+        if size is not None:
+            blank_rows += size - len(rows)
+
+    if not yielded and header is not None:
+        yield header, []
+
+
+def pad_unnamed_columns(df, header, width):
+    # add the empty 'Unnamed Sheet Col' columns fixResponse would have made
+    # if this frame had been read together with wider rows
+    extra = max(0, df.shape[1] - len(header))
+    for x in range(extra + 1, width - len(header) + 1):
+        df["Unnamed Sheet Col " + str(x)] = ''
+    return df
+
+
+def iter_sheet_frames(spreadsheetId, sheet_name=None, chunk_rows=None, render_options=None):
+    # yields (header, DataFrame) for each window of the sheet
+    properties = get_sheet_properties(spreadsheetId, sheet_name)
+    grid = properties['gridProperties']
+
+    width = 0
+    for header, rows in iter_sheet_windows(spreadsheetId, properties['title'], grid['rowCount'],
+                                           chunk_rows, render_options, col_count=grid['columnCount']):
+        df = fixResponse({'values': [header] + rows})
+        # keep the columns of later blocks in line with the earlier ones
+        width = max(width, df.shape[1])
+        yield header, pad_unnamed_columns(df, header, width)
+
+
+def read_sheet_frame(spreadsheetId, sheet_name=None, chunk_rows=None, render_options=None):
+    # the whole sheet as one unconverted DataFrame, read window by window
+    header = None
+    frames = []
+    for header, df in iter_sheet_frames(spreadsheetId, sheet_name, chunk_rows, render_options):
+        frames.append(df)
+
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0]
+    # blocks read before a wider one are missing its extra columns
+    width = frames[-1].shape[1]
+    frames = [pad_unnamed_columns(df, header, width) for df in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def get_render_options(value_render_option=None, date_time_render_option=None):
+    # keyword arguments for values().get, leaving out the ones not set
+    render_options = {}
+    if value_render_option:
+        render_options['valueRenderOption'] = value_render_option
+    if date_time_render_option:
+        render_options['dateTimeRenderOption'] = date_time_render_option
+    return render_options
+
+
+def to_datetime(series):
+    # serial day numbers from UNFORMATTED_VALUE reads, or date strings
+    try:
+        serial = pd.to_numeric(series)
+    except (ValueError, TypeError):
+        return pd.to_datetime(series)
+    return pd.to_datetime(serial, unit='D', origin=pd.Timestamp('1899-12-30'))
+
+
+def convert_column(series, dtype):
+    if dtype in ('str', 'object', str, object):
+        return series.astype(dtype)
+    series = series.replace('', nan)
+    if dtype in ('datetime', 'datetime64', 'datetime64[ns]'):
+        return to_datetime(series)
+    if dtype == 'category':
+        return series.astype(dtype)
+    # numeric types go through to_numeric so number strings parse too
+    return pd.to_numeric(series).astype(dtype)
+
+
+def convert_types(df, dtype=None, parse_dates=None, infer=False):
+    """
+    Converts the columns of a frame built by fixResponse in place of their
+    string/object values. `dtype` is a single type for every column or a
+    {column: type} dict, `parse_dates` a list of columns to turn into
+    datetimes. With `infer`, the remaining columns holding only numbers
+    (as UNFORMATTED_VALUE reads return them) become numeric columns.
+    Empty cells become missing values in every converted column.
+    """
+    if df.empty and not len(df.columns):
+        return df
+
+    if dtype is not None and not isinstance(dtype, dict):
+        dtype = dict((col, dtype) for col in df.columns)
+    dtype = dtype or {}
+    parse_dates = parse_dates or []
+
+    for col in list(dtype) + list(parse_dates):
+        if col not in df.columns:
+            raise ValueError("Column '{}' is not in the sheet.".format(col))
+
+    for col in df.columns:
+        if col in parse_dates:
+            df[col] = to_datetime(df[col].replace('', nan))
+        elif col in dtype:
+            df[col] = convert_column(df[col], dtype[col])
+        elif infer:
+            series = df[col].replace('', nan)
+            kind = pd.api.types.infer_dtype(series, skipna=True)
+            if kind in ('integer', 'floating', 'mixed-integer-float'):
+                df[col] = pd.to_numeric(series)
+            elif kind == 'boolean' and not series.isnull().any():
+                df[col] = series.astype(bool)
+    return df
+
+
+def entered_value(cell):
+    """
+    A cell the way the sheet stores it once it's entered, so rows sent by
+    serialize_df and rows read back UNFORMATTED hash alike: ISO datetimes
+    become serial day numbers, number and boolean strings become numbers
+    and booleans, and numbers keep the 15 significant digits the sheet
+    does, with 3.0 and 3 treated alike.
+    """
+    if isinstance(cell, str):
+        if cell in ('TRUE', 'FALSE'):
+            return cell == 'TRUE'
+        if ENTERED_NUMBER.match(cell):
+            cell = float(cell)
+        elif ENTERED_DATETIME.match(cell):
+            try:
+                cell = float((np.datetime64(cell.replace(' ', 'T')) - SHEETS_EPOCH) / np.timedelta64(1, 'D'))
+            except ValueError:
+                return cell
+        else:
+            return cell
+    if isinstance(cell, float):
+        cell = float('%.15g' % cell)
+        if cell.is_integer():
+            return int(cell)
+    return cell
+
+
+def normalize_row(row):
+    # drop trailing empty cells and put the rest in their entered form
+    end = len(row)
+    while end and row[end - 1] in ('', None):
+        end -= 1
+    return tuple(entered_value(cell) for cell in row[:end])
+
+
+def row_hashes(rows):
+    return [hash(normalize_row(row)) for row in rows]
+
+
+def get_fingerprint(spreadsheetId, sheet_name, stamp=None):
+    # the cached fingerprint, or None if it's older than FINGERPRINT_TTL or
+    # was taken under another write stamp than `stamp`
+    with metadata_lock:
+        fingerprint = fingerprint_cache.get((spreadsheetId, sheet_name))
+    if fingerprint is None or fingerprint.get('stamp') != stamp or \
+            time.time() - fingerprint.get('time', 0) >= FINGERPRINT_TTL:
+        return None
+    return fingerprint
+
+
+def set_fingerprint(spreadsheetId, sheet_name, fingerprint):
+    with metadata_lock:
+        if fingerprint is None:
+            fingerprint_cache.pop((spreadsheetId, sheet_name), None)
+        else:
+            fingerprint_cache[(spreadsheetId, sheet_name)] = fingerprint
+
+
+def read_fingerprint(spreadsheetId, sheet_name, row_count, chunk_rows=None, col_count=None):
+    # row hashes of the sheet as it is now, read window by window
+    render_options = get_render_options('UNFORMATTED_VALUE')
+    started = time.time()
+    hashes = []
+    width = 0
+    first = True
+    for header, rows in iter_sheet_windows(spreadsheetId, sheet_name, row_count, chunk_rows, render_options,
+                                           col_count=col_count):
+        if first:
+            rows = [header] + rows
+            first = False
+        hashes.extend(row_hashes(rows))
+        width = max([width] + [len(row) for row in rows])
+    return {'hashes': hashes, 'width': width, 'time': started}
+
+
+def changed_blocks(sheet_name, paste_data, new_hashes, old_hashes, width):
+    # (sheet_name, start_row, rows) for each run of rows that differ, padded
+    # to `width` so cells left over from wider old rows are cleared
+    start = None
+    for position in range(len(paste_data) + 1):
+        changed = position < len(paste_data) and \
+            (position >= len(old_hashes) or new_hashes[position] != old_hashes[position])
+        if changed and start is None:
+            start = position
+        elif not changed and start is not None:
+            rows = [row + [''] * (width - len(row)) for row in paste_data[start:position]]
+            yield sheet_name, start + 1, rows
+            start = None
+
+
+def diff_sync(spreadsheetId, sheet_name, paste_data, properties, max_cells=None,
+              max_workers=None, progress=None):
+    """
+    Brings a sheet in line with `paste_data` by writing only the rows that
+    changed since the last pygs write (or, without one, since a fresh read
+    of the sheet) and deleting rows below the new data. `properties` should
+    come from freshly fetched metadata, whose write stamp tells whether
+    the last write was ours.
+    Returns the number of rows written.
+    """
+    row_count = properties['gridProperties']['rowCount']
+
+    old = get_fingerprint(spreadsheetId, sheet_name, read_stamp(spreadsheetId, sheet_name, refresh=False)[1])
+    if old is None:
+        old = read_fingerprint(spreadsheetId, sheet_name, row_count,
+                               col_count=properties['gridProperties']['columnCount'])
+
+    new_hashes = row_hashes(paste_data)
+    new_width = max(len(row) for row in paste_data)
+    width = max(new_width, old['width'])
+
+    # forget the old state before writing, a failed write leaves it unknown
+    set_fingerprint(spreadsheetId, sheet_name, None)
+
+    try:
+        state = write_blocks(spreadsheetId,
+                             changed_blocks(sheet_name, paste_data, new_hashes, old['hashes'], width),
+                             max_cells=max_cells,
+                             max_workers=max_workers,
+                             progress=progress)
+    except Exception:
+        restamp(spreadsheetId, [sheet_name])
+        raise
+
+    requests = []
+    if len(paste_data) < row_count:
+        requests.append({
+            "deleteDimension": {
+                "range": {
+                    'sheetId': properties['sheetId'],
+                    'dimension': 'ROWS',
+                    'startIndex': len(paste_data),
+                    'endIndex': row_count
+                }
+            }
+        })
+    if requests or state['rows_done']:
+        batch_update(spreadsheetId, requests + stamp_requests(spreadsheetId, [sheet_name]))
+
+    # the stamp the write just left, from the metadata cache batch_update keeps
+    # current. Rows that weren't written are only known as of the last read,
+    # so the fingerprint ages from then
+    set_fingerprint(spreadsheetId, sheet_name, {
+        'hashes': new_hashes,
+        'width': new_width,
+        'stamp': read_stamp(spreadsheetId, sheet_name, refresh=False)[1],
+        'time': old['time']
+    })
+    return state['rows_done']
+
+
+def get_change_state(key):
+    with metadata_lock:
+        return change_cache.get(key)
+
+
+def set_change_state(key, state):
+    with metadata_lock:
+        if state is None:
+            change_cache.pop(key, None)
+        else:
+            change_cache[key] = state
+
+
+def sheet_changes(spreadsheetId, sheet_name, old, key=None, chunk_rows=None, block_rows=None,
+                  render_options=None):
+    """
+    Reads a sheet window by window and compares it with `old`, the state
+    returned by an earlier call (None for the first one), one block of
+    `block_rows` rows at a time. Rows are only looked at in blocks whose
+    hash changed. Rows are matched by position, or by the value in their
+    `key` column when it's given.
+
+    Returns (header, changes, state), where changes are (change, row, values)
+    tuples sorted by row: 'inserted' and 'updated' rows with their 1-based
+    sheet row and current values, 'deleted' rows with the row they were on
+    and no values (only their key, with `key`). A changed header starts
+    over, as if there were no `old`.
+    """
+    chunk_rows = chunk_rows or READ_CHUNK_ROWS
+    block_rows = block_rows or CHANGE_BLOCK_ROWS
+    render_options = render_options or {}
+
+    # rows added by hand since the metadata was cached grow the grid
+    properties = get_sheet_properties(spreadsheetId, sheet_name, refresh=True)
+    title = properties['title']
+    service = init_service.get_service()
+
+    header = None
+    position = None
+    blocks = []
+    hashes = []
+    keys = []
+    width = 0
+    candidates = []
+    for window in ranges.split_rows(ranges.GridRange(title, 0, 0, properties['gridProperties']['rowCount']),
+                                    chunk_rows):
+        response = init_service.execute(service.spreadsheets().values()
+                                        .get(spreadsheetId=spreadsheetId, range=ranges.to_a1(window),
+                                             **render_options))
+        rows = response.get('values', [])
+        # keep trailing blank rows so blocks line up with the same sheet rows every time
+        rows = rows + [[] for _ in range(window.end_row - window.start_row - len(rows))]
+        if header is None:
+            header = rows[0] if rows else []
+            rows = rows[1:]
+            if old is not None and old['header'] != header:
+                # renamed or moved columns change every row
+                old = None
+            if key is not None:
+                if key not in header:
+                    raise ValueError(
+                        "Unable to find the column '{}' in '{}'. Please check the column names again.".format(
+                            key, title))
+                position = header.index(key)
+
+        for offset in range(0, len(rows), block_rows):
+            block = rows[offset:offset + block_rows]
+            # rows come back the same way every read, so they're hashed as they are
+            block_hash = hash(tuple(map(tuple, block)))
+            first = len(hashes)
+            unchanged = old is not None and len(blocks) < len(old['blocks']) and \
+                old['blocks'][len(blocks)] == block_hash
+            if unchanged:
+                block_hashes = old['hashes'][first:first + len(block)]
+                if key is not None:
+                    keys.extend(old['keys'][first:first + len(block)])
+            else:
+                block_hashes = [hash(tuple(row)) for row in block]
+                if key is not None:
+                    keys.extend(row[position] if position < len(row) else '' for row in block)
+                for number, (row, row_hash) in enumerate(zip(block, block_hashes)):
+                    index = first + number
+                    if key is not None or old is None or index >= len(old['hashes']) or \
+                            old['hashes'][index] != row_hash:
+                        candidates.append((index, row))
+            blocks.append(block_hash)
+            hashes.extend(block_hashes)
+            width = max([width] + [len(row) for row in block])
+
+    # the data ends at the last row with anything in it
+    empty = hash(())
+    length = len(hashes)
+    while length and hashes[length - 1] == empty:
+        length -= 1
+    old_length = old['rows'] if old is not None else 0
+    state = {'header': header or [], 'blocks': blocks, 'hashes': hashes, 'keys': keys,
+             'rows': length, 'width': width}
+
+    changes = []
+    if key is None:
+        for index, row in candidates:
+            if index < min(length, old_length):
+                changes.append(('updated', index + 2, row))
+            elif index < length:
+                changes.append(('inserted', index + 2, row))
+            elif index < old_length:
+                changes.append(('deleted', index + 2, None))
+        # rows of a grid that shrank aren't read at all
+        for index in range(max(len(hashes), length), old_length):
+            changes.append(('deleted', index + 2, None))
+    else:
+        old_rows = {}
+        if old is not None:
+            for index in range(old_length):
+                if old['hashes'][index] != empty:
+                    old_rows[old['keys'][index]] = (index, old['hashes'][index])
+        current = set(keys[index] for index in range(length) if hashes[index] != empty)
+        for index, row in candidates:
+            if index >= length or hashes[index] == empty:
+                continue
+            previous = old_rows.get(keys[index])
+            if previous is None:
+                changes.append(('inserted', index + 2, row))
+            elif previous[1] != hashes[index]:
+                changes.append(('updated', index + 2, row))
+        for value, (index, _) in old_rows.items():
+            if value not in current:
+                changes.append(('deleted', index + 2, [''] * position + [value]))
+
+    changes.sort(key=lambda change: change[1])
+    return state['header'], changes, state
+
+
+def changes_frame(header, changes, width, key=None, dtype=None, parse_dates=None, infer=False):
+    """
+    The changes from sheet_changes as a DataFrame indexed by sheet row,
+    typed like read_google_sheet would type it, with CHANGE_COLUMN first.
+    Deleted rows only have their key filled in, so typed columns get
+    missing values for them.
+    """
+    present = [change for change in changes if change[0] != 'deleted']
+    deleted = [change for change in changes if change[0] == 'deleted']
+
+    df = pad_unnamed_columns(fixResponse({'values': [header] + [values for _, _, values in present]}),
+                             header, width)
+    df = convert_types(df, dtype, parse_dates, infer)
+    df.insert(0, CHANGE_COLUMN, [change for change, _, _ in present])
+    df.index = [row for _, row, _ in present]
+
+    if deleted:
+        gone = pd.DataFrame({CHANGE_COLUMN: ['deleted'] * len(deleted)}, index=[row for _, row, _ in deleted])
+        if key is not None:
+            keys = pd.DataFrame({key: [values[header.index(key)] for _, _, values in deleted]}, index=gone.index)
+            keys_dtype, keys_dates = select_columns(keys, dtype, parse_dates)
+            gone[key] = convert_types(keys, keys_dtype, keys_dates, infer)[key]
+        # a deleted row stays after the row that took its place
+        df = pd.concat([df, gone], sort=False).sort_index(kind='mergesort')
+    df.index.name = 'row'
+    return df
+
+
+def write_rows(spreadsheetId, sheet_name, rows, max_cells=None, max_workers=None, progress=None):
+    """
+    Writes `rows`, a dict of 1-based sheet row numbers to rows, with each run
+    of consecutive row numbers sent as one block, then stamps the sheet.
+    """
+    blocks = []
+    for number in sorted(rows):
+        if blocks and number == blocks[-1][1] + len(blocks[-1][2]):
+            blocks[-1][2].append(rows[number])
+        else:
+            blocks.append((sheet_name, number, [rows[number]]))
+
+    # the rows written are no longer what a diff update would compare against
+    set_fingerprint(spreadsheetId, sheet_name, None)
+    state = write_blocks(spreadsheetId, blocks,
+                         max_cells=max_cells,
+                         max_workers=max_workers,
+                         progress=progress)
+    batch_update(spreadsheetId, stamp_requests(spreadsheetId, [sheet_name]))
+    return state
+
+
+def batch_get(spreadsheetId, a1ranges, render_options=None, max_cells=None):
+    """
+    Reads many ranges with as few values().batchGet calls as possible,
+    grouping ranges until their sheets' grid sizes reach `max_cells`.
+    Returns the valueRanges in the order of `a1ranges`.
+    """
+    max_cells = max_cells or READ_BATCH_CELLS
+    render_options = render_options or {}
+
+    grid_cells = {}
+    for sheet in get_metadata(spreadsheetId)['sheets']:
+        grid = sheet['properties']['gridProperties']
+        grid_cells[sheet['properties']['title']] = grid['rowCount'] * grid['columnCount']
+
+    groups = []
+    cells = 0
+    for a1range in a1ranges:
+        # a range can't cover more than its whole sheet
+        size = grid_cells.get(ranges.sheet_title(a1range), 0)
+        if not groups or (cells + size > max_cells and groups[-1]):
+            groups.append([])
+            cells = 0
+        groups[-1].append(a1range)
+        cells += size
+
+    service = init_service.get_service()
+    value_ranges = []
+    for group in groups:
+        response = init_service.execute(service.spreadsheets().values()
+                                        .batchGet(spreadsheetId=spreadsheetId, ranges=group,
+                                                  **render_options))
+        value_ranges.extend(response.get('valueRanges', []))
+    return value_ranges
+
+
+def select_columns(df, dtype, parse_dates):
+    # narrow dtype/parse_dates settings down to the columns a frame has
+    if isinstance(dtype, dict):
+        dtype = dict((col, kind) for col, kind in dtype.items() if col in df.columns)
+    if parse_dates:
+        parse_dates = [col for col in parse_dates if col in df.columns]
+    return dtype, parse_dates
+
+
+def column_runs(indices):
+    # (first, last) for each run of consecutive column indices
+    runs = []
+    for index in sorted(set(indices)):
+        if runs and index == runs[-1][1] + 1:
+            runs[-1][1] = index
+        else:
+            runs.append([index, index])
+    return [tuple(run) for run in runs]
+
+
+def read_columns(spreadsheetId, sheet_name, usecols, render_options=None):
+    """
+    Reads just the `usecols` columns of a sheet, given by header or 0-based
+    position, with a batchGet of one range per run of adjacent columns.
+    Returns the rows, in sheet order, in the shape values().get does.
+    """
+    header = get_header_row(spreadsheetId, sheet_name) or []
+    indices = []
+    for col in usecols:
+        if col in header:
+            indices.append(header.index(col))
+        elif isinstance(col, int) and not isinstance(col, bool) and col >= 0:
+            indices.append(col)
+        else:
+            raise ValueError(
+                "Unable to find the column '{}' in '{}'. Please check the column names again.".format(
+                    col, sheet_name))
+
+    runs = column_runs(indices)
+    a1ranges = [ranges.columns_range(sheet_name, first, last) for first, last in runs]
+    options = dict(render_options or {}, majorDimension='COLUMNS')
+
+    columns = []
+    for (first, last), value_range in zip(runs, batch_get(spreadsheetId, a1ranges, options)):
+        values = value_range.get('values', [])
+        # empty columns at the end of a range aren't returned
+        columns.extend(values[position] if position < len(values) else []
+                       for position in range(last - first + 1))
+
+    length = max([0] + [len(column) for column in columns])
+    if not length:
+        return {}
+    return {'values': [[column[row] if row < len(column) else '' for column in columns]
+                       for row in range(length)]}
+
+
+def query_sheet(spreadsheetId, sheet_name, query):
+    """
+    Runs a Google Visualization API query against a sheet on Google's side
+    and returns the result rows, with its column labels first, in the shape
+    values().get does. Cells come back formatted as shown in the sheet.
+    """
+    params = urlencode([('tqx', 'out:csv'), ('headers', '1'), ('sheet', sheet_name), ('tq', query)])
+    uri = 'https://docs.google.com/spreadsheets/d/{}/gviz/tq?{}'.format(spreadsheetId, params)
+    content = init_service.http_get(uri, 'sheets.gviz.query')
+    rows = list(csv.reader(io.StringIO(content)))
+    return {'values': rows} if rows else {}
+
+
+def add_sheet_request(sheet_name, rows, cols):
+    return {
+        "addSheet": {
+            "properties": {
+                "title": sheet_name,
+                "gridProperties": {
+                    "rowCount": rows,
+                    "columnCount": cols
+                }
+            }
+        }
+    }
+
+
+def get_header_row(spreadsheetId, sheet_name):
+    # the first row of a sheet, or None if it's empty
+    service = init_service.get_service()
+    response = init_service.execute(service.spreadsheets().values()
+                                    .get(spreadsheetId=spreadsheetId, range=ranges.rows_range(sheet_name, 1, 1)))
+    return response['values'][0] if 'values' in response else None
+
+
+def append_rows(spreadsheetId, sheet_name, rows):
+    service = init_service.get_service()
+    response = init_service.execute(service.spreadsheets().values().append(
+        spreadsheetId=spreadsheetId,
+        range=ranges.quote(sheet_name),
+        valueInputOption='USER_ENTERED',
+        insertDataOption='INSERT_ROWS',
+        body={'values': rows}))
+    add_grid_rows(spreadsheetId, sheet_name, len(rows))
+    note_grid_size(spreadsheetId, sheet_name, 0, max(len(row) for row in rows))
+    return response
+
+
+def read_manifest(spreadsheetId):
+    # the sharded datasets recorded in a spreadsheet, or an empty manifest
+    try:
+        get_sheet_properties(spreadsheetId, MANIFEST_SHEET)
+    except ValueError:
+        return {'datasets': {}}
+    service = init_service.get_service()
+    response = init_service.execute(service.spreadsheets().values().get(
+        spreadsheetId=spreadsheetId, range=ranges.rows_range(MANIFEST_SHEET, 1, 1, 1), valueRenderOption='UNFORMATTED_VALUE'))
+    values = response.get('values')
+    if not values or not values[0] or not values[0][0]:
+        return {'datasets': {}}
+    return json.loads(values[0][0])
+
+
+def write_manifest(spreadsheetId, manifest):
+    try:
+        get_sheet_properties(spreadsheetId, MANIFEST_SHEET)
+    except ValueError:
+        batch_update(spreadsheetId, [add_sheet_request(MANIFEST_SHEET, 1, 1)])
+    service = init_service.get_service()
+    # RAW so Sheets keeps the JSON as it is
+    return init_service.execute(service.spreadsheets().values().update(
+        spreadsheetId=spreadsheetId,
+        range=ranges.rows_range(MANIFEST_SHEET, 1, 1, 1),
+        valueInputOption='RAW',
+        body={'values': [[json.dumps(manifest, sort_keys=True)]]}))
+
+
+def delete_sheets(sheets):
+    # remove the {'spreadsheetId', 'sheet_name'} sheets that still exist,
+    # with one batchUpdate per spreadsheet
+    titles = {}
+    for sheet in sheets:
+        titles.setdefault(sheet['spreadsheetId'], set()).add(sheet['sheet_name'])
+    for spreadsheetId, names in titles.items():
+        requests = [{'deleteSheet': {'sheetId': sheet['properties']['sheetId']}}
+                    for sheet in get_metadata(spreadsheetId, refresh=True)['sheets']
+                    if sheet['properties']['title'] in names]
+        if requests:
+            batch_update(spreadsheetId, requests)
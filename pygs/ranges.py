@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+"""
+A1 notation and the arithmetic on ranges the chunked reads and writes plan
+their requests with.
+
+A range is a GridRange of a sheet name and 0-based row and column bounds,
+with exclusive ends and None for an end that runs to the edge of the sheet,
+the way the API's own GridRange works:
+
+    >>> parse("'My Sheet'!B2:D10")
+    GridRange(sheet_name='My Sheet', start_row=1, start_col=1, end_row=10, end_col=4)
+    >>> to_a1(GridRange('My Sheet', 1, 1, 10, 4))
+    "'My Sheet'!B2:D10"
+
+Column letters are looked up in tables built once at import, and cover all
+18,278 columns (A to ZZZ) a sheet can have.
+"""
+import re
+import string
+import itertools
+from collections import namedtuple
+
+# the most columns a sheet can have, column ZZZ
+MAX_COLUMNS = 18278
+
+COLUMN_LETTERS = [''.join(letters)
+                  for length in (1, 2, 3)
+                  for letters in itertools.product(string.ascii_uppercase, repeat=length)]
+COLUMN_INDEX = dict((letters, index) for index, letters in enumerate(COLUMN_LETTERS))
+
+# sheet names that can go in a range without quotes
+PLAIN_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+# ...unless they'd be read as a cell, e.g. 'AB12' or 'R1C1'
+CELL_NAME = re.compile(r'^([A-Za-z]{1,3}\d+|[Rr]\d*[Cc]\d*)$')
+CELL_REF = re.compile(r'^([A-Za-z]*)(\d*)$')
+
+GridRange = namedtuple('GridRange', ['sheet_name', 'start_row', 'start_col', 'end_row', 'end_col'])
+GridRange.__new__.__defaults__ = (0, 0, None, None)
+
+
+def column_letter(index):
+    # the letters of the 0-based column `index`
+    if index < 0 or index >= MAX_COLUMNS:
+        raise ValueError(
+            "Column {} is past column 'ZZZ', the last of the {:,} columns a sheet can have.".format(
+                index + 1, MAX_COLUMNS))
+    return COLUMN_LETTERS[index]
+
+
+def column_index(letters):
+    # the 0-based index of the column `letters`
+    try:
+        return COLUMN_INDEX[letters.upper()]
+    except KeyError:
+        raise ValueError("'{}' is not a column of a sheet.".format(letters))
+
+
+def check_columns(width):
+    # fail early on frames wider than a sheet can hold
+    if width > MAX_COLUMNS:
+        raise ValueError(
+            "You have {:,} columns, more than the {:,} a sheet can have.".format(width, MAX_COLUMNS))
+
+
+def quote(sheet_name):
+    # the sheet name as it's written in a range, quoted if it has to be
+    if PLAIN_NAME.match(sheet_name) and not CELL_NAME.match(sheet_name):
+        return sheet_name
+    return "'{}'".format(sheet_name.replace("'", "''"))
+
+
+def unquote(title):
+    if len(title) > 1 and title.startswith("'") and title.endswith("'"):
+        return title[1:-1].replace("''", "'")
+    return title
+
+
+def split_a1(a1range):
+    # (sheet name, cell reference or None) of 'Sheet1', "'My Sheet'!A1:B2" or 'Sheet1!A:C'
+    if a1range.startswith("'"):
+        # a quoted name can hold '!', so find its closing quote
+        position = 1
+        while True:
+            position = a1range.find("'", position)
+            if position == -1:
+                raise ValueError("Unable to parse range: {}".format(a1range))
+            if a1range[position + 1:position + 2] == "'":
+                position += 2
+                continue
+            break
+        title, rest = a1range[:position + 1], a1range[position + 1:]
+        if rest and not rest.startswith('!'):
+            raise ValueError("Unable to parse range: {}".format(a1range))
+        return unquote(title), rest[1:] or None
+    if '!' in a1range:
+        title, ref = a1range.rsplit('!', 1)
+        return title, ref or None
+    return a1range, None
+
+
+def sheet_title(a1range):
+    # the sheet a range refers to
+    return split_a1(a1range)[0]
+
+
+def parse(a1range):
+    """
+    The GridRange of an A1 range: a sheet name, a sheet name and cells
+    ('Sheet1!A1:B2', 'Sheet1!A:C', 'Sheet1!2:5', 'Sheet1!A5:C') or a single
+    cell ('Sheet1!B3').
+    """
+    title, ref = split_a1(a1range)
+    if not ref:
+        return GridRange(title)
+
+    cells = []
+    for part in ref.split(':'):
+        match = CELL_REF.match(part)
+        if not match or not part or len(cells) == 2:
+            raise ValueError("Unable to parse range: {}".format(a1range))
+        letters, digits = match.groups()
+        if digits and int(digits) < 1:
+            raise ValueError("Unable to parse range: {}".format(a1range))
+        cells.append((int(digits) - 1 if digits else None, column_index(letters) if letters else None))
+
+    start_row, start_col = cells[0]
+    end_row, end_col = cells[-1]
+    if len(cells) == 1 and (start_row is None or start_col is None):
+        raise ValueError("Unable to parse range: {}".format(a1range))
+    return GridRange(title,
+                     start_row or 0,
+                     start_col or 0,
+                     end_row + 1 if end_row is not None else None,
+                     end_col + 1 if end_col is not None else None)
+
+
+def to_a1(grid_range):
+    # the A1 notation of a GridRange
+    sheet_name, start_row, start_col, end_row, end_col = grid_range
+    whole_columns = start_row == 0 and end_row is None
+    whole_rows = start_col == 0 and end_col is None
+    if whole_columns and whole_rows:
+        return quote(sheet_name)
+    if end_col is None and not whole_rows:
+        raise ValueError("A range that starts past column A has to end at a column to be written in A1 notation.")
+
+    if whole_columns:
+        ref = '{}:{}'.format(column_letter(start_col), column_letter(end_col - 1))
+    elif whole_rows:
+        if end_row is None:
+            raise ValueError("A range of whole rows has to end at a row to be written in A1 notation.")
+        ref = '{}:{}'.format(start_row + 1, end_row)
+    elif end_row is None:
+        # 'A5:C', to the last row of the sheet
+        ref = '{}{}:{}'.format(column_letter(start_col), start_row + 1, column_letter(end_col - 1))
+    elif end_row - start_row == 1 and end_col - start_col == 1:
+        ref = '{}{}'.format(column_letter(start_col), start_row + 1)
+    else:
+        ref = '{}{}:{}{}'.format(column_letter(start_col), start_row + 1, column_letter(end_col - 1), end_row)
+    return '{}!{}'.format(quote(sheet_name), ref)
+
+
+def rows_range(sheet_name, first_row, last_row, width=None, first_col=0):
+    """
+    The A1 range of the 1-based rows first_row to last_row, across `width`
+    columns from the 0-based `first_col`, or across whole rows without a
+    width: rows_range('Data', 2, 10, 3) is 'Data!A2:C10'.
+    """
+    end_col = first_col + width if width is not None else None
+    return to_a1(GridRange(sheet_name, first_row - 1, first_col, last_row, end_col))
+
+
+def columns_range(sheet_name, first_col, last_col):
+    # the A1 range of the whole 0-based columns first_col to last_col
+    return to_a1(GridRange(sheet_name, 0, first_col, None, last_col + 1))
+
+
+def size(grid_range, row_count=None, col_count=None):
+    # (rows, columns) of a range, with open ends taken to the given grid size
+    end_row = grid_range.end_row if grid_range.end_row is not None else row_count
+    end_col = grid_range.end_col if grid_range.end_col is not None else col_count
+    if end_row is None or end_col is None:
+        raise ValueError("The size of a range that runs to the edge of its sheet needs the sheet's grid size.")
+    return max(0, end_row - grid_range.start_row), max(0, end_col - grid_range.start_col)
+
+
+def split_rows(grid_range, rows):
+    # the range as blocks of at most `rows` rows, top to bottom
+    if grid_range.end_row is None:
+        raise ValueError("A range that runs to the last row of its sheet can't be split into rows.")
+    return [grid_range._replace(start_row=start, end_row=min(start + rows, grid_range.end_row))
+            for start in range(grid_range.start_row, grid_range.end_row, max(1, rows))]
+
+
+def split_columns(grid_range, cols):
+    # the range as blocks of at most `cols` columns, left to right
+    if grid_range.end_col is None:
+        raise ValueError("A range that runs to the last column of its sheet can't be split into columns.")
+    return [grid_range._replace(start_col=start, end_col=min(start + cols, grid_range.end_col))
+            for start in range(grid_range.start_col, grid_range.end_col, max(1, cols))]
+
+
+def split(grid_range, max_cells):
+    """
+    The range as blocks of at most `max_cells` cells, in rows of blocks
+    from the top left. Blocks are as wide as the range where a single row
+    fits in `max_cells`, so each one covers whole rows of it.
+    """
+    rows, cols = size(grid_range)
+    if cols <= max_cells:
+        return split_rows(grid_range, max(1, max_cells // max(1, cols)))
+    return [block for row in split_rows(grid_range, 1) for block in split_columns(row, max_cells)]
+
+
+def intersect(first, second):
+    # the cells two ranges share, or None if they don't overlap
+    if first.sheet_name != second.sheet_name:
+        return None
+
+    def end(a, b):
+        return a if b is None else b if a is None else min(a, b)
+
+    overlap = GridRange(first.sheet_name,
+                        max(first.start_row, second.start_row),
+                        max(first.start_col, second.start_col),
+                        end(first.end_row, second.end_row),
+                        end(first.end_col, second.end_col))
+    if (overlap.end_row is not None and overlap.end_row <= overlap.start_row) or \
+            (overlap.end_col is not None and overlap.end_col <= overlap.start_col):
+        return None
+    return overlap
+
+
+def touches(first, second, start, end):
+    # whether the spans [start, end) of two ranges overlap or meet
+    first_end, second_end = getattr(first, end), getattr(second, end)
+    return (first_end is None or getattr(second, start) <= first_end) and \
+        (second_end is None or getattr(first, start) <= second_end)
+
+
+def union(grid_ranges):
+    """
+    The fewest ranges covering the same cells as `grid_ranges`, joining
+    ranges of a sheet that overlap or meet and span the same rows or the
+    same columns. Ranges that can't be joined into a rectangle stay apart.
+    """
+    merged = []
+    for grid_range in grid_ranges:
+        merged.append(grid_range)
+        # joining two ranges can make the result joinable with another one
+        while True:
+            current = merged[-1]
+            for position, other in enumerate(merged[:-1]):
+                if other.sheet_name != current.sheet_name:
+                    continue
+                if (other.start_col, other.end_col) == (current.start_col, current.end_col) and \
+                        touches(other, current, 'start_row', 'end_row'):
+                    joined = other._replace(
+                        start_row=min(other.start_row, current.start_row),
+                        end_row=None if None in (other.end_row, current.end_row) else max(other.end_row,
+                                                                                          current.end_row))
+                elif (other.start_row, other.end_row) == (current.start_row, current.end_row) and \
+                        touches(other, current, 'start_col', 'end_col'):
+                    joined = other._replace(
+                        start_col=min(other.start_col, current.start_col),
+                        end_col=None if None in (other.end_col, current.end_col) else max(other.end_col,
+                                                                                          current.end_col))
+                else:
+                    continue
+                del merged[position]
+                merged[-1] = joined
+                break
+            else:
+                break
+    return sorted(merged, key=lambda item: (item.sheet_name, item.start_row, item.start_col))
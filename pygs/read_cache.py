@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""
+An on-disk cache of read_google_sheet results.
+
+Each result is kept as an uncompressed Arrow IPC (Feather v2) file, which is
+memory-mapped when it's read back, so a hit costs one small metadata request
+and no JSON parsing. Files are keyed by spreadsheetId, sheet and read
+options, and hold the sheet's write stamp (the developer metadata pygs
+writers update on every sheet they change) from when they were read. An
+entry is used only if it's younger than 'ttl' seconds and the stamp hasn't
+changed. Sheets pygs never wrote to have no stamp, so for those the ttl is
+the only limit on how stale a hit can be.
+
+The least recently used files are removed once the cache grows past
+'max_bytes'. The cache needs pyarrow and is off until configure is called.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+
+read_cache_dict = {
+    'directory': None,
+    'ttl': 3600,
+    'max_bytes': 1024 * 1024 * 1024
+}
+read_cache_lock = threading.Lock()
+
+SUFFIX = '.arrow'
+
+
+def configure(directory, ttl=None, max_bytes=None):
+    if directory is not None and pa is None:
+        raise ImportError("The read cache needs pyarrow. Please install it with 'pip install pyarrow'.")
+    if directory is not None:
+        directory = os.path.expanduser(directory)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+    with read_cache_lock:
+        read_cache_dict['directory'] = directory
+        if ttl is not None:
+            read_cache_dict['ttl'] = ttl
+        if max_bytes is not None:
+            read_cache_dict['max_bytes'] = max_bytes
+
+
+def enabled():
+    return read_cache_dict['directory'] is not None
+
+
+def cache_key(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def cache_files():
+    directory = read_cache_dict['directory']
+    if directory is None or not os.path.exists(directory):
+        return []
+    return [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(SUFFIX)]
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def load(key, stamp, output='pandas'):
+    """
+    The cached result for `key` if it's fresh and was read under `stamp`,
+    otherwise None. Stale entries are removed. The result is a DataFrame, or
+    the memory-mapped pyarrow Table itself for any other `output`.
+    """
+    if not enabled():
+        return None
+    path = os.path.join(read_cache_dict['directory'], key + SUFFIX)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        table = feather.read_table(path, memory_map=True)
+        entry = json.loads(table.schema.metadata[b'pygs'].decode('utf-8'))
+    except (OSError, KeyError, ValueError, pa.ArrowException):
+        remove(path)
+        return None
+
+    if entry['stamp'] != stamp or time.time() - entry['created'] > read_cache_dict['ttl']:
+        remove(path)
+        return None
+
+    # the modification time doubles as the last use for eviction
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+    if output != 'pandas':
+        return table
+    # numeric columns without missing values stay on the mapped file
+    return table.to_pandas(split_blocks=True)
+
+
+def store(key, data, stamp):
+    # cache a DataFrame or Table, unless Arrow can't hold it (e.g. mixed types in a column)
+    if not enabled() or data.shape[1] == 0:
+        return False
+    if isinstance(data, pa.Table):
+        table = data
+    else:
+        try:
+            table = pa.Table.from_pandas(data, preserve_index=False)
+        except (ValueError, TypeError, pa.ArrowException):
+            return False
+
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'pygs'] = json.dumps({'stamp': stamp, 'created': time.time()}).encode('utf-8')
+    table = table.replace_schema_metadata(metadata)
+
+    path = os.path.join(read_cache_dict['directory'], key + SUFFIX)
+    # write next to the final name, then move it into place in one step
+    temp_path = '{}.tmp{}-{}'.format(path, os.getpid(), threading.current_thread().ident)
+    try:
+        feather.write_feather(table, temp_path, compression='uncompressed')
+        os.rename(temp_path, path)
+    except (OSError, pa.ArrowException):
+        remove(temp_path)
+        return False
+
+    evict()
+    return True
+
+
+def evict():
+    # drop the least recently used files until the cache fits in max_bytes
+    files = []
+    for path in cache_files():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    files.sort()
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in files:
+        if total <= read_cache_dict['max_bytes']:
+            break
+        remove(path)
+        total -= size
+
+
+def clear():
+    for path in cache_files():
+        remove(path)
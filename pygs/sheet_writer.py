@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+"""
+A write-behind queue for sheets that are written many times a minute.
+
+SheetWriter takes replace, append and row writes for any number of sheets
+and sends them from a background thread. Writes to the same sheet are
+combined while they wait: a replace drops everything queued before it,
+appends are joined to the write before them and row updates are merged, so
+only the latest data for each sheet goes out, in a handful of requests:
+
+    writer = pygs.SheetWriter(flush_interval=10)
+    for df in frames:
+        writer.replace(df, 'Live', spreadsheetId)
+    writer.close()
+
+A sheet is written once its oldest queued write is `flush_interval` seconds
+old or it has `flush_rows` rows queued. Once `max_buffered_rows` rows are
+queued across all sheets, new writes wait for the queue to drain. Frames
+are copied when they're queued, so changing them afterwards doesn't change
+what's written.
+"""
+import time
+import threading
+try:
+    from queue import Full
+except ImportError:
+    from Queue import Full
+
+import pandas as pd
+
+import pygs
+#py3 compatible
+try:
+    import pygs_tools as pytools
+    import initialize_service as init_service
+except ImportError:
+    from . import pygs_tools as pytools
+    from . import initialize_service as init_service
+
+
+class SheetWriter(object):
+    """
+    Queues writes to sheets and sends them from a background thread,
+    combining the writes queued for the same sheet.
+
+    Parameters
+    ----------
+    flush_interval : float, optional
+        The longest a write waits before it's sent, in seconds. Defaults to 5.
+    flush_rows : int, optional
+        A sheet is written as soon as this many rows are queued for it.
+        Defaults to 50,000.
+    max_buffered_rows : int, optional
+        The most rows queued across all sheets. Writes past it wait for the
+        queue to drain, or raise queue.Full once their timeout runs out.
+        Defaults to 1,000,000.
+    mode : str, optional
+        How replaces are written, 'replace' or 'diff', as in update_sheet_with_df.
+    header : bool, optional
+        Whether the column titles are written, as in update_sheet_with_df
+        and append_df_to_sheet. Defaults to true.
+    chunk_cells : int, optional
+        The most cells sent in a single request. Defaults to 250,000.
+    max_workers : int, optional
+        How many chunks of a write are uploaded concurrently. Defaults to 4.
+    priority : str, optional
+        The request priority of the writes, 'batch' (the default) or 'interactive'.
+    on_error : callable, optional
+        Called with (error, spreadsheetId, sheet_name) when a write fails.
+        Without it, the first error is raised by the next flush or close.
+    """
+
+    def __init__(self, flush_interval=5.0, flush_rows=50000, max_buffered_rows=1000000,
+                 mode='replace', header=True, chunk_cells=None, max_workers=None,
+                 priority='batch', on_error=None):
+        if mode not in ('replace', 'diff'):
+            raise ValueError("mode must be either 'replace' or 'diff'.")
+        if priority not in ('interactive', 'batch'):
+            raise ValueError("priority must be either 'interactive' or 'batch'.")
+        self.flush_interval = flush_interval
+        self.flush_rows = flush_rows
+        self.max_buffered_rows = max_buffered_rows
+        self.mode = mode
+        self.header = header
+        self.chunk_cells = chunk_cells
+        self.max_workers = max_workers
+        self.priority = priority
+        self.on_error = on_error
+
+        # (spreadsheetId, sheet_name) -> {'ops': [...], 'since': time, 'rows': n}
+        self.pending = {}
+        self.buffered_rows = 0
+        self.busy = False
+        self.flush_requested = False
+        self.closed = False
+        self.errors = []
+        self.stats = {'writes': 0, 'coalesced': 0, 'flushes': 0}
+        self.condition = threading.Condition()
+
+        self.thread = threading.Thread(target=self.run, name='pygs-sheet-writer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def replace(self, df, sheet_name, spreadsheetId, timeout=None):
+        """
+        Queues replacing the contents of the sheet with df, dropping the
+        writes queued before it. A copy of df is queued, so the caller can
+        change df afterwards.
+        """
+        self.submit(spreadsheetId, sheet_name, 'replace', df.copy(), len(df), timeout)
+
+    def append(self, df, sheet_name, spreadsheetId, timeout=None):
+        """Queues adding the rows of df below the data in the sheet, from a copy of df."""
+        self.submit(spreadsheetId, sheet_name, 'append', df.copy(), len(df), timeout)
+
+    def update_rows(self, df, sheet_name, spreadsheetId, start_row, timeout=None):
+        """
+        Queues writing the rows of df, without its header, over the sheet
+        rows starting at the 1-based `start_row`.
+        """
+        rows = pytools.serialize_df(df, header=False)
+        self.submit(spreadsheetId, sheet_name, 'rows',
+                    dict(zip(range(start_row, start_row + len(rows)), rows)), len(rows), timeout)
+
+    def submit(self, spreadsheetId, sheet_name, kind, payload, rows, timeout):
+        if not sheet_name:
+            raise ValueError('Please specify a sheet name.')
+        if not spreadsheetId:
+            raise ValueError('Please specify a spreadsheetId.')
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            if self.closed:
+                raise ValueError('The SheetWriter is closed.')
+            # backpressure: wait for room, unless the queue is empty and this write is just big
+            while self.buffered_rows and self.buffered_rows + rows > self.max_buffered_rows:
+                self.flush_requested = True
+                self.condition.notify_all()
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise Full('The SheetWriter has {} rows waiting to be written.'.format(self.buffered_rows))
+                self.condition.wait(remaining)
+
+            key = (spreadsheetId, sheet_name)
+            entry = self.pending.get(key)
+            if entry is None:
+                entry = self.pending[key] = {'ops': [], 'since': time.time(), 'rows': 0}
+            self.add_op(entry, kind, payload, rows)
+            self.stats['writes'] += 1
+            self.condition.notify_all()
+
+    def add_op(self, entry, kind, payload, rows):
+        # combine a write with the ones queued for the same sheet. Call with the lock held.
+        ops = entry['ops']
+        last = ops[-1] if ops else None
+        if kind == 'replace':
+            self.stats['coalesced'] += len(ops)
+            self.buffered_rows -= entry['rows']
+            entry['rows'] = 0
+            ops[:] = [{'kind': 'replace', 'frames': [payload]}]
+        elif kind == 'append' and last is not None and last['kind'] in ('replace', 'append'):
+            self.stats['coalesced'] += 1
+            last['frames'].append(payload)
+        elif kind == 'rows' and last is not None and last['kind'] == 'rows':
+            self.stats['coalesced'] += 1
+            before = len(last['rows'])
+            last['rows'].update(payload)
+            rows = len(last['rows']) - before
+        elif kind == 'rows':
+            ops.append({'kind': 'rows', 'rows': dict(payload)})
+        else:
+            ops.append({'kind': kind, 'frames': [payload]})
+        entry['rows'] += rows
+        self.buffered_rows += rows
+
+    def due(self, now):
+        # the queued sheets that should be written now, and how long until the next one is due
+        keys = []
+        wait = None
+        for key, entry in self.pending.items():
+            age = now - entry['since']
+            if self.flush_requested or self.closed or entry['rows'] >= self.flush_rows or \
+                    age >= self.flush_interval:
+                keys.append(key)
+            else:
+                left = self.flush_interval - age
+                wait = left if wait is None else min(wait, left)
+        return keys, wait
+
+    def run(self):
+        while True:
+            with self.condition:
+                while True:
+                    keys, wait = self.due(time.time())
+                    if keys:
+                        break
+                    if self.closed:
+                        return
+                    self.condition.wait(wait)
+                key = min(keys, key=lambda item: self.pending[item]['since'])
+                entry = self.pending.pop(key)
+                self.busy = True
+
+            try:
+                with init_service.request_priority(self.priority):
+                    self.write(key, entry['ops'])
+            except Exception as error:
+                if self.on_error is not None:
+                    self.on_error(error, key[0], key[1])
+                else:
+                    with self.condition:
+                        self.errors.append(error)
+            finally:
+                with self.condition:
+                    self.buffered_rows -= entry['rows']
+                    self.busy = False
+                    self.stats['flushes'] += 1
+                    if not self.pending:
+                        self.flush_requested = False
+                    self.condition.notify_all()
+
+    def write(self, key, ops):
+        spreadsheetId, sheet_name = key
+        for op in ops:
+            if op['kind'] == 'replace':
+                frames = op['frames']
+                df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+                pygs.update_sheet_with_df(df, sheet_name, spreadsheetId,
+                                          header=self.header,
+                                          chunk_cells=self.chunk_cells,
+                                          max_workers=self.max_workers,
+                                          mode=self.mode)
+            elif op['kind'] == 'append':
+                pygs.append_df_to_sheet(iter(op['frames']), sheet_name, spreadsheetId, header=self.header)
+            else:
+                pytools.write_rows(spreadsheetId, sheet_name, op['rows'],
+                                   max_cells=self.chunk_cells,
+                                   max_workers=self.max_workers)
+
+    def flush(self, timeout=None):
+        """
+        Writes everything queued now and waits for it to be sent. Raises the
+        first error from a failed write since the last flush, if any.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            self.flush_requested = True
+            self.condition.notify_all()
+            while self.pending or self.busy:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise Full('The SheetWriter has {} rows waiting to be written.'.format(self.buffered_rows))
+                self.condition.wait(remaining)
+            errors = self.errors
+            self.errors = []
+        if errors:
+            raise errors[0]
+
+    def close(self, timeout=None):
+        """Writes everything queued, stops the background thread and takes no more writes."""
+        try:
+            self.flush(timeout)
+        finally:
+            with self.condition:
+                self.closed = True
+                self.condition.notify_all()
+            self.thread.join(timeout)
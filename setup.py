@@ -11,6 +11,13 @@ install_requires = [
     'oauth2client'
 ]
 
+extras_require = {
+    'cache': ['pyarrow'],
+    'arrow': ['pyarrow'],
+    'polars': ['pyarrow', 'polars'],
+    'parquet': ['pyarrow']
+}
+
 long_desc = """This allows a user to send a dataframe to a Google Sheet"""
 
 version = '1.1'
@@ -23,6 +30,10 @@ setup(
     author="JP Schultz",
     author_email="jp.schultz@gmail.com",
     install_requires=install_requires,
+    extras_require=extras_require,
     packages=packages,
-    package_data={}
+    package_data={},
+    entry_points={
+        'console_scripts': ['pygs=pygs.cli:main']
+    }
 )
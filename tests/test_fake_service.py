@@ -0,0 +1,815 @@
+#!/usr/bin/env python
+"""
+Round trips of the write and read paths against pygs.fake_service, the
+in-memory stand-in for the Sheets API. Run with `python -m pytest -q`.
+"""
+import os
+import copy
+import json
+import socket
+import shutil
+import tempfile
+import unittest
+
+import httplib2
+import numpy as np
+import pandas as pd
+from googleapiclient import errors
+
+import pygs
+from pygs import fake_service
+from pygs import pygs_tools as pytools
+from pygs import initialize_service as init_service
+from pygs import ranges
+from pygs import cli
+from pygs import instrumentation
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+def sample_frame(rows=50):
+    return pd.DataFrame({
+        'id': np.arange(rows),
+        'value': np.arange(rows) / 4.0,
+        'name': ['row %d' % i for i in range(rows)],
+        'flag': np.arange(rows) % 2 == 0
+    })
+
+
+def as_serial(value):
+    # what a real sheet stores for an ISO datetime entered as USER_ENTERED
+    return float((np.datetime64(value.replace(' ', 'T')) - pytools.SHEETS_EPOCH) / np.timedelta64(1, 'D'))
+
+
+class FakeServiceTestCase(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.limits = copy.deepcopy(init_service.scheduler_dict)
+        pygs.configure_rate_limits(10 ** 6, 10 ** 6)
+        init_service.scheduler_dict['base_delay'] = 0.001
+
+    @classmethod
+    def tearDownClass(cls):
+        saved = cls.limits
+        pygs.configure_rate_limits(saved['limits']['project'], saved['limits']['user'],
+                                   saved['interactive_reserve'], saved['max_retries'],
+                                   saved['base_delay'], saved['max_delay'])
+
+    def setUp(self):
+        self.fake = fake_service.install()
+        pygs.invalidate_metadata_cache()
+
+    def tearDown(self):
+        fake_service.uninstall()
+        pygs.invalidate_metadata_cache()
+
+    def create(self, df, sheet_name='Data', **kwargs):
+        return pygs.create_spreadsheet_from_df(df, sheet_name, 'test', **kwargs)['spreadsheetId']
+
+    def grow_behind_cache(self, spreadsheetId, sheet_name, rows):
+        # rows added by someone else past the cached grid, which only fits the data after a replace
+        pygs.update_sheet_with_df(self.read(spreadsheetId, sheet_name), sheet_name, spreadsheetId)
+        sheet = self.fake.sheet(spreadsheetId, sheet_name)
+        sheet['data'].extend(rows)
+        sheet['properties']['gridProperties']['rowCount'] = len(sheet['data'])
+
+    def writes(self):
+        return len([methodId for methodId in self.fake.requests
+                    if methodId in ('sheets.spreadsheets.values.update', 'sheets.spreadsheets.values.batchUpdate')])
+
+    def read(self, spreadsheetId, sheet_name='Data', **kwargs):
+        return pygs.read_google_sheet(spreadsheetId, sheet_name, value_render_option='UNFORMATTED_VALUE',
+                                      cache=False, **kwargs)
+
+
+class ReplaceTest(FakeServiceTestCase):
+
+    def test_round_trip(self):
+        df = sample_frame()
+        key = self.create(df)
+        back = self.read(key)
+        self.assertEqual(list(back.columns), list(df.columns))
+        self.assertEqual(back['id'].tolist(), df['id'].tolist())
+        self.assertEqual(back['value'].tolist(), df['value'].tolist())
+        self.assertEqual(back['name'].tolist(), df['name'].tolist())
+
+    def test_replace_removes_rows_added_behind_cache(self):
+        key = self.create(sample_frame(10))
+        self.grow_behind_cache(key, 'Data', [[i, 0, 'extra', False] for i in range(10, 15)])
+        pygs.update_sheet_with_df(sample_frame(10), 'Data', key)
+        self.assertEqual(len(self.fake.sheet(key, 'Data')['data']), 11)
+
+    def test_replace_clears_wider_old_data(self):
+        key = self.create(sample_frame(10))
+        pygs.update_sheet_with_df(sample_frame(5)[['id']], 'Data', key)
+        data = self.fake.sheet(key, 'Data')['data']
+        self.assertEqual(len(data), 6)
+        self.assertTrue(all(cell in ('', None) for row in data for cell in row[1:]))
+
+    def test_replace_with_cached_metadata_is_two_requests(self):
+        key = self.create(sample_frame(10))
+        pygs.update_sheet_with_df(sample_frame(10), 'Data', key)
+        before = len(self.fake.requests)
+        pygs.update_sheet_with_df(sample_frame(12), 'Data', key)
+        self.assertEqual(self.fake.requests[before:],
+                         ['sheets.spreadsheets.values.batchUpdate', 'sheets.spreadsheets.batchUpdate'])
+
+    def test_failed_chunk_raises_and_restamps(self):
+        key = self.create(sample_frame(100))
+        stamp = pytools.read_stamp(key, 'Data')[1]
+        run = self.fake.run
+        sent = {'chunks': 0}
+
+        def failing(request):
+            # every chunk after the first is rejected
+            if request.methodId == 'sheets.spreadsheets.values.batchUpdate':
+                sent['chunks'] += 1
+                if sent['chunks'] > 1:
+                    raise self.fake.error(400, 'Simulated error')
+            return run(request)
+        self.fake.run = failing
+        changed = sample_frame(100)
+        changed['name'] = 'new'
+        with self.assertRaises(errors.HttpError):
+            pygs.update_sheet_with_df(changed, 'Data', key, chunk_cells=100, max_workers=1)
+        names = [row[2] for row in self.fake.sheet(key, 'Data')['data'][1:101]]
+        # the first chunk is in, the rest of the sheet still has the old rows
+        self.assertEqual(names[0], 'new')
+        self.assertEqual(names[-1], 'row 99')
+        self.assertNotEqual(pytools.read_stamp(key, 'Data')[1], stamp)
+
+    def test_processes_match_the_normal_path(self):
+        df = sample_frame(40)
+        df['when'] = pd.date_range('2024-03-09 22:00', periods=40, freq='37min', tz='US/Eastern')
+        df.loc[3, 'value'] = np.nan
+        normal = self.create(df)
+        pooled = self.create(df, processes=2)
+        self.assertEqual(self.fake.sheet(normal, 'Data')['data'], self.fake.sheet(pooled, 'Data')['data'])
+        # tz-aware datetimes are written as wall time on both paths
+        self.assertEqual(self.fake.sheet(pooled, 'Data')['data'][1][4], '2024-03-09 22:00:00')
+
+
+class DatetimeTest(FakeServiceTestCase):
+
+    def written(self, df, **kwargs):
+        key = self.create(df, **kwargs)
+        return [row[0] for row in self.fake.sheet(key, 'Data')['data'][1:]]
+
+    def test_fractional_seconds_kept_where_present(self):
+        df = pd.DataFrame({'when': pd.to_datetime(['2024-01-01 10:00:00.000', '2024-01-01 10:00:00.250', None])})
+        self.assertEqual(self.written(df), ['2024-01-01 10:00:00', '2024-01-01 10:00:00.250000', ''])
+        self.assertEqual(self.written(df, processes=2), ['2024-01-01 10:00:00', '2024-01-01 10:00:00.250000', ''])
+
+    def test_serial(self):
+        df = pd.DataFrame({'when': pd.to_datetime(['1899-12-31 12:00:00.0', '2024-01-01 06:00:00.5'])})
+        written = self.written(df, datetime_format='serial')
+        self.assertEqual(written[0], 1.5)
+        self.assertAlmostEqual(written[1], as_serial('2024-01-01 06:00:00.5'))
+
+    def test_pattern_keeps_the_offset(self):
+        df = pd.DataFrame({'when': pd.date_range('2024-03-09 22:00', periods=3, freq='3h', tz='US/Eastern')})
+        expected = ['2024-03-09T22:00:00-0500', '2024-03-10T01:00:00-0500', '2024-03-10T05:00:00-0400']
+        self.assertEqual(self.written(df, datetime_format='%Y-%m-%dT%H:%M:%S%z'), expected)
+        self.assertEqual(self.written(df, datetime_format='%Y-%m-%dT%H:%M:%S%z', processes=2), expected)
+
+    def test_update_and_append_take_the_format(self):
+        df = pd.DataFrame({'when': pd.to_datetime(['2024-01-01', '2024-01-02'])})
+        key = self.create(df)
+        pygs.update_sheet_with_df(df, 'Data', key, datetime_format='%d/%m/%Y')
+        pygs.append_df_to_sheet(df, 'Data', key, datetime_format='%d/%m/%Y')
+        self.assertEqual([row[0] for row in self.fake.sheet(key, 'Data')['data'][1:]],
+                         ['01/01/2024', '02/01/2024', '01/01/2024', '02/01/2024'])
+
+    def test_fractional_seconds_unchanged_in_a_diff(self):
+        df = pd.DataFrame({'when': pd.date_range('2024-01-01 10:00', periods=20, freq='1500ms')})
+        key = self.create(df)
+        for row in self.fake.sheet(key, 'Data')['data'][1:]:
+            row[0] = as_serial(row[0])
+        pygs.invalidate_metadata_cache()
+        before = self.writes()
+        pygs.update_sheet_with_df(df, 'Data', key, mode='diff')
+        self.assertEqual(self.writes(), before)
+
+
+class DiffTest(FakeServiceTestCase):
+
+    def test_writes_only_changed_rows(self):
+        df = sample_frame()
+        key = self.create(df)
+        pygs.update_sheet_with_df(df, 'Data', key, mode='diff')
+        changed = df.copy()
+        changed.loc[[5, 30], 'name'] = 'changed'
+        before = self.writes()
+        pygs.update_sheet_with_df(changed, 'Data', key, mode='diff')
+        self.assertEqual(self.writes() - before, 1)
+        self.assertEqual(self.read(key)['name'].tolist(), changed['name'].tolist())
+
+    def test_removes_rows_below_shorter_data(self):
+        key = self.create(sample_frame(20))
+        pygs.update_sheet_with_df(sample_frame(8), 'Data', key, mode='diff')
+        self.assertEqual(len(self.read(key)), 8)
+
+    def test_datetimes_unchanged_without_a_fingerprint(self):
+        df = sample_frame(20)
+        df['when'] = pd.date_range('2024-01-01 10:00', periods=20, freq='37min')
+        key = self.create(df)
+        for row in self.fake.sheet(key, 'Data')['data'][1:]:
+            row[4] = as_serial(row[4])
+        # as in a fresh process, with nothing cached
+        pygs.invalidate_metadata_cache()
+        before = self.writes()
+        pygs.update_sheet_with_df(df, 'Data', key, mode='diff')
+        self.assertEqual(self.writes(), before)
+
+    def test_hand_edits_corrected_once_fingerprint_expires(self):
+        df = sample_frame(20)
+        key = self.create(df)
+        pygs.update_sheet_with_df(df, 'Data', key, mode='diff')
+        self.fake.sheet(key, 'Data')['data'][5][0] = 999
+        for fingerprint in pytools.fingerprint_cache.values():
+            fingerprint['time'] -= pytools.FINGERPRINT_TTL
+        pygs.update_sheet_with_df(df, 'Data', key, mode='diff')
+        self.assertEqual(self.fake.sheet(key, 'Data')['data'][5][0], 4)
+
+    def test_fingerprint_dropped_when_another_writer_stamps_the_sheet(self):
+        df = sample_frame(20)
+        key = self.create(df)
+        pygs.update_sheet_with_df(df, 'Data', key, mode='diff')
+        sheet = self.fake.sheet(key, 'Data')
+        sheet['data'][7][0] = 555
+        for item in sheet['developerMetadata']:
+            item['metadataValue'] = 'another writer'
+        pygs.update_sheet_with_df(df, 'Data', key, mode='diff')
+        self.assertEqual(sheet['data'][7][0], 6)
+
+
+class AppendTest(FakeServiceTestCase):
+
+    def fail_first(self, methodId, status, applied):
+        # the first `methodId` request fails with `status`, after it was applied or before
+        run = self.fake.run
+        state = {'failed': False}
+
+        def failing(request):
+            if request.methodId == methodId and not state['failed']:
+                state['failed'] = True
+                if applied:
+                    run(request)
+                raise self.fake.error(status, 'Simulated error')
+            return run(request)
+        self.fake.run = failing
+
+    def test_round_trip(self):
+        df = sample_frame(10)
+        key = self.create(df)
+        pygs.append_df_to_sheet(sample_frame(5), 'Data', key)
+        back = self.read(key)
+        self.assertEqual(back['id'].tolist(), list(range(10)) + list(range(5)))
+
+    def test_not_retried_on_server_error(self):
+        key = self.create(sample_frame(3))
+        self.fail_first('sheets.spreadsheets.values.append', 503, applied=True)
+        with self.assertRaises(errors.HttpError):
+            pygs.append_df_to_sheet(sample_frame(3), 'Data', key)
+        self.assertEqual(len(self.fake.sheet(key, 'Data')['data']), 7)
+
+    def test_retried_on_quota_error(self):
+        key = self.create(sample_frame(3))
+        # a 429 is returned before the append is applied
+        self.fail_first('sheets.spreadsheets.values.append', 429, applied=False)
+        pygs.append_df_to_sheet(sample_frame(3), 'Data', key)
+        self.assertEqual(len(self.fake.sheet(key, 'Data')['data']), 7)
+
+    def test_row_changes_not_retried_on_server_error(self):
+        key = self.create(sample_frame(3))
+        properties = pytools.get_sheet_properties(key, 'Data')
+        rows = properties['gridProperties']['rowCount']
+        self.fail_first('sheets.spreadsheets.batchUpdate', 503, applied=True)
+        with self.assertRaises(errors.HttpError):
+            pytools.batch_update(key, [{'appendDimension': {'sheetId': properties['sheetId'],
+                                                            'dimension': 'ROWS', 'length': 5}}])
+        self.assertEqual(self.fake.sheet(key, 'Data')['properties']['gridProperties']['rowCount'], rows + 5)
+
+    def test_resize_retried_on_server_error(self):
+        key = self.create(sample_frame(3))
+        properties = pytools.get_sheet_properties(key, 'Data')
+        self.fail_first('sheets.spreadsheets.batchUpdate', 503, applied=True)
+        pytools.batch_update(key, pytools.resize_requests(properties, rows=4))
+        self.assertEqual(self.fake.sheet(key, 'Data')['properties']['gridProperties']['rowCount'], 4)
+
+    def test_sheet_writer_queues_a_copy(self):
+        key = self.create(sample_frame(3))
+        writer = pygs.SheetWriter(flush_interval=60)
+        df = pd.DataFrame({'id': [7, 8]})
+        writer.replace(df, 'Data', key)
+        df['id'] = [0, 0]
+        writer.append(df, 'Data', key)
+        df.loc[0, 'id'] = 5
+        writer.close()
+        data = self.fake.sheet(key, 'Data')['data']
+        self.assertEqual([row[0] for row in data], ['id', 7, 8, 0, 0])
+
+
+class ShardTest(FakeServiceTestCase):
+
+    def test_round_trip_written_twice(self):
+        df = sample_frame(300)
+        home = pygs.write_sharded_df(df, 'big', max_cells=500)['spreadsheetId']
+        spreadsheets = set(self.fake.spreadsheets_by_id)
+        changed = df.copy()
+        changed['id'] += 1000
+        entry = pygs.write_sharded_df(changed, 'big', home, max_cells=500)['manifest']
+        # the same spreadsheets are reused, each holding a shard
+        self.assertEqual(set(self.fake.spreadsheets_by_id), spreadsheets)
+        self.assertEqual(set(shard['spreadsheetId'] for shard in entry['shards']), spreadsheets)
+        back = pygs.read_sharded_df(home, 'big', value_render_option='UNFORMATTED_VALUE')
+        self.assertEqual(back['id'].tolist(), changed['id'].tolist())
+        self.assertTrue(all(pygs.get_total_cells(key) <= 500 for key in spreadsheets))
+
+    def test_smaller_rewrite_removes_leftover_shards(self):
+        home = pygs.write_sharded_df(sample_frame(300), 'big', max_cells=500)['spreadsheetId']
+        entry = pygs.write_sharded_df(sample_frame(50), 'big', home, max_cells=500)['manifest']
+        self.assertEqual(len(entry['shards']), 1)
+        shard_tabs = [sheet['properties']['title'] for spreadsheet in self.fake.spreadsheets_by_id.values()
+                      for sheet in spreadsheet['sheets'] if sheet['properties']['title'] != pytools.MANIFEST_SHEET]
+        self.assertEqual(shard_tabs, [entry['shards'][0]['sheet_name']])
+        self.assertEqual(len(pygs.read_sharded_df(home, 'big')), 50)
+
+
+class WindowedReadTest(FakeServiceTestCase):
+
+    def test_windows_match_a_single_read(self):
+        key = self.create(sample_frame(53))
+        whole = self.read(key)
+        windowed = self.read(key, chunk_rows=7)
+        self.assertTrue(whole.equals(windowed))
+        self.assertEqual(len(windowed), 53)
+
+    def test_blank_rows_kept_in_place(self):
+        key = self.create(sample_frame(20))
+        data = self.fake.sheet(key, 'Data')['data']
+        data[7] = []
+        data[8] = []
+        back = self.read(key, chunk_rows=7)
+        self.assertEqual(len(back), 20)
+        self.assertEqual(back['id'].tolist()[8], 8)
+
+    def test_reads_rows_added_behind_cache(self):
+        key = self.create(sample_frame(10))
+        self.grow_behind_cache(key, 'Data', [[i, 0, 'extra', False] for i in range(10, 15)])
+        self.assertEqual(len(pytools.read_sheet_frame(key, 'Data', chunk_rows=4)), 15)
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_arrow_reads_rows_added_behind_cache(self):
+        from pygs import arrow_tools
+        key = self.create(sample_frame(10))
+        self.grow_behind_cache(key, 'Data', [[i, 0, 'extra', False] for i in range(10, 15)])
+        self.assertEqual(arrow_tools.read_sheet_table(key, 'Data').num_rows, 15)
+
+
+class QuotingTest(FakeServiceTestCase):
+
+    def test_quote(self):
+        self.assertEqual(ranges.quote('Sheet1'), 'Sheet1')
+        self.assertEqual(ranges.quote('Q1'), "'Q1'")
+        self.assertEqual(ranges.quote('AB12'), "'AB12'")
+        self.assertEqual(ranges.quote("My 'Sheet'"), "'My ''Sheet'''")
+        self.assertEqual(ranges.parse("'My ''Sheet'''!B2:D10"), ranges.GridRange("My 'Sheet'", 1, 1, 10, 4))
+
+    def test_read_google_sheets_quotes_sheet_names(self):
+        key = self.create(sample_frame(3), 'Q1')
+        pygs.create_tab_from_df(sample_frame(4), "My 'Sheet'", key)
+        sent = []
+        batch_get = pytools.batch_get
+
+        def recording(spreadsheetId, a1ranges, *args, **kwargs):
+            sent.extend(a1ranges)
+            return batch_get(spreadsheetId, a1ranges, *args, **kwargs)
+        pytools.batch_get = recording
+        try:
+            frames = pygs.read_google_sheets(key, ['Q1', "My 'Sheet'"])
+        finally:
+            pytools.batch_get = batch_get
+        self.assertEqual(sent, ["'Q1'", "'My ''Sheet'''"])
+        self.assertEqual(list(frames), ['Q1', "My 'Sheet'"])
+        self.assertEqual([len(frame) for frame in frames.values()], [3, 4])
+
+    def test_read_google_sheets_with_a1ranges(self):
+        key = self.create(sample_frame(10), 'Q1')
+        frames = pygs.read_google_sheets(key, a1ranges=["'Q1'!A1:B4", "'Q1'!C1:C3"])
+        self.assertEqual(list(frames), ["'Q1'!A1:B4", "'Q1'!C1:C3"])
+        self.assertEqual(list(frames["'Q1'!A1:B4"].columns), ['id', 'value'])
+        self.assertEqual(frames["'Q1'!C1:C3"]['name'].tolist(), ['row 0', 'row 1'])
+
+    def test_write_and_read_sheet_with_spaces(self):
+        key = self.create(sample_frame(5), 'My Data')
+        pygs.update_sheet_with_df(sample_frame(6), 'My Data', key)
+        self.assertEqual(len(self.read(key, 'My Data')), 6)
+
+
+class AioTest(FakeServiceTestCase):
+
+    def test_concurrent_tabs(self):
+        import asyncio
+        from pygs import aio
+        key = self.create(sample_frame(3))
+
+        async def write_and_read():
+            await asyncio.gather(*[aio.create_tab_from_df(sample_frame(rows), 'Tab %d' % rows, key)
+                                   for rows in (4, 5, 6)])
+            return await asyncio.gather(*[aio.read_google_sheet(key, 'Tab %d' % rows) for rows in (4, 5, 6)])
+        frames = asyncio.run(write_and_read())
+        self.assertEqual([len(frame) for frame in frames], [4, 5, 6])
+
+
+class MultiSheetTest(FakeServiceTestCase):
+
+    def test_replaces_and_creates_tabs_in_one_call(self):
+        key = self.create(sample_frame(10))
+        before = self.writes()
+        result = pygs.write_dfs_to_spreadsheet(key, {'Data': sample_frame(3), 'New': sample_frame(7)})
+        self.assertEqual(result['sheet_names'], {'Data': 'Data', 'New': 'New'})
+        # both tabs' data goes out in a single request
+        self.assertEqual(self.writes() - before, 1)
+        self.assertEqual(len(self.read(key, 'Data')), 3)
+        self.assertEqual(self.read(key, 'New')['id'].tolist(), list(range(7)))
+
+    def test_create_renames_taken_tabs(self):
+        key = self.create(sample_frame(10))
+        result = pygs.write_dfs_to_spreadsheet(key, {'Data': sample_frame(4)}, mode='create')
+        self.assertEqual(result['sheet_names'], {'Data': 'Data_1'})
+        self.assertEqual(len(self.read(key, 'Data')), 10)
+        self.assertEqual(len(self.read(key, 'Data_1')), 4)
+
+
+class InstrumentationTest(FakeServiceTestCase):
+
+    def setUp(self):
+        super(InstrumentationTest, self).setUp()
+        self.events = []
+        instrumentation.add_callback(self.events.append)
+        instrumentation.get_metrics(reset=True)
+
+    def tearDown(self):
+        instrumentation.remove_callback(self.events.append)
+        super(InstrumentationTest, self).tearDown()
+
+    def test_events_for_calls_requests_and_phases(self):
+        key = self.create(sample_frame(10))
+        names = [(event['kind'], event['name']) for event in self.events]
+        self.assertIn(('call', 'create_spreadsheet_from_df'), names)
+        self.assertIn(('phase', 'serialize'), names)
+        write = [event for event in self.events if event['name'] == 'sheets.spreadsheets.values.batchUpdate'][0]
+        self.assertEqual(write['kind'], 'request')
+        self.assertGreater(write['payload_bytes'], 0)
+        self.assertIsNone(write['error'])
+        metrics = instrumentation.get_metrics()
+        self.assertEqual(metrics[('call', 'create_spreadsheet_from_df')]['count'], 1)
+        self.read(key)
+        self.assertEqual(instrumentation.get_metrics()[('call', 'read_google_sheet')]['count'], 1)
+
+    def test_retries_and_errors_counted(self):
+        key = self.create(sample_frame(3))
+        run = self.fake.run
+        # two server errors, then a bad request
+        statuses = [503, 503, None, 400]
+
+        def failing(request):
+            if request.methodId == 'sheets.spreadsheets.values.get':
+                status = statuses.pop(0)
+                if status:
+                    raise self.fake.error(status, 'Simulated error')
+            return run(request)
+        self.fake.run = failing
+        self.read(key)
+        reads = [event for event in self.events if event['name'] == 'sheets.spreadsheets.values.get']
+        self.assertEqual(reads[-1]['retries'], 2)
+        with self.assertRaises(errors.HttpError):
+            self.read(key)
+        self.assertEqual(instrumentation.get_metrics()[('call', 'read_google_sheet')]['errors'], 1)
+
+    def test_broken_callback_does_not_break_the_call(self):
+        def broken(event):
+            raise RuntimeError('broken exporter')
+        instrumentation.add_callback(broken)
+        try:
+            key = self.create(sample_frame(3))
+        finally:
+            instrumentation.remove_callback(broken)
+        self.assertEqual(len(self.read(key)), 3)
+
+
+@unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+class ReadCacheTest(FakeServiceTestCase):
+
+    def setUp(self):
+        super(ReadCacheTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        pygs.configure_read_cache(self.directory, ttl=60)
+
+    def tearDown(self):
+        pygs.configure_read_cache(None)
+        shutil.rmtree(self.directory)
+        super(ReadCacheTest, self).tearDown()
+
+    def cached_read(self, key, **kwargs):
+        return pygs.read_google_sheet(key, 'Data', value_render_option='UNFORMATTED_VALUE', **kwargs)
+
+    def test_hit_reads_no_values(self):
+        key = self.create(sample_frame(20))
+        first = self.cached_read(key)
+        before = len(self.fake.requests)
+        second = self.cached_read(key)
+        self.assertTrue(first.equals(second))
+        # only the metadata request for the write stamp
+        self.assertEqual(self.fake.requests[before:], ['sheets.spreadsheets.get'])
+
+    def test_pygs_writes_invalidate_entries(self):
+        key = self.create(sample_frame(20))
+        self.cached_read(key)
+        pygs.update_sheet_with_df(sample_frame(5), 'Data', key)
+        self.assertEqual(len(self.cached_read(key)), 5)
+        pygs.append_df_to_sheet(sample_frame(2), 'Data', key)
+        self.assertEqual(len(self.cached_read(key)), 7)
+
+    def test_expired_entries_read_again(self):
+        key = self.create(sample_frame(20))
+        self.cached_read(key)
+        # an edit that doesn't change the write stamp is seen once the entry expires
+        self.fake.sheet(key, 'Data')['data'][1][2] = 'edited'
+        self.assertEqual(self.cached_read(key)['name'][0], 'row 0')
+        pygs.configure_read_cache(self.directory, ttl=0)
+        self.assertEqual(self.cached_read(key)['name'][0], 'edited')
+
+    def test_clear(self):
+        key = self.create(sample_frame(20))
+        self.cached_read(key)
+        self.assertTrue(os.listdir(self.directory))
+        pygs.clear_read_cache()
+        self.assertFalse(os.listdir(self.directory))
+
+
+class ColumnReadTest(FakeServiceTestCase):
+
+    def test_usecols_by_name_and_position(self):
+        key = self.create(sample_frame(10))
+        back = self.read(key, usecols=['name', 'id'])
+        self.assertEqual(list(back.columns), ['id', 'name'])
+        self.assertEqual(back['name'].tolist(), sample_frame(10)['name'].tolist())
+        self.assertEqual(list(self.read(key, usecols=[1]).columns), ['value'])
+        # the header, then only the columns asked for
+        self.assertEqual(self.fake.requests[-2:], ['sheets.spreadsheets.values.get',
+                                                   'sheets.spreadsheets.values.batchGet'])
+
+    def test_unknown_column(self):
+        key = self.create(sample_frame(10))
+        with self.assertRaises(ValueError):
+            self.read(key, usecols=['missing'])
+
+    def test_query(self):
+        key = self.create(sample_frame(10))
+        back = pygs.read_google_sheet(key, 'Data', query="select A, C where A >= 3 and C != 'row 5' limit 4",
+                                      dtype={'id': 'int64'}, cache=False)
+        self.assertEqual(list(back.columns), ['id', 'name'])
+        self.assertEqual(back['id'].tolist(), [3, 4, 6, 7])
+
+    def test_usecols_and_query_together(self):
+        key = self.create(sample_frame(10))
+        with self.assertRaises(ValueError):
+            self.read(key, usecols=['id'], query='select A')
+
+
+class ChangesTest(FakeServiceTestCase):
+
+    def changes(self, spreadsheetId, **kwargs):
+        return pygs.read_changes(spreadsheetId, 'Data', value_render_option='UNFORMATTED_VALUE', block_rows=10, **kwargs)
+
+    def test_positional_changes(self):
+        key = self.create(sample_frame(50))
+        first = self.changes(key)
+        self.assertEqual(len(first), 50)
+        self.assertEqual(set(first['_change']), set(['inserted']))
+        self.assertEqual(len(self.changes(key)), 0)
+        sheet = self.fake.sheet(key, 'Data')
+        sheet['data'][12][2] = 'edited'
+        sheet['data'].append([50, 0, 'new', True])
+        sheet['properties']['gridProperties']['rowCount'] += 1
+        changes = self.changes(key)
+        self.assertEqual(changes['_change'].to_dict(), {13: 'updated', 52: 'inserted'})
+        self.assertEqual(changes.loc[13, 'name'], 'edited')
+
+    def test_keyed_changes(self):
+        key = self.create(sample_frame(50))
+        self.changes(key, key='id')
+        sheet = self.fake.sheet(key, 'Data')
+        del sheet['data'][5]
+        sheet['data'][30][2] = 'edited'
+        changes = self.changes(key, key='id')
+        self.assertEqual(changes['_change'].tolist(), ['deleted', 'updated'])
+        self.assertEqual(changes['id'].tolist(), [4, 30])
+
+
+class CliTest(FakeServiceTestCase):
+
+    def setUp(self):
+        super(CliTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.df = pd.DataFrame({'id': np.arange(500), 'value': np.arange(500) / 2.0,
+                                'name': ['row %d' % i for i in range(500)]})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(CliTest, self).tearDown()
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def run_cli(self, *argv):
+        return cli.main(list(argv) + ['--quiet'])
+
+    def interrupt(self, module, name, after):
+        # the wrapped function raises on its call number `after`, then is put back
+        original = getattr(module, name)
+        calls = {'count': 0}
+
+        def failing(*args, **kwargs):
+            calls['count'] += 1
+            if calls['count'] == after:
+                raise RuntimeError('Simulated interruption')
+            return original(*args, **kwargs)
+        setattr(module, name, failing)
+        self.addCleanup(setattr, module, name, original)
+        return original
+
+    def test_push_resumes_from_checkpoint(self):
+        self.df.to_csv(self.path('in.csv'), index=False)
+        key = self.create(sample_frame(3))
+        checkpoint = self.path('push.json')
+        write_blocks = self.interrupt(pytools, 'write_blocks', 3)
+        with self.assertRaises(RuntimeError):
+            self.run_cli('push', self.path('in.csv'), '--spreadsheet-id', key, '--sheet', 'Data',
+                         '--chunk-rows', '100', '--checkpoint', checkpoint)
+        with open(checkpoint) as saved:
+            self.assertEqual(json.load(saved)['rows_done'], 200)
+        pytools.write_blocks = write_blocks
+        sent = self.writes()
+        self.assertEqual(self.run_cli('push', self.path('in.csv'), '--spreadsheet-id', key, '--sheet', 'Data',
+                                      '--chunk-rows', '100', '--checkpoint', checkpoint), 0)
+        # only the three chunks left are sent again
+        self.assertEqual(self.writes() - sent, 3)
+        self.assertFalse(os.path.exists(checkpoint))
+        back = self.read(key)
+        self.assertEqual(back['id'].tolist(), self.df['id'].tolist())
+        self.assertEqual(back['value'].tolist(), self.df['value'].tolist())
+
+    def test_pull_resumes_from_checkpoint(self):
+        key = self.create(self.df)
+        checkpoint = self.path('pull.json')
+        iter_sheet_windows = pytools.iter_sheet_windows
+
+        def interrupted(*args, **kwargs):
+            for number, window in enumerate(iter_sheet_windows(*args, **kwargs)):
+                if number == 2:
+                    raise RuntimeError('Simulated interruption')
+                yield window
+        pytools.iter_sheet_windows = interrupted
+        try:
+            with self.assertRaises(RuntimeError):
+                self.run_cli('pull', key, self.path('out.csv'), '--chunk-rows', '100', '--checkpoint', checkpoint)
+        finally:
+            pytools.iter_sheet_windows = iter_sheet_windows
+        with open(checkpoint) as saved:
+            self.assertEqual(json.load(saved)['rows_done'], 200)
+        # a partly written row after the last checkpoint is dropped
+        with open(self.path('out.csv'), 'a') as output:
+            output.write('999,partial')
+        self.assertEqual(self.run_cli('pull', key, self.path('out.csv'), '--chunk-rows', '100',
+                                      '--checkpoint', checkpoint), 0)
+        back = pd.read_csv(self.path('out.csv'))
+        self.assertEqual(back['id'].tolist(), self.df['id'].tolist())
+        self.assertEqual(back['name'].tolist(), self.df['name'].tolist())
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_parquet_round_trip(self):
+        self.df.to_parquet(self.path('in.parquet'))
+        key = self.create(sample_frame(3))
+        self.run_cli('push', self.path('in.parquet'), '--spreadsheet-id', key, '--sheet', 'New', '--chunk-rows', '150')
+        self.assertEqual(self.read(key, 'New')['id'].tolist(), self.df['id'].tolist())
+        self.run_cli('pull', key, self.path('out.parquet'), '--sheet', 'New', '--chunk-rows', '150')
+        back = pd.read_parquet(self.path('out.parquet'))
+        self.assertEqual(list(back.columns), list(self.df.columns))
+        self.assertEqual(len(back), 500)
+        self.assertEqual(back['name'].tolist(), self.df['name'].tolist())
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow is not installed')
+    def test_parquet_pull_types_columns(self):
+        key = self.create(self.df)
+        data = self.fake.sheet(key, 'Data')['data']
+        # a column of ints with a float in a later window, and one with a single value late on
+        for row in data[1:]:
+            row.append('')
+        data[0].append('late')
+        data[400][0] = 399.5
+        data[450][3] = True
+        self.run_cli('pull', key, self.path('typed.parquet'), '--chunk-rows', '100',
+                     '--value-render-option', 'UNFORMATTED_VALUE')
+        back = pyarrow.parquet.read_table(self.path('typed.parquet'))
+        self.assertEqual([str(field.type) for field in back.schema], ['double', 'double', 'string', 'string'])
+        self.assertEqual(back.column('id').to_pylist()[398:400], [398.0, 399.5])
+        whole = pygs.read_google_sheet(key, 'Data', output='arrow', value_render_option='UNFORMATTED_VALUE',
+                                       cache=False)
+        self.assertEqual(back.schema, whole.schema)
+        # formatted values are strings, as in read_google_sheet
+        self.run_cli('pull', key, self.path('text.parquet'), '--chunk-rows', '100')
+        back = pyarrow.parquet.read_table(self.path('text.parquet'))
+        self.assertEqual(set(str(field.type) for field in back.schema), set(['string']))
+
+    def test_missing_file(self):
+        self.assertNotEqual(self.run_cli('push', self.path('missing.csv')), 0)
+
+
+class RangesTest(unittest.TestCase):
+
+    def test_split_keeps_under_max_cells(self):
+        grid_range = ranges.GridRange('s', 0, 0, 10, 4)
+        pieces = ranges.split(grid_range, 12)
+        self.assertTrue(all(rows * cols <= 12 for rows, cols in map(ranges.size, pieces)))
+        self.assertEqual(ranges.union(pieces), [grid_range])
+        # rows wider than max_cells are split across columns too
+        wide = ranges.GridRange('s', 0, 0, 2, 30)
+        pieces = ranges.split(wide, 12)
+        self.assertEqual(len(pieces), 6)
+        self.assertEqual(ranges.union(pieces), [wide])
+
+    def test_split_rows(self):
+        pieces = ranges.split_rows(ranges.GridRange('s', 1, 0, 25), 10)
+        self.assertEqual([(piece.start_row, piece.end_row) for piece in pieces], [(1, 11), (11, 21), (21, 25)])
+
+    def test_union(self):
+        G = ranges.GridRange
+        self.assertEqual(ranges.union([G('s', 0, 0, 10, 5), G('s', 20, 0, 30, 5), G('s', 10, 0, 20, 5)]),
+                         [G('s', 0, 0, 30, 5)])
+        self.assertEqual(ranges.union([G('s', 0, 0, 10, 5), G('s', 0, 5, 10, 8), G('t', 0, 0, 1, 1)]),
+                         [G('s', 0, 0, 10, 8), G('t', 0, 0, 1, 1)])
+        # ranges that neither touch nor line up stay apart
+        self.assertEqual(len(ranges.union([G('s', 0, 0, 10, 5), G('s', 12, 0, 20, 5)])), 2)
+
+    def test_intersect(self):
+        G = ranges.GridRange
+        self.assertEqual(ranges.intersect(G('s', 0, 0, 10, 5), G('s', 5, 3, None, None)), G('s', 5, 3, 10, 5))
+        self.assertIsNone(ranges.intersect(G('s', 0, 0, 10, 5), G('s', 10, 0, 20, 5)))
+        self.assertIsNone(ranges.intersect(G('s', 0, 0, 10, 5), G('t', 0, 0, 10, 5)))
+
+    def test_column_letters(self):
+        for index, letters in ((0, 'A'), (25, 'Z'), (26, 'AA'), (701, 'ZZ'), (702, 'AAA')):
+            self.assertEqual(ranges.column_letter(index), letters)
+            self.assertEqual(ranges.column_index(letters), index)
+        with self.assertRaises(ValueError):
+            ranges.column_letter(18278)
+
+    def test_a1_round_trip(self):
+        for a1range in ("'My Sheet'!B2:D10", 'Sheet1', "'a!b'!A1", 'Data!A:C', 'Data!2:10', 'Data!A5:C'):
+            grid_range = ranges.parse(a1range)
+            self.assertEqual(ranges.parse(ranges.to_a1(grid_range)), grid_range)
+
+
+class DiscoveryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ['HOME'] = self.home
+        self.request = httplib2.Http.request
+
+    def tearDown(self):
+        httplib2.Http.request = self.request
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.home)
+
+    def offline(self, http, *args, **kwargs):
+        self.assertEqual(http.timeout, init_service.DISCOVERY_TIMEOUT)
+        raise socket.timeout('timed out')
+
+    def test_bundled_copy_without_network_or_cache(self):
+        httplib2.Http.request = lambda http, *args, **kwargs: self.offline(http)
+        document = json.loads(init_service.get_discovery_document())
+        self.assertEqual((document['name'], document['version']), ('sheets', 'v4'))
+
+    def test_stale_copy_preferred_to_bundled_one(self):
+        cache_path = os.path.join(self.home, '.credentials', 'sheets.googleapis.com-v4-discovery.json')
+        os.makedirs(os.path.dirname(cache_path))
+        with open(cache_path, 'w') as cache_file:
+            cache_file.write('{"name": "sheets", "version": "stale"}')
+        os.utime(cache_path, (0, 0))
+        httplib2.Http.request = lambda http, *args, **kwargs: self.offline(http)
+        self.assertEqual(json.loads(init_service.get_discovery_document())['version'], 'stale')
+
+
+if __name__ == '__main__':
+    unittest.main()